@@ -0,0 +1,96 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, NamedTuple
+import asyncio
+import functools
+import threading
+
+from BatchControl import BatchControl
+from FileOperation import CPDIR_LARGE_FILE_SIZE, CPDIR_WORKERS, FileOperation
+
+
+class Progress(NamedTuple):
+    commandsDone: int
+    commandsTotal: int
+    filesCopied: int
+    bytesCopied: int
+
+
+class BatchCancelled(asyncio.CancelledError):
+    # the awaiting task was cancelled. The work stopped between commands(files for cpdir), recoverList is
+    # what the call would have returned and undoes what was done before it stopped
+    def __init__(self, recoverList: FileOperation.BATCH_COMMAND_LIST_TYPE):
+        super().__init__()
+        self.recoverList = recoverList
+
+
+class AsyncFileOperation:
+    # asyncio front-end: the filesystem work runs on a bounded thread pool, the event loop only awaits it.
+    # progress is called on the event loop thread; updates coming faster than the loop runs are coalesced.
+    # Cancel either the awaiting task(BatchCancelled is raised) or the BatchControl passed in(the call returns).
+    def __init__(self, maxBatches: int = 2):
+        self._executor = ThreadPoolExecutor(max_workers=maxBatches, thread_name_prefix="AsyncFileOperation")
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    async def __aenter__(self) -> "AsyncFileOperation":
+        return self
+
+    async def __aexit__(self, *excInfo) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    async def execute(self, aBatch: FileOperation.BATCH_COMMAND_LIST_TYPE, progress: Callable[[Progress], None] = None,
+                      control: BatchControl = None, **executerKwargs) -> tuple[bool, FileOperation.BATCH_COMMAND_LIST_TYPE]:
+        # executerKwargs: srcCommand, maxWorkers, journal, statCache of FileOperation.executer
+        control = control or BatchControl()
+        func = functools.partial(FileOperation.executer, aBatch, control=control, **executerKwargs)
+        return await self._run(func, len(aBatch), progress, control)
+
+    async def cpdir(self, pre: str, rel: str, to: str, progress: Callable[[Progress], None] = None,
+                    control: BatchControl = None, maxWorkers: int = CPDIR_WORKERS,
+                    largeFileSize: int = CPDIR_LARGE_FILE_SIZE) -> FileOperation.RETURN_TYPE:
+        control = control or BatchControl()
+        func = functools.partial(control.call, FileOperation.cpdir, pre, rel, to, maxWorkers=maxWorkers,
+                                 largeFileSize=largeFileSize)
+        return await self._run(func, 1, progress, control)
+
+    async def _run(self, func: Callable, commandsTotal: int, progress: Callable[[Progress], None] | None,
+                   control: BatchControl) -> tuple:
+        loop = asyncio.get_running_loop()
+        if progress is not None:
+            control.onProgress = self._progressForwarder(loop, commandsTotal, progress)
+        future = loop.run_in_executor(self._executor, func)
+        try:
+            ret = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            control.cancel()
+            ret = await future  # the running command finishes its current file first
+            raise BatchCancelled(ret[1])
+        if progress is not None:
+            progress(AsyncFileOperation._snapshot(control, commandsTotal))
+        return ret
+
+    @staticmethod
+    def _snapshot(control: BatchControl, commandsTotal: int) -> Progress:
+        return Progress(control.commandsDone, commandsTotal, control.filesCopied, control.bytesCopied)
+
+    @staticmethod
+    def _progressForwarder(loop: asyncio.AbstractEventLoop, commandsTotal: int,
+                           progress: Callable[[Progress], None]) -> Callable[[BatchControl], None]:
+        lock = threading.Lock()
+        scheduled = False
+
+        def deliver(control: BatchControl) -> None:
+            nonlocal scheduled
+            with lock:
+                scheduled = False
+            progress(AsyncFileOperation._snapshot(control, commandsTotal))
+
+        def onProgress(control: BatchControl) -> None:
+            nonlocal scheduled
+            with lock:
+                if scheduled:
+                    return
+                scheduled = True
+            loop.call_soon_threadsafe(deliver, control)
+        return onProgress
@@ -0,0 +1,59 @@
+from typing import Any, Callable
+import threading
+
+
+class BatchControl:
+    # Cancellation and progress of one running batch, shared by every thread working on it.
+    # Cancellation is cooperative: commands not started yet return ErrorCode.CANCELLED, and cpdir stops
+    # between files, so the recover list only holds what really happened.
+    _local = threading.local()
+
+    def __init__(self, onProgress: Callable[["BatchControl"], None] = None):
+        self.onProgress = onProgress  # called from worker threads after each command and each copied file
+        self.commandsDone = 0
+        self.filesCopied = 0
+        self.bytesCopied = 0
+        self._cancelEvent = threading.Event()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def current() -> "BatchControl | None":
+        return getattr(BatchControl._local, "control", None)
+
+    def cancel(self) -> None:
+        self._cancelEvent.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelEvent.is_set()
+
+    def call(self, func: Callable, *args, **kwargs) -> Any:
+        # func(*args, **kwargs) with this control active in the calling thread
+        BatchControl._local.control = self
+        try:
+            return func(*args, **kwargs)
+        finally:
+            BatchControl._local.control = None
+
+    def bound(self, run: Callable[[tuple], tuple], cancelledRet: tuple) -> Callable[[tuple], tuple]:
+        # cancelledRet: what a command that never started returns
+        def controlled(cmds: tuple) -> tuple:
+            if self.cancelled and cmds:
+                return cancelledRet
+            ret = self.call(run, cmds)
+            if cmds:
+                with self._lock:
+                    self.commandsDone += 1
+                self._notify()
+            return ret
+        return controlled
+
+    def fileCopied(self, nBytes: int) -> None:
+        with self._lock:
+            self.filesCopied += 1
+            self.bytesCopied += nBytes
+        self._notify()
+
+    def _notify(self) -> None:
+        if self.onProgress is not None:
+            self.onProgress(self)
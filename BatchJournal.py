@@ -0,0 +1,223 @@
+from typing import Callable, NamedTuple
+import json
+import threading
+import time
+
+import os
+
+
+class JournalState(NamedTuple):
+    complete: bool  # every batch in the journal reached its end record
+    recoverList: list[tuple]  # recover commands of unfinished batches, already in undo order
+    uncertain: list[tuple]  # commands with an intent but no outcome: they may be partially applied
+    pendingBatches: list[int]  # batches without end record
+
+
+class RollbackResult(NamedTuple):
+    ok: bool  # executer's result of the undo
+    recoverList: list[tuple]
+    uncertain: list[tuple]  # see JournalState, only their checkpointed steps were undone
+
+
+class BatchJournal:
+    # Append-only JSON-lines journal of executer batches:
+    #   {"t": "begin", "b": batch, "n": count}
+    #   {"t": "intent", "b": batch, "s": seq, "c": command}                  before a command runs
+    #   {"t": "progress", "b": batch, "s": seq, "r": recover commands}       a step of a multi-file command, see Checkpoint
+    #   {"t": "outcome", "b": batch, "s": seq, "e": ErrorCode name, "r": recover commands}
+    #   {"t": "end", "b": batch, "ok": bool}                                    after the batch, or its rollback
+    # Command args that are not JSON(e.g., the CopyStats of a cpdir) are recorded as "<TypeName>".
+    # Records are group committed: fsync after syncEvery records or syncIntervalMs, whichever comes first,
+    # so a crash loses at most that window; end records are always synced.
+    _local = threading.local()
+
+    def __init__(self, path: str, syncEvery: int = 256, syncIntervalMs: float = 50):
+        self.path = path
+        self.syncEvery = syncEvery
+        self.syncInterval = syncIntervalMs / 1000
+        self._file = open(path, "ab")
+        if self._file.tell() and not BatchJournal._EndsWithNewline(path):
+            self._file.write(b"\n")  # terminate a torn tail so it can't swallow our first record
+        self._lock = threading.Lock()
+        self._batch = BatchJournal._LastBatchNo(path)
+        self._seq = 0
+        self._unsynced = 0
+        self._lastSync = time.monotonic()
+        # overhead counters
+        self.records = 0
+        self.syncs = 0
+        self.bytesWritten = 0
+        self.seconds = 0.0  # time spent inside the journal, sync included
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flushLoop, name="BatchJournalFlusher", daemon=True)
+        self._flusher.start()
+
+    @staticmethod
+    def _LastBatchNo(path: str) -> int:
+        batchNo = 0
+        for record in BatchJournal._ReadRecords(path):
+            batchNo = max(batchNo, record.get("b", 0))
+        return batchNo
+
+    @staticmethod
+    def _EndsWithNewline(path: str) -> bool:
+        with open(path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    @staticmethod
+    def _ReadRecords(path: str):
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:  # torn tail of a crashed write
+                    continue
+
+    @staticmethod
+    def _Placeholder(arg) -> str:
+        # json default for args that are not JSON, e.g., the CopyStats of a cpdir: recorded by type name only
+        return f"<{type(arg).__name__}>"
+
+    def _sync(self) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.syncs += 1
+        self._unsynced = 0
+        self._lastSync = time.monotonic()
+
+    def _write(self, record: dict, sync: bool = False) -> None:
+        start = time.perf_counter()
+        line = json.dumps(record, separators=(",", ":"), default=BatchJournal._Placeholder).encode("utf-8") + b"\n"
+        with self._lock:
+            self._file.write(line)
+            self.records += 1
+            self.bytesWritten += len(line)
+            self._unsynced += 1
+            if sync or self._unsynced >= self.syncEvery or time.monotonic() - self._lastSync >= self.syncInterval:
+                self._sync()
+            self.seconds += time.perf_counter() - start
+
+    def _flushLoop(self) -> None:
+        # an idle journal still gets its tail synced within syncIntervalMs, e.g., while one long cpdir runs
+        while not self._closed.wait(self.syncInterval):
+            with self._lock:
+                if self._unsynced:
+                    start = time.perf_counter()
+                    self._sync()
+                    self.seconds += time.perf_counter() - start
+
+    def begin(self, count: int) -> None:
+        self._batch += 1
+        self._write({"t": "begin", "b": self._batch, "n": count})
+
+    def intent(self, cmds: tuple) -> int:
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+        self._write({"t": "intent", "b": self._batch, "s": seq, "c": list(cmds)})
+        return seq
+
+    def outcome(self, seq: int, ret, recover: list[tuple]) -> None:
+        self._write({"t": "outcome", "b": self._batch, "s": seq, "e": ret.name, "r": [list(c) for c in recover]})
+
+    def progress(self, seq: int, recover: list[tuple]) -> None:
+        self._write({"t": "progress", "b": self._batch, "s": seq, "r": [list(c) for c in recover]})
+
+    @staticmethod
+    def Checkpoint() -> Callable[[list[tuple]], None]:
+        # A multi-file command(cpdir, syncdir, the glob verbs) calls it with the recover of every step it completed,
+        # from any thread, so the rollback of an interrupted run undoes those steps. It logs progress records of the
+        # journaled command running in the calling thread, and does nothing when there is none
+        current = getattr(BatchJournal._local, "command", None)
+        if current is None:
+            return lambda recover: None
+        journal, seq = current
+        return lambda recover: journal.progress(seq, recover) if recover else None
+
+    def end(self, ok: bool) -> None:
+        self._write({"t": "end", "b": self._batch, "ok": ok}, sync=True)
+
+    def wrap(self, run: Callable[[tuple], tuple]) -> Callable[[tuple], tuple]:
+        def journaled(cmds: tuple) -> tuple:
+            if not cmds:
+                return run(cmds)
+            seq = self.intent(cmds)
+            outer = getattr(BatchJournal._local, "command", None)
+            BatchJournal._local.command = (self, seq)
+            try:
+                ret, recover = run(cmds)
+            finally:
+                BatchJournal._local.command = outer
+            self.outcome(seq, ret, recover)
+            return ret, recover
+        return journaled
+
+    def close(self) -> None:
+        self._closed.set()
+        self._flusher.join()
+        with self._lock:
+            if not self._file.closed:
+                self._sync()
+                self._file.close()
+
+    def __enter__(self) -> "BatchJournal":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    @staticmethod
+    def ReadJournal(path: str) -> JournalState:
+        begun: set[int] = set()
+        ended: set[int] = set()
+        intents: dict[tuple[int, int], tuple] = dict()
+        outcomes: dict[tuple[int, int], list[tuple]] = dict()
+        progress: dict[tuple[int, int], list[tuple]] = dict()
+        for record in BatchJournal._ReadRecords(path):
+            t, b = record.get("t"), record.get("b")
+            if t == "begin":
+                begun.add(b)
+            elif t == "end":
+                ended.add(b)
+            elif t == "intent":
+                intents[(b, record["s"])] = tuple(record["c"])
+            elif t == "outcome":
+                outcomes[(b, record["s"])] = [tuple(c) for c in record["r"]]
+            elif t == "progress":
+                progress.setdefault((b, record["s"]), list()).extend(tuple(c) for c in record["r"])
+        recoverList: list[tuple] = list()
+        uncertain: list[tuple] = list()
+        for key in sorted(intents):  # batch then seq: the order commands started in
+            if key[0] in ended:
+                continue
+            if key in outcomes:
+                recoverList += outcomes[key]
+            else:  # its checkpointed steps are undone, what it did after the last one is unknown
+                recoverList += progress.get(key, list())
+                uncertain.append(intents[key])
+        recoverList.reverse()
+        pendingBatches = sorted(begun - ended)
+        return JournalState(not pendingBatches, recoverList, uncertain, pendingBatches)
+
+    @staticmethod
+    def rollback(path: str) -> RollbackResult:
+        # Undo every batch which has no end record, e.g., after the process died halfway.
+        # Returns executer's result of the undo and the uncertain commands, which the caller has to look at: they may
+        # have changed more than their checkpoints tell. Batches rolled back are ended so a second call does nothing.
+        state = BatchJournal.ReadJournal(path)
+        if state.complete:
+            return RollbackResult(True, list(), list())
+        from FileOperation import FileOperation
+        ok, recover = FileOperation.executer(state.recoverList)
+        with open(path, "ab") as f:
+            if f.tell() and not BatchJournal._EndsWithNewline(path):
+                f.write(b"\n")
+            for b in state.pendingBatches:
+                f.write(json.dumps({"t": "end", "b": b, "ok": False, "rolledBack": True},
+                                   separators=(",", ":")).encode("utf-8") + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        return RollbackResult(ok, recover, state.uncertain)
@@ -0,0 +1,265 @@
+from typing import NamedTuple
+
+import os
+
+from BatchPlanner import BatchPlanner
+from BatchScheduler import BatchScheduler
+from FileOperation import FileOperation
+
+OPTIMIZER_WINDOW = 256  # commands looked ahead for the partner of a command(rmfile of a touch, next rename of a chain)
+
+
+class Rewrite(NamedTuple):
+    rule: str
+    indices: tuple[int, ...]  # indices in the original batch of the commands rewritten
+    replacement: tuple | None  # the command standing for them, None when they were dropped
+
+
+class OptimizedBatch(NamedTuple):
+    batch: FileOperation.BATCH_COMMAND_LIST_TYPE
+    rewrites: list[Rewrite]
+
+    @property
+    def eliminated(self) -> int:
+        # commands less than in the original batch
+        return sum(len(r.indices) - (r.replacement is not None) for r in self.rewrites)
+
+
+class BatchOptimizer:
+    # Rewrites a batch into an equivalent cheaper one before executer runs it. The batch is walked with a
+    # BatchPlanner, so every rule only fires when the state the commands would meet makes the rewrite exact:
+    #   NOOP:           a command with nothing to do, e.g., touch of an existing file, rmfile of an absent one
+    #   TOUCH_REMOVED:  touch x ... rmfile x, when x's parent exists and nothing in between touches x
+    #   MKPATH_IMPLIED: mkpath p when the next command on p creates p anyway(touch/cpfile/rename into p)
+    #   RENAME_CHAIN:   rename a->b ... rename b->c becomes rename a->c, a->b->a is dropped
+    #   COPY_MERGE:     consecutive cpfile from pre to `to` covering every file of pre/d becomes cpdir(pre, d, to)
+    # The end state and the effect of the recover list are the same as the original batch's when every command
+    # succeeds. Optimize right before executing: the planner reads the real tree as it is now.
+    NOOP = "noop"
+    TOUCH_REMOVED = "touchRemoved"
+    MKPATH_IMPLIED = "mkpathImplied"
+    RENAME_CHAIN = "renameChain"
+    COPY_MERGE = "copyMerge"
+
+    def __init__(self, aBatch: FileOperation.BATCH_COMMAND_LIST_TYPE):
+        self._cmds: list[tuple | None] = [tuple(cmds) for cmds in aBatch]  # None: dropped
+        self._origins: list[tuple[int, ...]] = [(ind,) for ind in range(len(aBatch))]
+        self._paths: dict[int, list[str] | None] = dict()
+        self._done: list[list[str] | None] = list()  # paths of the commands already simulated
+        self._planner = BatchPlanner()
+        self._examined: set[int] = set()  # cpfile already looked at as a part of some run
+        self.rewrites: list[Rewrite] = list()
+
+    @staticmethod
+    def optimize(aBatch: FileOperation.BATCH_COMMAND_LIST_TYPE) -> OptimizedBatch:
+        optimizer = BatchOptimizer(aBatch)
+        optimizer._run()
+        return OptimizedBatch([cmds for cmds in optimizer._cmds if cmds is not None], optimizer.rewrites)
+
+    # ---- paths and conflicts, see BatchScheduler ----
+
+    @staticmethod
+    def _Related(a: str, b: str) -> bool:
+        # the same path, or one is inside the other
+        return a == b or a.startswith(b.rstrip(os.sep) + os.sep) or b.startswith(a.rstrip(os.sep) + os.sep)
+
+    @staticmethod
+    def _Conflict(pthsA: list[str] | None, pthsB: list[str] | None) -> bool:
+        if pthsA is None or pthsB is None:
+            return True
+        return any(BatchOptimizer._Related(a, b) for a in pthsA for b in pthsB)
+
+    def _pathsAt(self, ind: int) -> list[str] | None:
+        if ind not in self._paths:
+            self._paths[ind] = BatchScheduler.touchedPaths(self._cmds[ind])
+        return self._paths[ind]
+
+    def _next(self, ind: int, pths: list[str]) -> int | None:
+        # the first command after ind conflicting with pths, None when there is none within the window
+        for j in range(ind + 1, min(len(self._cmds), ind + 1 + OPTIMIZER_WINDOW)):
+            if self._cmds[j] and BatchOptimizer._Conflict(pths, self._pathsAt(j)):
+                return j
+        return None
+
+    def _quiet(self, ind: int, j: int, pths: list[str]) -> bool:
+        # no command between ind and j touches pths
+        return not any(self._cmds[k] and BatchOptimizer._Conflict(pths, self._pathsAt(k)) for k in range(ind + 1, j))
+
+    def _replace(self, rule: str, ind: int, replacement: tuple | None, *dropped: int) -> None:
+        origins = tuple(sorted(sum((self._origins[k] for k in (ind,) + dropped), ())))
+        self.rewrites.append(Rewrite(rule, origins, replacement))
+        self._cmds[ind] = replacement
+        self._origins[ind] = origins
+        self._paths.pop(ind, None)
+        for k in dropped:
+            self._cmds[k] = None
+
+    # ---- walk ----
+
+    def _run(self) -> None:
+        rules = (self._noop, self._touchRemoved, self._mkpathImplied, self._renameChain, self._copyMerge)
+        for ind in range(len(self._cmds)):
+            while self._cmds[ind] and any(rule(ind) for rule in rules):
+                pass  # a rewritten command may be rewritten again, e.g., the next rename of a chain
+            if self._cmds[ind]:
+                self._planner.simulate(self._cmds[ind])
+                self._done.append(self._pathsAt(ind))
+
+    def _kind(self, pre: str, rel: str = "") -> str:
+        return self._planner.kind(BatchPlanner.AbsFilePath(pre, rel) if rel else pre)
+
+    def _noop(self, ind: int) -> bool:
+        cmds = self._cmds[ind]
+        k, vals = cmds[0], cmds[1:]
+        if len(vals) < 2 or k not in ("touch", "mkpath", "rmfile", "rmdir", "rmpath", "moveToTrash", "stageDelete"):
+            return False
+        kind = self._kind(vals[0], vals[1])
+        if k in ("touch", "mkpath"):  # an existing path is left as it is, even a file for mkpath
+            noop = self._kind(vals[0]) == BatchPlanner.DIR and kind != BatchPlanner.ABSENT
+        elif k in ("rmdir", "rmpath"):
+            noop = kind != BatchPlanner.DIR
+        else:
+            noop = kind == BatchPlanner.ABSENT
+        if noop:
+            self._replace(BatchOptimizer.NOOP, ind, None)
+        return noop
+
+    def _touchRemoved(self, ind: int) -> bool:
+        cmds = self._cmds[ind]
+        if cmds[0] != "touch" or len(cmds) != 3:
+            return False
+        pth = BatchScheduler.AbsPath(cmds[1], cmds[2])
+        if self._kind(cmds[1]) != BatchPlanner.DIR or self._kind(pth) != BatchPlanner.ABSENT or \
+                self._kind(os.path.dirname(pth)) != BatchPlanner.DIR:
+            return False
+        j = self._next(ind, [pth])
+        if j is None or self._cmds[j][0] != "rmfile" or len(self._cmds[j]) != 3 or \
+                BatchScheduler.AbsPath(*self._cmds[j][1:]) != pth:
+            return False
+        self._replace(BatchOptimizer.TOUCH_REMOVED, ind, None, j)
+        return True
+
+    def _mkpathImplied(self, ind: int) -> bool:
+        cmds = self._cmds[ind]
+        if cmds[0] != "mkpath" or len(cmds) != 3:
+            return False
+        pth = BatchScheduler.AbsPath(cmds[1], cmds[2])
+        if self._kind(cmds[1]) != BatchPlanner.DIR or self._kind(pth) != BatchPlanner.ABSENT:
+            return False
+        j = self._next(ind, [pth])
+        if j is None or not self._quiet(ind, j, self._pathsAt(j)):
+            return False
+        creator = self._cmds[j]
+        k, vals = creator[0], creator[1:]
+        inside = lambda p: p.startswith(pth + os.sep)  # noqa: E731
+        if k == "touch" and len(vals) == 2:  # touch needs pre, it makes the rest of the parents
+            pre = BatchScheduler.AbsPath(vals[0], "")
+            ok = inside(BatchScheduler.AbsPath(*vals)) and pre != pth and not inside(pre) and \
+                self._kind(pre) == BatchPlanner.DIR
+        elif k == "cpfile" and len(vals) >= 3:  # cpfile needs to
+            to = BatchScheduler.AbsPath(vals[2], "")
+            ok = inside(BatchScheduler.AbsPath(vals[2], vals[1])) and to != pth and not inside(to) and \
+                self._kind(to) == BatchPlanner.DIR and self._kind(vals[0], vals[1]) == BatchPlanner.FILE
+        elif k == "rename" and len(vals) == 4:
+            src = BatchScheduler.AbsPath(vals[0], vals[1])
+            ok = inside(BatchScheduler.AbsPath(vals[2], vals[3])) and not BatchOptimizer._Related(src, pth) and \
+                self._kind(src) != BatchPlanner.ABSENT
+        else:
+            ok = False
+        if ok:
+            self._replace(BatchOptimizer.MKPATH_IMPLIED, ind, None)
+        return ok
+
+    def _renameChain(self, ind: int) -> bool:
+        cmds = self._cmds[ind]
+        if cmds[0] != "rename" or len(cmds) != 5:
+            return False
+        a, b = BatchScheduler.AbsPath(cmds[1], cmds[2]), BatchScheduler.AbsPath(cmds[3], cmds[4])
+        if BatchOptimizer._Related(a, b) or self._kind(a) == BatchPlanner.ABSENT or \
+                self._kind(b) != BatchPlanner.ABSENT or self._kind(os.path.dirname(b)) != BatchPlanner.DIR:
+            return False
+        j = self._next(ind, [a, b])
+        nextCmds = self._cmds[j] if j is not None else ()
+        if len(nextCmds) != 5 or nextCmds[0] != "rename" or BatchScheduler.AbsPath(nextCmds[1], nextCmds[2]) != b:
+            return False
+        c = BatchScheduler.AbsPath(nextCmds[3], nextCmds[4])
+        if c == a:  # there and back
+            self._replace(BatchOptimizer.RENAME_CHAIN, ind, None, j)
+            return True
+        if BatchOptimizer._Related(c, a) or BatchOptimizer._Related(c, b) or not self._quiet(ind, j, [c]) or \
+                self._kind(c) != BatchPlanner.ABSENT:
+            return False
+        self._replace(BatchOptimizer.RENAME_CHAIN, ind, ("rename", cmds[1], cmds[2], nextCmds[3], nextCmds[4]), j)
+        return True
+
+    def _copyMerge(self, ind: int) -> bool:
+        # at the first cpfile of a run of cpfile with the same pre and to, each top dir of pre whose files are all
+        # in the run becomes one cpdir
+        cmds = self._cmds[ind]
+        if cmds[0] != "cpfile" or len(cmds) != 4 or ind in self._examined:
+            return False
+        pre, to = cmds[1], cmds[3]
+        run: list[int] = list()
+        for j in range(ind, len(self._cmds)):
+            if self._cmds[j] is None:
+                continue
+            c = self._cmds[j]
+            if len(c) != 4 or c[0] != "cpfile" or c[1] != pre or c[3] != to:
+                break
+            run.append(j)
+        self._examined.update(run)
+        groups: dict[str, list[int]] = dict()
+        for j in run:
+            rel = self._cmds[j][2].replace("\\", "/")
+            topDir = rel.split("/", 1)[0]
+            if "/" in rel and not os.path.isabs(rel) and topDir not in ("", ".", ".."):
+                groups.setdefault(topDir, list()).append(j)
+        merged = False
+        for topDir, members in groups.items():
+            if len(members) < 2 or not self._mergeable(pre, topDir, to, members, run):
+                continue
+            self._replace(BatchOptimizer.COPY_MERGE, members[0], ("cpdir", pre, topDir, to), *members[1:])
+            merged = merged or members[0] == ind
+        return merged
+
+    def _mergeable(self, pre: str, topDir: str, to: str, members: list[int], run: list[int]) -> bool:
+        src, dst = BatchScheduler.AbsPath(pre, topDir), BatchScheduler.AbsPath(to, topDir)
+        if self._kind(to) != BatchPlanner.DIR or self._kind(dst) != BatchPlanner.ABSENT or \
+                self._kind(src) != BatchPlanner.DIR:
+            return False
+        if any(BatchOptimizer._Conflict([src], pths) for pths in self._done):
+            return False  # changed earlier in the batch, the real tree below is not what cpfile would see
+        others = [j for j in run if j not in members]
+        if any(BatchOptimizer._Conflict([src, dst], self._pathsAt(j)) for j in others):
+            return False
+        rels = [self._cmds[j][2].replace("\\", "/") for j in members]
+        if len(set(rels)) != len(rels):
+            return False
+        return set(rels) == BatchOptimizer._FilesIfPlain(src, topDir)
+
+    @staticmethod
+    def _FilesIfPlain(root: str, relRoot: str) -> set[str] | None:
+        # rel paths of the regular files under root; None when there is a symlink, a special file or an empty dir,
+        # which cpdir and a set of cpfile do not reproduce alike
+        files: set[str] = set()
+        stack = [(root, relRoot)]
+        try:
+            while stack:
+                absDir, relDir = stack.pop()
+                empty = True
+                with os.scandir(absDir) as it:
+                    for entry in it:
+                        empty = False
+                        if entry.is_symlink():
+                            return None
+                        if entry.is_dir():
+                            stack.append((entry.path, relDir + "/" + entry.name))
+                        elif entry.is_file():
+                            files.add(relDir + "/" + entry.name)
+                        else:
+                            return None
+                if empty:
+                    return None
+        except OSError:
+            return None
+        return files
@@ -0,0 +1,468 @@
+from typing import NamedTuple
+
+import os
+import re
+import stat
+
+from FileBackend import FileBackend
+from FileOperation import FileOperation, SystemPath
+from PathMatcher import PathMatcher
+from TreeIndex import TreeIndex
+
+
+class BatchPlan(NamedTuple):
+    ok: bool
+    errors: list[tuple[int, tuple, FileOperation.ErrorCode]]  # (index in batch, command, ErrorCode) of each failure
+    recoverList: FileOperation.BATCH_COMMAND_LIST_TYPE  # predicted, in the order executer would return it
+    statCalls: int  # real filesystem calls the planning cost
+
+
+class BatchPlanner:
+    # Simulates a batch against an in-memory overlay of the real tree, nothing on disk is touched.
+    # The overlay holds only what the batch changed; everything else is read lazily, one stat per distinct path.
+    # A directory entry may be backed by a real directory(e.g., the source of a renamed or copied dir):
+    # its children not in the overlay are the children of that real directory.
+    FILE = "file"
+    DIR = "dir"
+    ABSENT = "absent"
+    TRASH_NAME = "<trash>"  # names only known after running, e.g., the file name inside the trash bin
+    STAGED_NAME = "<staged>"
+
+    def __init__(self):
+        self._overlay: dict[str, tuple[str, str | None]] = dict()  # key -> (kind, backing real dir)
+        self._children: dict[str, set[str]] = dict()  # overlay key -> overlay keys of its direct children
+        self._realKinds: dict[str, str] = dict()
+        self._realNames: dict[str, list[str]] = dict()
+        self.statCalls = 0
+
+    @staticmethod
+    def plan(aBatch: FileOperation.BATCH_COMMAND_LIST_TYPE) -> BatchPlan:
+        planner = BatchPlanner()
+        errors = list()
+        recoverList: FileOperation.BATCH_COMMAND_LIST_TYPE = list()
+        for ind, cmds in enumerate(aBatch):
+            if not cmds:
+                continue
+            ret, recover = planner.simulate(cmds)
+            if ret != FileOperation.ErrorCode.OK:
+                errors.append((ind, tuple(cmds), ret))
+            recoverList += recover
+        recoverList.reverse()
+        return BatchPlan(not errors, errors, recoverList, planner.statCalls)
+
+    def simulate(self, cmds: tuple) -> FileOperation.RETURN_TYPE:
+        verb = BatchPlanner.VERBS.get(cmds[0])
+        if verb is None:
+            return FileOperation.ErrorCode.UNKNOWN_ERROR, list()
+        try:
+            return verb(self, *cmds[1:])
+        except TypeError:  # wrong number of args, executer would raise
+            return FileOperation.ErrorCode.UNKNOWN_ERROR, list()
+
+    # ---- paths ----
+
+    @staticmethod
+    def AbsFilePath(pre: str, rel: str) -> str:
+        # the string FileOperation builds, so predicted recover commands look the same
+        return FileBackend.current().absoluteFilePath(pre, rel)
+
+    @staticmethod
+    def Key(pth: str) -> str:
+        return os.path.normcase(os.path.abspath(pth))
+
+    @staticmethod
+    def _Parent(key: str) -> str:
+        return os.path.dirname(key)
+
+    # ---- lazy real filesystem ----
+
+    def _realKind(self, key: str) -> str:
+        kind = self._realKinds.get(key)
+        if kind is None:
+            self.statCalls += 1
+            try:
+                kind = BatchPlanner.DIR if stat.S_ISDIR(os.stat(key).st_mode) else BatchPlanner.FILE
+            except (OSError, ValueError):
+                kind = BatchPlanner.ABSENT
+            self._realKinds[key] = kind
+        return kind
+
+    def _realListdir(self, key: str) -> list[str]:
+        names = self._realNames.get(key)
+        if names is None:
+            self.statCalls += 1
+            try:
+                names = os.listdir(key)
+            except OSError:
+                names = list()
+            self._realNames[key] = names
+        return names
+
+    # ---- overlay ----
+
+    def _backing(self, key: str) -> tuple[str, str | None]:
+        # (kind, real path standing for key)
+        if key in self._overlay:
+            kind, backing = self._overlay[key]
+            return kind, backing
+        child, parent = key, BatchPlanner._Parent(key)
+        suffix = ""
+        while parent != child:
+            suffix = os.sep + os.path.basename(child) + suffix
+            if parent in self._overlay:
+                kind, backing = self._overlay[parent]
+                if kind != BatchPlanner.DIR or backing is None:
+                    return BatchPlanner.ABSENT, None
+                real = backing + suffix
+                return self._realKind(real), real
+            child, parent = parent, BatchPlanner._Parent(parent)
+        return self._realKind(key), key
+
+    def kind(self, pth: str) -> str:
+        return self._backing(BatchPlanner.Key(pth))[0]
+
+    def listdir(self, pth: str) -> list[str]:
+        key = BatchPlanner.Key(pth)
+        kind, backing = self._backing(key)
+        if kind != BatchPlanner.DIR:
+            return list()
+        names = list(self._realListdir(backing)) if backing is not None else list()
+        for childKey in sorted(self._children.get(key, ())):
+            name = os.path.basename(childKey)
+            childKind = self._overlay[childKey][0]
+            if childKind == BatchPlanner.ABSENT:
+                if name in names:
+                    names.remove(name)
+            elif name not in names:
+                names.append(name)
+        return names
+
+    def _dropDescendants(self, key: str) -> dict[str, tuple[str, str | None]]:
+        dropped = dict()
+        stack = list(self._children.pop(key, ()))
+        while stack:
+            k = stack.pop()
+            dropped[k] = self._overlay.pop(k)
+            stack += self._children.pop(k, ())
+        return dropped
+
+    def _set(self, key: str, kind: str, backing: str | None = None) -> None:
+        self._dropDescendants(key)
+        self._overlay[key] = (kind, backing)
+        parent = BatchPlanner._Parent(key)
+        if parent != key:
+            self._children.setdefault(parent, set()).add(key)
+
+    def _makeDirs(self, key: str) -> bool:
+        # like mkpath: False when some ancestor is a file
+        missing = list()
+        while True:
+            kind = self._backing(key)[0]
+            if kind == BatchPlanner.DIR:
+                break
+            if kind == BatchPlanner.FILE:
+                return False
+            missing.append(key)
+            parent = BatchPlanner._Parent(key)
+            if parent == key:
+                break
+            key = parent
+        for k in reversed(missing):
+            self._set(k, BatchPlanner.DIR)
+        return True
+
+    def _move(self, srcKey: str, dstKey: str, keepSrc: bool) -> None:
+        kind, backing = self._backing(srcKey)
+        subtree = {k: v for k, v in self._dropDescendants(srcKey).items()}
+        if kind == BatchPlanner.DIR:
+            self._set(dstKey, BatchPlanner.DIR, backing)
+        else:
+            self._set(dstKey, BatchPlanner.FILE)
+        for k in sorted(subtree):  # parents sort before their children
+            self._set(dstKey + k[len(srcKey):], *subtree[k])
+        if keepSrc:
+            for k in sorted(subtree):
+                self._set(k, *subtree[k])
+        else:
+            self._set(srcKey, BatchPlanner.ABSENT)
+
+    def _removeEmptyDirs(self, key: str) -> bool:
+        # like QDir.rmpath: remove key and then its parents while they are empty
+        if self.listdir(key):
+            return False
+        self._set(key, BatchPlanner.ABSENT)
+        parent = BatchPlanner._Parent(key)
+        while parent != key and self._backing(parent)[0] == BatchPlanner.DIR and not self.listdir(parent):
+            self._set(parent, BatchPlanner.ABSENT)
+            key, parent = parent, BatchPlanner._Parent(parent)
+        return True
+
+    def _walk(self, pth: str) -> tuple[list[str], list[str]]:
+        # dirs in pre-order and files, relative with "/", like CopyEngine.ScanTree
+        dirs, files = list(), list()
+        stack = [(pth, "")]
+        while stack:
+            absDir, relDir = stack.pop()
+            subDirs = list()
+            for name in self.listdir(absDir):
+                childPth = os.path.join(absDir, name)
+                if self.kind(childPth) == BatchPlanner.DIR:
+                    dirs.append(relDir + name)
+                    subDirs.append((childPth, relDir + name + "/"))
+                else:
+                    files.append(relDir + name)
+            stack += reversed(subDirs)
+        return dirs, files
+
+    def _globWalk(self, pth: str, pattern: str, prune: str = None) -> list[str]:
+        # the files PathMatcher.Walk yields, in its order
+        match, byPath = PathMatcher.Compile(pattern)
+        pruneKey = BatchPlanner.Key(prune) if prune else None
+        matches = list()
+        stack = [(pth, "")]
+        while stack:
+            absDir, relDir = stack.pop()
+            subDirs = list()
+            for name in sorted(self.listdir(absDir)):
+                childPth = os.path.join(absDir, name)
+                if self.kind(childPth) == BatchPlanner.DIR:
+                    if BatchPlanner.Key(childPth) != pruneKey:
+                        subDirs.append((childPth, relDir + name + "/"))
+                elif match(relDir + name if byPath else name):
+                    matches.append(relDir + name)
+            stack += reversed(subDirs)
+        return matches
+
+    # ---- verbs, mirroring the ErrorCode and recover semantics of FileOperation.LambdaTable ----
+
+    def rmpath(self, pre: str, rel: str) -> FileOperation.RETURN_TYPE:
+        pth = BatchPlanner.AbsFilePath(pre, rel)
+        if self.kind(pth) != BatchPlanner.DIR:
+            return FileOperation.ErrorCode.OK, list()
+        if not self._removeEmptyDirs(BatchPlanner.Key(pth)):
+            return FileOperation.ErrorCode.CANNOT_REMOVE_DIR, list()
+        return FileOperation.ErrorCode.OK, [("mkpath", pre, rel)]
+
+    def rmdir(self, pre: str, rel: str, *_) -> FileOperation.RETURN_TYPE:
+        pth = BatchPlanner.AbsFilePath(pre, rel)
+        if self.kind(pth) != BatchPlanner.DIR:
+            return FileOperation.ErrorCode.OK, list()
+        self._set(BatchPlanner.Key(pth), BatchPlanner.ABSENT)
+        return FileOperation.ErrorCode.OK, list()
+
+    def rmtree(self, pre: str, rel: str, files: list[str] = (), dirs: list[str] = (), *_) -> FileOperation.RETURN_TYPE:
+        pth = BatchPlanner.AbsFilePath(pre, rel)
+        if self.kind(pth) != BatchPlanner.DIR:
+            return FileOperation.ErrorCode.OK, list()
+        foundDirs, foundFiles = self._walk(pth)
+        created = set(files).union(dirs)
+        if not created.issuperset(foundDirs) or not created.issuperset(foundFiles):
+            for f in files:
+                self.rmfile(pth, f)
+            for d in sorted(dirs, reverse=True):
+                self.rmpath(pth, d)
+            return self.rmpath(pre, rel)
+        key = BatchPlanner.Key(pth)
+        self._set(key, BatchPlanner.ABSENT)
+        parent = BatchPlanner._Parent(key)
+        if parent != key and self._backing(parent)[0] == BatchPlanner.DIR:
+            self._removeEmptyDirs(parent)
+        return FileOperation.ErrorCode.OK, [("mkpath", pre, rel)]
+
+    def rmfile(self, pre: str, rel: str) -> FileOperation.RETURN_TYPE:
+        pth = BatchPlanner.AbsFilePath(pre, rel)
+        kind = self.kind(pth)
+        if kind == BatchPlanner.ABSENT:
+            return FileOperation.ErrorCode.OK, list()
+        if kind == BatchPlanner.DIR:
+            return FileOperation.ErrorCode.CANNOT_REMOVE_FILE, list()
+        self._set(BatchPlanner.Key(pth), BatchPlanner.ABSENT)
+        return FileOperation.ErrorCode.OK, list()
+
+    def stageDelete(self, pre: str, rel: str, *_) -> FileOperation.RETURN_TYPE:
+        pth = BatchPlanner.AbsFilePath(pre, rel)
+        if self.kind(pth) == BatchPlanner.ABSENT:
+            return FileOperation.ErrorCode.OK, list()
+        self._set(BatchPlanner.Key(pth), BatchPlanner.ABSENT)
+        return FileOperation.ErrorCode.OK, [("rename", BatchPlanner.STAGED_NAME, BatchPlanner.STAGED_NAME, pre, rel)]
+
+    def moveToTrash(self, pre: str, rel: str) -> FileOperation.RETURN_TYPE:
+        pth = BatchPlanner.AbsFilePath(pre, rel)
+        if self.kind(pth) == BatchPlanner.ABSENT:
+            return FileOperation.ErrorCode.OK, list()
+        self._set(BatchPlanner.Key(pth), BatchPlanner.ABSENT)
+        return FileOperation.ErrorCode.OK, [("rename", "", BatchPlanner.TRASH_NAME, "", pth)]
+
+    def moveAllToTrash(self, pre: str, rels: list[str]) -> FileOperation.RETURN_TYPE:
+        recoverList: FileOperation.BATCH_COMMAND_LIST_TYPE = list()
+        for rel in rels:
+            recoverList += self.moveToTrash(pre, rel)[1]
+        return FileOperation.ErrorCode.OK, recoverList
+
+    def rename(self, pre: str, rel: str, to: str, toRel: str) -> FileOperation.RETURN_TYPE:
+        pth = BatchPlanner.AbsFilePath(pre, rel)
+        if self.kind(pth) == BatchPlanner.ABSENT:
+            return FileOperation.ErrorCode.SRC_INEXIST, list()
+        absNewPath = BatchPlanner.AbsFilePath(to, toRel)
+        if self.kind(absNewPath) != BatchPlanner.ABSENT:
+            return FileOperation.ErrorCode.DST_FILE_OR_PATH_ALREADY_EXIST, list()
+        cmds: FileOperation.BATCH_COMMAND_LIST_TYPE = list()
+        preNewPathFolder = absNewPath.rsplit("/", 1)[0] if "/" in absNewPath else os.path.dirname(absNewPath)
+        if self.kind(preNewPathFolder) != BatchPlanner.DIR:
+            if not self._makeDirs(BatchPlanner.Key(preNewPathFolder)):
+                return FileOperation.ErrorCode.DST_PRE_DIR_CANNOT_MAKE, list()
+            cmds.append(("rmpath", "", preNewPathFolder))
+        srcKey, dstKey = BatchPlanner.Key(pth), BatchPlanner.Key(absNewPath)
+        if dstKey.startswith(srcKey + os.sep):  # into itself
+            return FileOperation.ErrorCode.UNKNOWN_ERROR, cmds
+        self._move(srcKey, dstKey, keepSrc=False)
+        cmds.append(("rename", to, toRel, pre, rel))
+        return FileOperation.ErrorCode.OK, cmds
+
+    def cpfile(self, pre: str, rel: str, to: str, *_) -> FileOperation.RETURN_TYPE:
+        pth = BatchPlanner.AbsFilePath(pre, rel)
+        srcKind = self.kind(pth)
+        if srcKind == BatchPlanner.ABSENT:
+            return FileOperation.ErrorCode.SRC_INEXIST, list()
+        if self.kind(to) != BatchPlanner.DIR:
+            return FileOperation.ErrorCode.DST_DIR_INEXIST, list()
+        toPth = BatchPlanner.AbsFilePath(to, rel)
+        if self.kind(toPth) != BatchPlanner.ABSENT:
+            return FileOperation.ErrorCode.DST_FILE_ALREADY_EXIST, list()
+        cmds: FileOperation.BATCH_COMMAND_LIST_TYPE = list()
+        prePath = toPth.rsplit("/", 1)[0]
+        if self.kind(prePath) != BatchPlanner.DIR:
+            if not self._makeDirs(BatchPlanner.Key(prePath)):
+                return FileOperation.ErrorCode.DST_PRE_DIR_CANNOT_MAKE, list()
+            cmds.append(("rmpath", "", prePath))
+        if srcKind == BatchPlanner.DIR:  # a dir cannot be copied as a file
+            return FileOperation.ErrorCode.UNKNOWN_ERROR, cmds
+        self._set(BatchPlanner.Key(toPth), BatchPlanner.FILE)
+        cmds.append(("rmfile", to, rel))
+        return FileOperation.ErrorCode.OK, cmds
+
+    def cpdir(self, pre: str, rel: str, to: str, *_) -> FileOperation.RETURN_TYPE:
+        pth = BatchPlanner.AbsFilePath(pre, rel)
+        srcKind = self.kind(pth)
+        if srcKind == BatchPlanner.ABSENT:
+            return FileOperation.ErrorCode.SRC_INEXIST, list()
+        if self.kind(to) != BatchPlanner.DIR:
+            return FileOperation.ErrorCode.DST_DIR_INEXIST, list()
+        toPth = BatchPlanner.AbsFilePath(to, rel)
+        if self.kind(toPth) != BatchPlanner.ABSENT:
+            return FileOperation.ErrorCode.DST_FOLDER_ALREADY_EXIST, list()
+        if not self._makeDirs(BatchPlanner.Key(toPth)):
+            return FileOperation.ErrorCode.UNKNOWN_ERROR, list()
+        recoverList: FileOperation.BATCH_COMMAND_LIST_TYPE = [("rmpath", to, rel)]
+        if srcKind != BatchPlanner.DIR:
+            return FileOperation.ErrorCode.UNKNOWN_ERROR, recoverList
+        dirs, files = self._walk(pth)
+        self._move(BatchPlanner.Key(pth), BatchPlanner.Key(toPth), keepSrc=True)
+        recoverList += [("rmpath", toPth, toRel) for toRel in dirs]
+        recoverList += [("rmfile", toPth, toRel) for toRel in files]
+        return FileOperation.ErrorCode.OK, recoverList
+
+    def _globbed(self, pre: str, rel: str, pattern: str, to: str | None, run) -> FileOperation.RETURN_TYPE:
+        pth = BatchPlanner.AbsFilePath(pre, rel)
+        if self.kind(pth) != BatchPlanner.DIR:
+            return FileOperation.ErrorCode.SRC_DIR_INEXIST, list()
+        if to is not None and self.kind(to) != BatchPlanner.DIR:
+            return FileOperation.ErrorCode.DST_DIR_INEXIST, list()
+        try:
+            matches = self._globWalk(pth, pattern, BatchPlanner.AbsFilePath(to, rel) if to is not None else None)
+        except (re.error, TypeError):
+            return FileOperation.ErrorCode.INVALID_PATTERN, list()
+        recoverList: FileOperation.BATCH_COMMAND_LIST_TYPE = list()
+        for fileRel in matches:
+            ret, recover = run(rel.rstrip("/") + "/" + fileRel if rel else fileRel)
+            recoverList += recover
+            if ret != FileOperation.ErrorCode.OK:
+                return ret, recoverList
+        return FileOperation.ErrorCode.OK, recoverList
+
+    def rmglob(self, pre: str, rel: str, pattern: str) -> FileOperation.RETURN_TYPE:
+        return self._globbed(pre, rel, pattern, None, lambda fileRel: self.rmfile(pre, fileRel))
+
+    def mvglob(self, pre: str, rel: str, pattern: str, to: str) -> FileOperation.RETURN_TYPE:
+        return self._globbed(pre, rel, pattern, to, lambda fileRel: self.rename(pre, fileRel, to, fileRel))
+
+    def cpglob(self, pre: str, rel: str, pattern: str, to: str) -> FileOperation.RETURN_TYPE:
+        return self._globbed(pre, rel, pattern, to, lambda fileRel: self.cpfile(pre, fileRel, to))
+
+    def syncdir(self, pre: str, rel: str, to: str, *_) -> FileOperation.RETURN_TYPE:
+        # an existing destination is only validated: what the sync changes depends on its index
+        pth = BatchPlanner.AbsFilePath(pre, rel)
+        if self.kind(pth) != BatchPlanner.DIR:
+            return FileOperation.ErrorCode.SRC_DIR_INEXIST, list()
+        if self.kind(to) != BatchPlanner.DIR:
+            return FileOperation.ErrorCode.DST_DIR_INEXIST, list()
+        toPth = BatchPlanner.AbsFilePath(to, rel)
+        toKind = self.kind(toPth)
+        if toKind == BatchPlanner.ABSENT:
+            ret, recoverList = self.cpdir(pre, rel, to)
+            if ret != FileOperation.ErrorCode.OK:
+                return ret, recoverList
+            return ret, recoverList + [("rmfile", TreeIndex.IndexDir(), TreeIndex.IndexName(toPth))]
+        if toKind != BatchPlanner.DIR:
+            return FileOperation.ErrorCode.DST_FILE_ALREADY_EXIST, list()
+        return FileOperation.ErrorCode.OK, list()
+
+    def touch(self, pre: str, rel: str) -> FileOperation.RETURN_TYPE:
+        if self.kind(pre) != BatchPlanner.DIR:
+            return FileOperation.ErrorCode.DST_DIR_INEXIST, list()
+        pth = BatchPlanner.AbsFilePath(pre, rel)
+        if self.kind(pth) != BatchPlanner.ABSENT:
+            return FileOperation.ErrorCode.OK, list()
+        cmds: FileOperation.BATCH_COMMAND_LIST_TYPE = list()
+        prePath = pth.rsplit("/", 1)[0]
+        if self.kind(prePath) != BatchPlanner.DIR:
+            if not self._makeDirs(BatchPlanner.Key(prePath)):
+                return FileOperation.ErrorCode.DST_PRE_DIR_CANNOT_MAKE, cmds
+            cmds.append(("rmpath", "", prePath))
+        self._set(BatchPlanner.Key(pth), BatchPlanner.FILE)
+        cmds.append(("rmfile", pre, rel))
+        return FileOperation.ErrorCode.OK, cmds
+
+    def mkpath(self, pre: str, rel: str) -> FileOperation.RETURN_TYPE:
+        if self.kind(pre) != BatchPlanner.DIR:
+            return FileOperation.ErrorCode.DST_DIR_INEXIST, list()
+        pth = BatchPlanner.AbsFilePath(pre, rel)
+        if self.kind(pth) != BatchPlanner.ABSENT:
+            return FileOperation.ErrorCode.OK, list()
+        if not self._makeDirs(BatchPlanner.Key(pth)):
+            return FileOperation.ErrorCode.UNKNOWN_ERROR, list()
+        return FileOperation.ErrorCode.OK, [("rmpath", pre, rel)]
+
+    def link(self, pre: str, rel: str, to: str = None) -> FileOperation.RETURN_TYPE:
+        to = SystemPath.starredPath if to is None else to
+        pth = BatchPlanner.AbsFilePath(pre, rel)
+        if self.kind(pth) == BatchPlanner.ABSENT:
+            return FileOperation.ErrorCode.SRC_INEXIST, list()
+        if self.kind(to) != BatchPlanner.DIR:
+            return FileOperation.ErrorCode.DST_DIR_INEXIST, list()
+        toPath = BatchPlanner.AbsFilePath(to, rel) + ".lnk"
+        cmds: FileOperation.BATCH_COMMAND_LIST_TYPE = list()
+        if self.kind(toPath) != BatchPlanner.ABSENT:
+            self._set(BatchPlanner.Key(toPath), BatchPlanner.ABSENT)
+            cmds.append(("rename", "", BatchPlanner.TRASH_NAME, "", toPath))
+        prePath = toPath.rsplit("/", 1)[0]
+        if self.kind(prePath) != BatchPlanner.DIR:
+            if not self._makeDirs(BatchPlanner.Key(prePath)):
+                return FileOperation.ErrorCode.DST_PRE_DIR_CANNOT_MAKE, cmds
+            cmds.append(("rmpath", "", prePath))
+        self._set(BatchPlanner.Key(toPath), BatchPlanner.FILE)
+        cmds.append(("unlink", pre, rel + ".lnk", to))
+        return FileOperation.ErrorCode.OK, cmds
+
+    def unlink(self, pre: str, rel: str, to: str = None) -> FileOperation.RETURN_TYPE:
+        to = SystemPath.starredPath if to is None else to
+        toPath = BatchPlanner.AbsFilePath(to, rel)
+        if self.kind(toPath) == BatchPlanner.ABSENT:
+            return FileOperation.ErrorCode.OK, list()
+        self._set(BatchPlanner.Key(toPath), BatchPlanner.ABSENT)
+        return FileOperation.ErrorCode.OK, [("link", pre, rel[:-4], to)]
+
+    VERBS = {"rmfile": rmfile, "rmpath": rmpath, "rmdir": rmdir, "rmtree": rmtree, "moveToTrash": moveToTrash,
+             "moveAllToTrash": moveAllToTrash, "stageDelete": stageDelete, "touch": touch, "mkpath": mkpath,
+             "rename": rename, "cpfile": cpfile, "cpdir": cpdir, "syncdir": syncdir,
+             "rmglob": rmglob, "mvglob": mvglob, "cpglob": cpglob, "link": link, "unlink": unlink}
@@ -0,0 +1,122 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+import os
+
+
+class BatchScheduler:
+    TRASH_KEY = "\0trash"  # all commands that write into the trash bin share this virtual path
+    BARRIER = None  # command whose effect cannot be bounded to some paths, e.g., rmpath removes its empty parents
+
+    @staticmethod
+    def AbsPath(pre: str, rel: str) -> str:
+        return os.path.normcase(os.path.abspath(os.path.join(pre, rel)))
+
+    @staticmethod
+    def WithMissingParent(pth: str, rel: str) -> list[str]:
+        # A command creates the missing parent dirs of its destination, with a recover rmpath. Commands creating the
+        # same parent must not run in one wave: whichever created it, the rmpath is replayed in batch order.
+        # The highest missing ancestor stands for them all, a/b/1.txt and a/c/2.txt both create a when it is missing
+        if not os.path.dirname(rel):
+            return [pth]
+        missing = None
+        parent = os.path.dirname(pth)
+        while not os.path.isdir(parent):
+            missing = parent
+            up = os.path.dirname(parent)
+            if up == parent:
+                break
+            parent = up
+        return [pth] if missing is None else [pth, missing]
+
+    @staticmethod
+    def touchedPaths(cmds: tuple) -> list[str] | None:
+        # paths (absolute, normalized) a command reads or writes. None means it conflicts with everything
+        if not cmds:
+            return []
+        k: str = cmds[0]
+        vals: tuple = cmds[1:]
+        try:
+            if k in ("rmfile", "rmdir", "mkpath", "stageDelete"):
+                return [BatchScheduler.AbsPath(vals[0], vals[1])]
+            if k == "touch":
+                return BatchScheduler.WithMissingParent(BatchScheduler.AbsPath(vals[0], vals[1]), vals[1])
+            if k == "moveToTrash":
+                return [BatchScheduler.AbsPath(vals[0], vals[1]), BatchScheduler.TRASH_KEY]
+            if k == "moveAllToTrash":
+                return [BatchScheduler.AbsPath(vals[0], rel) for rel in vals[1]] + [BatchScheduler.TRASH_KEY]
+            if k == "rename":
+                return [BatchScheduler.AbsPath(vals[0], vals[1])] + BatchScheduler.WithMissingParent(
+                    BatchScheduler.AbsPath(vals[2], vals[3]), vals[3])
+            if k in ("cpfile", "cpdir", "syncdir"):
+                return [BatchScheduler.AbsPath(vals[0], vals[1])] + BatchScheduler.WithMissingParent(
+                    BatchScheduler.AbsPath(vals[2], vals[1]), vals[1])
+            if k == "rmglob":
+                return [BatchScheduler.AbsPath(vals[0], vals[1])]
+            if k in ("mvglob", "cpglob"):
+                return [BatchScheduler.AbsPath(vals[0], vals[1])] + BatchScheduler.WithMissingParent(
+                    BatchScheduler.AbsPath(vals[3], vals[1]), vals[1])
+            if k in ("link", "unlink"):
+                from FileOperation import SystemPath
+                to = vals[2] if len(vals) > 2 else SystemPath.starredPath
+                if k == "unlink":
+                    return [BatchScheduler.AbsPath(to, vals[1])]
+                return [BatchScheduler.AbsPath(vals[0], vals[1]), BatchScheduler.TRASH_KEY] + \
+                    BatchScheduler.WithMissingParent(BatchScheduler.AbsPath(to, vals[1] + ".lnk"), vals[1])
+        except (IndexError, TypeError):
+            pass
+        return BatchScheduler.BARRIER
+
+    @staticmethod
+    def Ancestors(pth: str) -> list[str]:
+        # pth itself included, root last
+        ancestors = [pth]
+        while True:
+            parent = os.path.dirname(pth)
+            if parent == pth:
+                return ancestors
+            ancestors.append(parent)
+            pth = parent
+
+    @staticmethod
+    def levels(aBatch: list[tuple]) -> list[list[int]]:
+        # Assign every command to the earliest wave after all earlier commands it conflicts with.
+        # Two commands conflict when they touch the same path or one path is a prefix(parent) of the other.
+        # Commands inside one wave are independent of each other and can run in any order.
+        touchedLevel: dict[str, int] = dict()  # path -> the last wave which touched this exact path
+        subtreeLevel: dict[str, int] = dict()  # path -> the last wave which touched this path or anything under it
+        barrierLevel = -1
+        maxLevel = -1
+        waves: list[list[int]] = list()
+        for ind, cmds in enumerate(aBatch):
+            pths = BatchScheduler.touchedPaths(cmds)
+            if pths is BatchScheduler.BARRIER:
+                lvl = maxLevel + 1
+                barrierLevel = lvl
+            else:
+                lvl = barrierLevel + 1
+                for pth in pths:
+                    ancestors = BatchScheduler.Ancestors(pth)
+                    lvl = max(lvl, subtreeLevel.get(pth, -1) + 1,
+                              max(touchedLevel.get(a, -1) for a in ancestors) + 1)
+                for pth in pths:
+                    touchedLevel[pth] = lvl
+                    for a in BatchScheduler.Ancestors(pth):
+                        if subtreeLevel.get(a, -1) < lvl:
+                            subtreeLevel[a] = lvl
+            if lvl == len(waves):
+                waves.append(list())
+            waves[lvl].append(ind)
+            maxLevel = max(maxLevel, lvl)
+        return waves
+
+    @staticmethod
+    def execute(aBatch: list[tuple], run: Callable[[tuple], tuple], maxWorkers: int) -> list[tuple]:
+        # results are returned in the batch order, no matter which order they completed in
+        results: list[tuple] = [None] * len(aBatch)
+        with ThreadPoolExecutor(max_workers=maxWorkers) as pool:
+            for wave in BatchScheduler.levels(aBatch):
+                futures = [(ind, pool.submit(run, aBatch[ind])) for ind in wave]
+                for ind, future in futures:
+                    results[ind] = future.result()
+        return results
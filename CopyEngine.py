@@ -0,0 +1,473 @@
+from typing import Callable, NamedTuple
+import threading
+
+import errno
+import hashlib
+import os
+import stat
+import sys
+
+from BatchControl import BatchControl
+from DirFdContext import DirFdContext
+from Instrumentation import Instrumentation
+from LiveDirIndex import LiveDirIndex
+
+
+class CopyResult(NamedTuple):
+    ok: bool
+    bytesCopied: int  # logical: the size of dst
+    method: str
+    bytesWritten: int = 0  # physical: data actually written, the holes of a sparse copy and clones excluded
+
+
+class CopyStats:
+    # accumulates CopyResult of many copies, can be shared by several threads
+    def __init__(self, perFile: bool = False):
+        self.files = 0
+        self.failedFiles = 0
+        self.bytesCopied = 0
+        self.bytesWritten = 0
+        self.methods: dict[str, int] = dict()  # method -> file count
+        self.fileMethods: dict[str, str] | None = dict() if perFile else None  # dst -> method, only when perFile
+        self._lock = threading.Lock()
+
+    def add(self, result: CopyResult, dst: str = "") -> None:
+        with self._lock:
+            if result.ok:
+                self.files += 1
+            else:
+                self.failedFiles += 1
+            self.bytesCopied += result.bytesCopied
+            self.bytesWritten += result.bytesWritten
+            self.methods[result.method] = self.methods.get(result.method, 0) + 1
+            if self.fileMethods is not None and dst:
+                self.fileMethods[dst] = result.method
+
+
+class CopyEngine:
+    REFLINK = "reflink"  # copy-on-write clone, no data is moved
+    HARDLINK = "hardlink"  # same content as another file of the job, linked to its copy
+    COPY_FILE_RANGE = "copy_file_range"
+    SENDFILE = "sendfile"
+    READ_WRITE = "readwrite"
+    SPARSE = "sparse"  # only the data extents of a sparse src are copied, its holes stay holes
+    NONE = "none"  # failed before any data path was chosen
+
+    BUFFER_SIZE = 1 << 20  # read/write loop buffer
+    KERNEL_CHUNK = 1 << 30  # bytes per copy_file_range/sendfile call
+    FICLONE = 0x40049409  # linux/fs.h _IOW(0x94, 9, int)
+    SPARSE_MIN_SIZE = 1 << 20  # smaller files are copied whole, their holes are not worth the lseek calls
+    PREALLOCATE_MIN_SIZE = 8 << 20  # dst of at least this size is fallocate-d before its data is copied, None: never
+    # errors meaning "this syscall cannot do it here", not "the copy failed"
+    _FALLBACK_ERRNOS = {errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF,
+                        errno.EPERM, errno.ENOTTY}
+
+    # Data paths report every syscall they issue to Instrumentation.countFsCalls, also the one that failed
+
+    @staticmethod
+    def _reflink(srcFd: int, dstFd: int) -> int:
+        import fcntl
+        Instrumentation.countFsCalls(4)
+        fcntl.ioctl(dstFd, CopyEngine.FICLONE, srcFd)
+        size = os.fstat(srcFd).st_size
+        os.lseek(srcFd, size, os.SEEK_SET)
+        os.lseek(dstFd, size, os.SEEK_SET)
+        return size
+
+    @staticmethod
+    def _copyFileRange(srcFd: int, dstFd: int) -> int:
+        copied = calls = 0
+        try:
+            while True:
+                calls += 1
+                n = os.copy_file_range(srcFd, dstFd, CopyEngine.KERNEL_CHUNK)
+                if n == 0:
+                    return copied
+                copied += n
+        finally:
+            Instrumentation.countFsCalls(calls)
+
+    @staticmethod
+    def _sendfile(srcFd: int, dstFd: int) -> int:
+        copied = calls = 0
+        try:
+            while True:
+                calls += 1
+                n = os.sendfile(dstFd, srcFd, None, CopyEngine.KERNEL_CHUNK)
+                if n == 0:
+                    return copied
+                copied += n
+        finally:
+            Instrumentation.countFsCalls(calls)
+
+    @staticmethod
+    def _readWrite(srcFd: int, dstFd: int) -> int:
+        copied = calls = 0
+        buf = bytearray(CopyEngine.BUFFER_SIZE)
+        view = memoryview(buf)
+        try:
+            with os.fdopen(srcFd, "rb", buffering=0, closefd=False) as srcFile:
+                while True:
+                    calls += 1
+                    n = srcFile.readinto(buf)
+                    if not n:
+                        return copied
+                    written = 0
+                    while written < n:
+                        calls += 1
+                        written += os.write(dstFd, view[written:n])
+                    copied += n
+        finally:
+            Instrumentation.countFsCalls(calls)
+
+    _fallocate = None
+
+    @staticmethod
+    def Preallocate(fd: int, extents: list[tuple[int, int]]) -> bool:
+        # fallocate(2) mode 0 for (offset, length) extents: the filesystem reserves contiguous blocks up front.
+        # Not posix_fallocate, glibc emulates that by writing zeros where fallocate is not supported
+        if CopyEngine._fallocate is None:
+            fallocate = False
+            if sys.platform.startswith("linux"):
+                import ctypes
+                import ctypes.util
+                try:
+                    libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+                    fallocate = getattr(libc, "fallocate64", None) or libc.fallocate
+                    fallocate.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64)
+                    fallocate.restype = ctypes.c_int
+                except (OSError, AttributeError):
+                    fallocate = False
+            CopyEngine._fallocate = fallocate
+        if not CopyEngine._fallocate:
+            return False
+        for offset, length in extents:
+            Instrumentation.countFsCalls()
+            if CopyEngine._fallocate(fd, 0, offset, length) != 0:  # e.g., EOPNOTSUPP on tmpfs of old kernels
+                return False
+        return True
+
+    @staticmethod
+    def DataExtents(fd: int, st: os.stat_result) -> list[tuple[int, int]] | None:
+        # (offset, length) of the data of a sparse file by SEEK_DATA/SEEK_HOLE, None when it is not sparse
+        # (it has as many blocks as bytes) or the filesystem cannot tell
+        if not hasattr(os, "SEEK_DATA") or st.st_size < CopyEngine.SPARSE_MIN_SIZE or \
+                getattr(st, "st_blocks", st.st_size) * 512 >= st.st_size:
+            return None
+        extents: list[tuple[int, int]] = list()
+        offset = calls = 0
+        try:
+            while offset < st.st_size:
+                try:
+                    calls += 1
+                    data = os.lseek(fd, offset, os.SEEK_DATA)
+                except OSError as e:
+                    if e.errno == errno.ENXIO:  # only a hole after offset
+                        break
+                    raise
+                calls += 1
+                offset = os.lseek(fd, data, os.SEEK_HOLE)
+                extents.append((data, offset - data))
+        except OSError:
+            return None
+        finally:
+            os.lseek(fd, 0, os.SEEK_SET)
+            Instrumentation.countFsCalls(calls + 1)
+        return extents
+
+    @staticmethod
+    def _sparse(srcFd: int, dstFd: int, extents: list[tuple[int, int]], size: int) -> int:
+        # Copies the extents at their offsets and sets the size with ftruncate, so the holes are never written.
+        # The file offsets are left alone until the end: after a failure the next path copies from the start
+        CopyEngine.Preallocate(dstFd, extents)
+        useCopyFileRange = hasattr(os, "copy_file_range")
+        buf = None
+        calls = 0
+        try:
+            for offset, length in extents:
+                end = offset + length
+                while offset < end:
+                    n = 0
+                    if useCopyFileRange:
+                        try:
+                            calls += 1
+                            n = os.copy_file_range(srcFd, dstFd, min(end - offset, CopyEngine.KERNEL_CHUNK), offset,
+                                                   offset)
+                        except OSError as e:
+                            if e.errno not in CopyEngine._FALLBACK_ERRNOS:
+                                raise
+                            useCopyFileRange = False
+                    if not useCopyFileRange:
+                        buf = buf or bytearray(CopyEngine.BUFFER_SIZE)
+                        calls += 1
+                        n = os.preadv(srcFd, [memoryview(buf)[:min(end - offset, len(buf))]], offset)
+                        written = 0
+                        while written < n:
+                            calls += 1
+                            written += os.pwrite(dstFd, memoryview(buf)[written:n], offset + written)
+                    if n == 0:  # src shrank meanwhile
+                        break
+                    offset += n
+            calls += 3
+            os.ftruncate(dstFd, size)
+            os.lseek(srcFd, size, os.SEEK_SET)
+            os.lseek(dstFd, size, os.SEEK_SET)
+        finally:
+            Instrumentation.countFsCalls(calls)
+        return size
+
+    @staticmethod
+    def DataPaths(reflink: bool = False, extents: list[tuple[int, int]] = None,
+                  size: int = 0) -> list[tuple[str, Callable[[int, int], int]]]:
+        # extents: the data of a sparse src(see DataExtents), copied by the sparse path before the whole-file ones
+        paths = list()
+        if sys.platform.startswith("linux"):
+            if reflink:  # btrfs, XFS, ...; others fail with EOPNOTSUPP/EXDEV/EINVAL and the next path copies
+                paths.append((CopyEngine.REFLINK, CopyEngine._reflink))
+        if extents is not None and hasattr(os, "pwrite"):
+            paths.append((CopyEngine.SPARSE, lambda srcFd, dstFd: CopyEngine._sparse(srcFd, dstFd, extents, size)))
+        if sys.platform.startswith("linux"):
+            if hasattr(os, "copy_file_range"):
+                paths.append((CopyEngine.COPY_FILE_RANGE, CopyEngine._copyFileRange))
+            if hasattr(os, "sendfile"):
+                paths.append((CopyEngine.SENDFILE, CopyEngine._sendfile))
+        paths.append((CopyEngine.READ_WRITE, CopyEngine._readWrite))
+        return paths
+
+    @staticmethod
+    def copyFile(src: str, dst: str, reflink: bool = False) -> CopyResult:
+        # Like QFile(src).copy(dst): fails if dst already exists, copies permissions, removes a partial dst.
+        # Data moves in kernel when possible: [reflink ->] [sparse ->] copy_file_range -> sendfile -> read/write loop.
+        # A sparse src keeps its holes in dst, a large one is preallocated(see Preallocate) before the whole-file paths.
+        # mtime is copied last, so a matching size and mtime(see upToDate) means the copy completed.
+        Instrumentation.countFsCalls()
+        try:
+            srcFd = DirFdContext.Call(os.open, src, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        except OSError:
+            return CopyResult(False, 0, CopyEngine.NONE)
+        calls = 2  # fstat and close of src, then the calls of copyFile itself below; data paths count their own
+        try:
+            st = os.fstat(srcFd)
+            try:
+                calls += 1
+                dstFd = DirFdContext.Call(os.open, dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0),
+                                          0o600)
+            except OSError:
+                return CopyResult(False, 0, CopyEngine.NONE)
+            copied, method, ok = 0, CopyEngine.NONE, False
+            extents = CopyEngine.DataExtents(srcFd, st)
+            preallocate = extents is None and CopyEngine.PREALLOCATE_MIN_SIZE is not None and \
+                st.st_size >= CopyEngine.PREALLOCATE_MIN_SIZE
+            try:
+                for method, dataPath in CopyEngine.DataPaths(reflink, extents, st.st_size):
+                    if preallocate and method != CopyEngine.REFLINK:  # a clone shares the blocks of src
+                        CopyEngine.Preallocate(dstFd, [(0, st.st_size)])
+                        preallocate = False
+                    try:
+                        copied += dataPath(srcFd, dstFd)
+                        ok = True
+                        break
+                    except OSError as e:
+                        if e.errno not in CopyEngine._FALLBACK_ERRNOS or method == CopyEngine.READ_WRITE:
+                            break
+                        # a kernel path may fail after moving some bytes, the next path continues from the file offsets
+                        calls += 1
+                        copied = os.lseek(dstFd, 0, os.SEEK_CUR)
+                if ok and copied < st.st_size and method != CopyEngine.SPARSE:
+                    calls += 1
+                    os.ftruncate(dstFd, copied)  # src shrank meanwhile: drop the preallocated tail
+                if ok:
+                    calls += 1
+                    if hasattr(os, "fchmod"):
+                        os.fchmod(dstFd, st.st_mode & 0o7777)
+                    else:
+                        os.chmod(dst, st.st_mode & 0o7777)
+                    calls += 1
+                    os.utime(dstFd if os.utime in os.supports_fd else dst, ns=(st.st_atime_ns, st.st_mtime_ns))
+            except OSError:
+                ok = False
+            finally:
+                calls += 1
+                os.close(dstFd)
+            if not ok:
+                try:
+                    calls += 1
+                    DirFdContext.Call(os.remove, dst)
+                except OSError:
+                    pass
+            counters = Instrumentation.Current()
+            if counters is not None:
+                counters.add(copied)
+            if method == CopyEngine.SPARSE:
+                written = sum(length for _, length in extents)
+            else:
+                written = 0 if method == CopyEngine.REFLINK else copied
+            return CopyResult(ok, copied, method, written)
+        finally:
+            os.close(srcFd)
+            Instrumentation.countFsCalls(calls)
+
+    @staticmethod
+    def upToDate(src: str, dst: str, checksum: bool = False) -> bool:
+        # dst is a finished copy of src: same size and mtime, or with checksum same size and blake2b digest
+        try:
+            srcSt, dstSt = os.stat(src), os.lstat(dst)
+        except OSError:
+            return False
+        if not stat.S_ISREG(dstSt.st_mode) or srcSt.st_size != dstSt.st_size:
+            return False
+        if not checksum:
+            return srcSt.st_mtime_ns == dstSt.st_mtime_ns
+        try:
+            return CopyEngine.Digest(src) == CopyEngine.Digest(dst)
+        except OSError:
+            return False
+
+    @staticmethod
+    def Digest(pth: str) -> bytes:
+        # blake2b of the content, read into one reused buffer. Not mmap: a file truncated meanwhile would raise SIGBUS
+        h = hashlib.blake2b()
+        buf = bytearray(CopyEngine.BUFFER_SIZE)
+        with open(pth, "rb", buffering=0) as f, memoryview(buf) as view:
+            while n := f.readinto(buf):
+                h.update(view[:n])
+        return h.digest()
+
+    @staticmethod
+    def ScanTree(root: str, withSize: bool = False,
+                 links: list[str] = None, others: list[str] = None) -> tuple[list[str], list[tuple[str, int]]]:
+        # One os.scandir pass. Returns dirs in pre-order(parent before child) and files, both relative with "/".
+        # Like QDirIterator without FollowSymlinks: a symlink to dir is listed as a dir but not descended into.
+        # links: every symlink is appended there instead, e.g., to be recreated as a symlink.
+        # others: FIFOs, sockets and device nodes are appended there instead, opening them may block forever.
+        # Served by the LiveDirIndex watching root when there is one and links and others are None
+        index = LiveDirIndex.For(root) if links is None and others is None else None
+        if index is not None:
+            scanned = index.scanTree(root, withSize)
+            if scanned is not None:
+                return scanned
+        dirs: list[str] = list()
+        files: list[tuple[str, int]] = list()
+        stack: list[tuple[str, str]] = [(root, "")]
+        while stack:
+            absDir, relDir = stack.pop()
+            subDirs = list()
+            with os.scandir(absDir) as it:
+                for entry in it:
+                    rel = relDir + entry.name
+                    if links is not None and entry.is_symlink():
+                        links.append(rel)
+                    elif entry.is_dir():
+                        dirs.append(rel)
+                        if not entry.is_symlink():
+                            subDirs.append((entry.path, rel + "/"))
+                    elif others is not None and not entry.is_file():
+                        others.append(rel)
+                    else:
+                        files.append((rel, entry.stat().st_size if withSize else 0))
+            stack += reversed(subDirs)
+        return dirs, files
+
+    @staticmethod
+    def DuplicateOf(jobs: list[tuple[str, str, int]], maxWorkers: int = 1) -> dict[int, int]:
+        # job index -> index of an earlier job whose src has identical content: same size first, then same digest
+        bySize: dict[int, list[int]] = dict()
+        for ind, (_, _, size) in enumerate(jobs):
+            if size > 0:
+                bySize.setdefault(size, list()).append(ind)
+        candidates = sorted(ind for inds in bySize.values() if len(inds) > 1 for ind in inds)
+
+        def digestOf(ind: int) -> bytes | None:
+            try:
+                return CopyEngine.Digest(jobs[ind][0])
+            except OSError:
+                return None
+
+        if maxWorkers > 1 and len(candidates) > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=maxWorkers) as pool:
+                digests = list(pool.map(digestOf, candidates))
+        else:
+            digests = [digestOf(ind) for ind in candidates]
+        first: dict[tuple[int, bytes], int] = dict()
+        duplicateOf: dict[int, int] = dict()
+        for ind, digest in zip(candidates, digests):
+            if digest is None:
+                continue
+            key = (jobs[ind][2], digest)
+            if key in first:
+                duplicateOf[ind] = first[key]
+            else:
+                first[key] = ind
+        return duplicateOf
+
+    @staticmethod
+    def copyFiles(jobs: list[tuple[str, str, int]], maxWorkers: int = 1, largeFileSize: int = 64 << 20,
+                  copyStats: CopyStats = None, reflink: bool = False, dedup: bool = False,
+                  onCopied: Callable[[int], None] = None) -> list[bool | None]:
+        # jobs: (src, dst, size). Returns per job: True copied, False failed, None not attempted(after a failure
+        # or once the BatchControl of the caller is cancelled).
+        # Files >= largeFileSize go to their own pool so a few huge files cannot hold back the small ones.
+        # reflink: clone when the filesystem supports it. dedup: a file with the same content(size, then blake2b)
+        # as an earlier one of the jobs becomes a hardlink to that one's copy, sharing its mode and mtime.
+        # onCopied: called with the job index once its dst is complete, from the thread that copied it
+        results: list[bool | None] = [None] * len(jobs)
+        stop = threading.Event()
+        counters = Instrumentation.Current()  # pool threads report to the command that started the copy
+        control = BatchControl.current()
+        duplicateOf = CopyEngine.DuplicateOf(jobs, maxWorkers) if dedup else dict()
+
+        def finish(ind: int, ret: CopyResult) -> None:
+            if copyStats is not None:
+                copyStats.add(ret, jobs[ind][1])
+            results[ind] = ret.ok
+            if not ret.ok:
+                stop.set()
+                return
+            if onCopied is not None:
+                onCopied(ind)
+            if control is not None:
+                control.fileCopied(ret.bytesCopied)
+
+        def copyOne(ind: int) -> None:
+            if stop.is_set() or (control is not None and control.cancelled):
+                return
+            previous = Instrumentation.attach(counters)
+            try:
+                src, dst, _ = jobs[ind]
+                finish(ind, CopyEngine.copyFile(src, dst, reflink))
+            finally:
+                Instrumentation.attach(previous)  # pool threads outlive the command
+
+        def linkOne(ind: int) -> None:
+            if stop.is_set() or (control is not None and control.cancelled):
+                return
+            primary = duplicateOf[ind]
+            if results[primary]:
+                try:
+                    os.link(jobs[primary][1], jobs[ind][1])
+                    Instrumentation.countFsCalls()
+                except OSError:  # e.g., EMLINK, or no hardlink support: copy it instead
+                    pass
+                else:
+                    finish(ind, CopyResult(True, 0, CopyEngine.HARDLINK))
+                    return
+            copyOne(ind)
+
+        primaries = [ind for ind in range(len(jobs)) if ind not in duplicateOf]
+        if maxWorkers <= 1:
+            for ind in primaries:
+                copyOne(ind)
+        else:
+            from concurrent.futures import ThreadPoolExecutor, wait
+            largeWorkers = max(1, maxWorkers // 4)
+            with ThreadPoolExecutor(max_workers=maxWorkers) as smallPool, \
+                    ThreadPoolExecutor(max_workers=largeWorkers) as largePool:
+                futures = [(largePool if jobs[ind][2] >= largeFileSize else smallPool).submit(copyOne, ind)
+                           for ind in primaries]
+                wait(futures)
+                for future in futures:
+                    future.result()
+        for ind in sorted(duplicateOf):  # after every primary copy finished
+            linkOne(ind)
+        return results
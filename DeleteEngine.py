@@ -0,0 +1,168 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import os
+
+from Instrumentation import Instrumentation
+
+DELETE_SPLIT_FACTOR = 4  # the top of a tree is split until there are this many subtrees per worker
+DELETE_SPLIT_DEPTH = 4  # levels looked at for splitting, deeper dirs are removed by the worker owning their subtree
+
+
+class DeleteStats:
+    # accumulates what DeleteEngine removed, can be shared by several threads
+    def __init__(self):
+        self.entries = 0  # files, symlinks and dirs removed
+        self.bytesRemoved = 0  # st_size of the removed files
+        self.failedEntries = 0
+        self._lock = threading.Lock()
+
+    def add(self, entries: int, bytesRemoved: int, failedEntries: int) -> None:
+        with self._lock:
+            self.entries += entries
+            self.bytesRemoved += bytesRemoved
+            self.failedEntries += failedEntries
+
+
+class _Tally:
+    # counts of one worker, added to DeleteStats once
+    __slots__ = ("entries", "bytesRemoved", "failedEntries", "fsCalls")
+
+    def __init__(self):
+        self.entries = self.bytesRemoved = self.failedEntries = self.fsCalls = 0
+
+
+class DeleteEngine:
+    # Recursive delete by directory file descriptors: entries are listed with os.scandir(fd) and removed with
+    # unlink/rmdir relative to their dir's fd, so no full path is resolved per entry. The top levels of the tree
+    # are split into subtrees removed on a thread pool, each one depth first, holding at most 2 fds per level.
+    # Symlinks are removed, never followed. Like QDir.removeRecursively, a failed entry does not stop the others.
+    NOFOLLOW = getattr(os, "O_NOFOLLOW", 0)
+    DIR_FLAGS = os.O_RDONLY | getattr(os, "O_DIRECTORY", 0) | NOFOLLOW | getattr(os, "O_CLOEXEC", 0)
+
+    @staticmethod
+    def Supported() -> bool:
+        # dir_fd and scandir(fd) are POSIX only
+        return os.unlink in os.supports_dir_fd and os.rmdir in os.supports_dir_fd and os.scandir in os.supports_fd
+
+    @staticmethod
+    def _unlink(dirFd: int, entry: os.DirEntry, tally: _Tally) -> None:
+        try:
+            size = entry.stat(follow_symlinks=False).st_size if entry.is_file(follow_symlinks=False) else 0
+            os.unlink(entry.name, dir_fd=dirFd)
+        except FileNotFoundError:
+            return  # removed by someone else, after all it is gone
+        except OSError:
+            tally.failedEntries += 1
+            return
+        finally:
+            tally.fsCalls += 2
+        tally.entries += 1
+        tally.bytesRemoved += size
+
+    @staticmethod
+    def _rmdir(parentFd: int, name: str, tally: _Tally) -> bool:
+        tally.fsCalls += 1
+        try:
+            os.rmdir(name, dir_fd=parentFd)
+        except FileNotFoundError:
+            return True
+        except OSError:
+            tally.failedEntries += 1
+            return False
+        tally.entries += 1
+        return True
+
+    @staticmethod
+    def _open(parentFd: int | None, name: str, tally: _Tally, flags: int = DIR_FLAGS) -> int | None:
+        tally.fsCalls += 1
+        try:
+            return os.open(name, flags, dir_fd=parentFd)
+        except OSError:
+            tally.failedEntries += 1
+            return None
+
+    @staticmethod
+    def _removeSubtree(parentFd: int, name: str, tally: _Tally) -> None:
+        # the dir name of parentFd and everything in it, depth first
+        fd = DeleteEngine._open(parentFd, name, tally)
+        if fd is None:
+            return
+        stack: list[tuple[int, str, int, os.ScandirIterator]] = [(parentFd, name, fd, os.scandir(fd))]
+        while stack:
+            parentFd, name, fd, it = stack[-1]
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subFd = DeleteEngine._open(fd, entry.name, tally)
+                    if subFd is not None:
+                        stack.append((fd, entry.name, subFd, os.scandir(subFd)))
+                        break
+                else:
+                    DeleteEngine._unlink(fd, entry, tally)
+            else:
+                stack.pop()
+                it.close()
+                os.close(fd)
+                DeleteEngine._rmdir(parentFd, name, tally)
+
+    @staticmethod
+    def removeTree(pth: str, maxWorkers: int = 1, deleteStats: DeleteStats = None) -> bool:
+        # pth and everything in it. False when anything is left(pth a symlink is refused: nothing is removed)
+        pth = os.path.abspath(pth)
+        tally = _Tally()
+        if os.path.dirname(pth) == pth:
+            return False  # a root
+        parentFd = DeleteEngine._open(None, os.path.dirname(pth), tally, DeleteEngine.DIR_FLAGS & ~DeleteEngine.NOFOLLOW)
+        if parentFd is None:
+            return False
+        try:
+            if maxWorkers <= 1:
+                DeleteEngine._removeSubtree(parentFd, os.path.basename(pth), tally)
+            else:
+                DeleteEngine._removeSplit(parentFd, os.path.basename(pth), maxWorkers, tally)
+        finally:
+            os.close(parentFd)
+        if deleteStats is not None:
+            deleteStats.add(tally.entries, tally.bytesRemoved, tally.failedEntries)
+        Instrumentation.countFsCalls(tally.fsCalls)
+        return tally.failedEntries == 0 and not os.path.lexists(pth)
+
+    @staticmethod
+    def _removeSplit(parentFd: int, name: str, maxWorkers: int, tally: _Tally) -> None:
+        # the top levels are listed here breadth first, their files removed on the way, until there are enough
+        # subtrees for the pool. The dirs listed here are removed last, deepest first
+        listed: list[tuple[int, str, int]] = list()  # (parentFd, name, fd)
+        level: list[tuple[int, str]] = [(parentFd, name)]
+        depth = 0
+        try:
+            while level and len(level) < maxWorkers * DELETE_SPLIT_FACTOR and depth < DELETE_SPLIT_DEPTH:
+                nextLevel: list[tuple[int, str]] = list()
+                for levelParentFd, levelName in level:
+                    fd = DeleteEngine._open(levelParentFd, levelName, tally)
+                    if fd is None:
+                        continue
+                    listed.append((levelParentFd, levelName, fd))
+                    with os.scandir(fd) as it:
+                        for entry in it:
+                            if entry.is_dir(follow_symlinks=False):
+                                nextLevel.append((fd, entry.name))
+                            else:
+                                DeleteEngine._unlink(fd, entry, tally)
+                level = nextLevel
+                depth += 1
+
+            def work(subtree: tuple[int, str]) -> _Tally:
+                subTally = _Tally()
+                DeleteEngine._removeSubtree(subtree[0], subtree[1], subTally)
+                return subTally
+
+            with ThreadPoolExecutor(max_workers=min(maxWorkers, max(1, len(level)))) as pool:
+                for subTally in pool.map(work, level):
+                    tally.entries += subTally.entries
+                    tally.bytesRemoved += subTally.bytesRemoved
+                    tally.failedEntries += subTally.failedEntries
+                    tally.fsCalls += subTally.fsCalls
+        finally:
+            for listedParentFd, listedName, fd in reversed(listed):
+                os.close(fd)
+                DeleteEngine._rmdir(listedParentFd, listedName, tally)
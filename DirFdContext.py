@@ -0,0 +1,261 @@
+from collections import OrderedDict
+from typing import Callable
+import contextlib
+import threading
+
+import errno
+import os
+import stat
+import sys
+
+DIRFD_MAX_OPEN = 64  # open dir fds kept by one DirFdContext, least recently used ones are closed first
+
+
+class _Root:
+    __slots__ = ("fd", "pins", "dropped")
+
+    def __init__(self, fd: int):
+        self.fd = fd
+        self.pins = 0  # calls using fd right now, it is closed only when unpinned
+        self.dropped = False
+
+
+class DirFdContext:
+    # Open fds of the dirs batch commands are relative to(their pre and to) for one executer run.
+    # Filesystem calls on a path under such a root become *at calls(dir_fd=) with the path relative to it,
+    # so the kernel resolves only the relative part. Roots are registered by bound() from every command and
+    # opened on first use; an LRU keeps at most maxOpen of them open.
+    # FileOperation reports removed/renamed paths(NotifyRemoved), roots at or under them are dropped.
+    _local = threading.local()
+    SUPPORTED = os.open in os.supports_dir_fd and os.stat in os.supports_dir_fd and os.unlink in os.supports_dir_fd
+
+    def __init__(self, maxOpen: int = DIRFD_MAX_OPEN):
+        self.maxOpen = maxOpen
+        self._registered: set[str] = set()
+        self._open: OrderedDict[str, _Root] = OrderedDict()
+        self._lock = threading.Lock()
+        self.opens = 0  # dir fds opened
+        self.hits = 0  # calls served by an already open fd
+        self.evictions = 0
+
+    @staticmethod
+    def Supported() -> bool:
+        return DirFdContext.SUPPORTED
+
+    @staticmethod
+    def Key(pth: str) -> str:
+        return os.path.normcase(os.path.abspath(pth))
+
+    @staticmethod
+    def current() -> "DirFdContext | None":
+        return getattr(DirFdContext._local, "context", None)
+
+    @staticmethod
+    def Roots(cmds: tuple) -> tuple:
+        # the dirs a command's paths are relative to
+        if len(cmds) > 3 and cmds[0] in ("rename", "cpfile", "cpdir", "syncdir", "link", "unlink"):
+            return cmds[1], cmds[3]
+        if len(cmds) > 4 and cmds[0] in ("mvglob", "cpglob"):
+            return cmds[1], cmds[4]
+        return cmds[1:2]
+
+    def bound(self, run: Callable[[tuple], tuple]) -> Callable[[tuple], tuple]:
+        # run with this context active in whichever thread run is called
+        if not DirFdContext.Supported():
+            return run
+
+        def relative(cmds: tuple) -> tuple:
+            for root in DirFdContext.Roots(cmds):
+                if root and isinstance(root, str):
+                    self.register(root)
+            DirFdContext._local.context = self
+            try:
+                return run(cmds)
+            finally:
+                DirFdContext._local.context = None
+        return relative
+
+    def register(self, root: str) -> None:
+        key = DirFdContext.Key(root)
+        if key not in self._registered:
+            with self._lock:
+                self._registered.add(key)
+
+    def close(self) -> None:
+        # fds in use are closed by their last user
+        with self._lock:
+            for root in self._open.values():
+                root.dropped = True
+                if not root.pins:
+                    os.close(root.fd)
+            self._open.clear()
+            self._registered.clear()
+
+    def _rootOf(self, key: str) -> str | None:
+        # the deepest registered root strictly above key
+        parent = os.path.dirname(key)
+        while parent != key:
+            if parent in self._registered:
+                return parent
+            key, parent = parent, os.path.dirname(parent)
+        return None
+
+    def _acquire(self, rootKey: str) -> _Root | None:
+        with self._lock:
+            root = self._open.get(rootKey)
+            if root is not None:
+                self._open.move_to_end(rootKey)
+                root.pins += 1
+                self.hits += 1
+                return root
+        try:  # a missing root is not remembered, it may be created later in the batch
+            fd = os.open(rootKey, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0) | getattr(os, "O_CLOEXEC", 0))
+        except OSError:
+            return None
+        with self._lock:
+            if rootKey in self._open:  # opened meanwhile by another thread
+                os.close(fd)
+                root = self._open[rootKey]
+                self._open.move_to_end(rootKey)
+            else:
+                root = self._open[rootKey] = _Root(fd)
+                self.opens += 1
+            root.pins += 1  # before evicting, the new root must not be taken
+            self._evict()
+            return root
+
+    def _release(self, root: _Root) -> None:
+        with self._lock:
+            root.pins -= 1
+            if root.dropped and not root.pins:
+                os.close(root.fd)
+
+    def _evict(self) -> None:
+        # under self._lock, pinned roots are skipped
+        for rootKey in list(self._open):
+            if len(self._open) <= self.maxOpen:
+                return
+            root = self._open[rootKey]
+            if not root.pins:
+                del self._open[rootKey]
+                os.close(root.fd)
+                self.evictions += 1
+
+    @contextlib.contextmanager
+    def at(self, pth: str):
+        # yields (dirFd, path relative to it), (None, pth) when pth is under no open-able root
+        key = DirFdContext.Key(pth)
+        rootKey = self._rootOf(key)
+        root = self._acquire(rootKey) if rootKey is not None else None
+        if root is None:
+            yield None, pth
+            return
+        try:
+            yield root.fd, key[len(rootKey):].lstrip(os.sep)
+        finally:
+            self._release(root)
+
+    def removed(self, pth: str, emptyParents: bool = False) -> None:
+        # roots at or under pth(and above it when emptyParents) no longer are what was opened
+        key = DirFdContext.Key(pth)
+        with self._lock:
+            for rootKey in list(self._open):
+                if rootKey == key or rootKey.startswith(key.rstrip(os.sep) + os.sep) or \
+                        (emptyParents and key.startswith(rootKey.rstrip(os.sep) + os.sep)):
+                    root = self._open.pop(rootKey)
+                    root.dropped = True
+                    if not root.pins:
+                        os.close(root.fd)
+
+    # helpers for FileBackend/CopyEngine/StatCache: plain path calls when no context is active in this thread
+
+    @staticmethod
+    def NotifyRemoved(pth: str, emptyParents: bool = False) -> None:
+        context = DirFdContext.current()
+        if context is not None:
+            context.removed(pth, emptyParents)
+
+    @staticmethod
+    def Call(func: Callable, pth: str, *args, **kwargs):
+        # func(pth, *args) as func(rel, *args, dir_fd=fd) under the root of pth. func takes dir_fd, e.g., os.stat
+        context = DirFdContext.current()
+        if context is None:
+            return func(pth, *args, **kwargs)
+        with context.at(pth) as (fd, rel):
+            if fd is None:
+                return func(pth, *args, **kwargs)
+            return func(rel, *args, dir_fd=fd, **kwargs)
+
+    @staticmethod
+    def Rename(src: str, dst: str) -> None:
+        context = DirFdContext.current()
+        if context is None:
+            return os.rename(src, dst)
+        with context.at(src) as (srcFd, srcRel), context.at(dst) as (dstFd, dstRel):
+            os.rename(srcRel, dstRel, src_dir_fd=srcFd, dst_dir_fd=dstFd)
+
+    _renameNoReplace = None
+
+    @staticmethod
+    def _RenameNoReplaceCall():
+        # renameat2(RENAME_NOREPLACE) on Linux, renameatx_np(RENAME_EXCL) on macOS, False elsewhere.
+        # Returns (call, AT_FDCWD) with call(srcFd, src, dstFd, dst) -> 0 or the errno
+        if DirFdContext._renameNoReplace is None:
+            renameNoReplace = False
+            if sys.platform.startswith("linux") or sys.platform == "darwin":
+                import ctypes
+                import ctypes.util
+                try:
+                    libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+                    if sys.platform == "darwin":
+                        func, flags, atFdCwd = libc.renameatx_np, 0x4, -2
+                    else:
+                        func, flags, atFdCwd = libc.renameat2, 0x1, -100
+                    func.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint)
+                    func.restype = ctypes.c_int
+
+                    def call(srcFd: int, src: str, dstFd: int, dst: str) -> int:
+                        if func(srcFd, os.fsencode(src), dstFd, os.fsencode(dst), flags) == 0:
+                            return 0
+                        return ctypes.get_errno()
+
+                    renameNoReplace = (call, atFdCwd)
+                except (OSError, AttributeError):  # e.g., glibc older than 2.28
+                    renameNoReplace = False
+            DirFdContext._renameNoReplace = renameNoReplace
+        return DirFdContext._renameNoReplace
+
+    @staticmethod
+    def RenameNoReplace(src: str, dst: str) -> None:
+        # Rename that raises FileExistsError instead of replacing a dst that exists, also one created meanwhile.
+        # Where the kernel or filesystem cannot do it atomically: link+unlink for files, lstat+rename for dirs
+        if os.name == "nt":
+            return os.rename(src, dst)  # never replaces there
+        context = DirFdContext.current()
+        with contextlib.ExitStack() as stack:
+            srcFd, srcRel = (None, src) if context is None else stack.enter_context(context.at(src))
+            dstFd, dstRel = (None, dst) if context is None else stack.enter_context(context.at(dst))
+            renameNoReplace = DirFdContext._RenameNoReplaceCall()
+            if renameNoReplace:
+                call, atFdCwd = renameNoReplace
+                err = call(atFdCwd if srcFd is None else srcFd, srcRel, atFdCwd if dstFd is None else dstFd, dstRel)
+                if not err:
+                    return
+                if err not in (errno.EINVAL, errno.ENOSYS, errno.ENOTSUP, errno.EOPNOTSUPP):
+                    raise OSError(err, os.strerror(err), src, None, dst)  # FileExistsError for EEXIST
+            if not stat.S_ISDIR(os.lstat(srcRel, dir_fd=srcFd).st_mode):
+                try:
+                    os.link(srcRel, dstRel, src_dir_fd=srcFd, dst_dir_fd=dstFd, follow_symlinks=False)
+                except FileExistsError:
+                    raise
+                except OSError as e:
+                    if e.errno not in (errno.EPERM, errno.EXDEV, errno.ENOTSUP, errno.EOPNOTSUPP, errno.EMLINK):
+                        raise
+                else:
+                    os.unlink(srcRel, dir_fd=srcFd)
+                    return
+            try:  # last resort, a dst created between lstat and rename is replaced
+                os.lstat(dstRel, dir_fd=dstFd)
+            except FileNotFoundError:
+                return os.rename(srcRel, dstRel, src_dir_fd=srcFd, dst_dir_fd=dstFd)
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dst)
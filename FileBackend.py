@@ -0,0 +1,332 @@
+from urllib.parse import quote
+import shutil
+import threading
+import time
+
+import os
+import stat
+import sys
+
+from DirFdContext import DirFdContext
+
+BACKEND_ENV = "FILE_OPERATION_BACKEND"  # "os"(default) or "qt"
+
+
+class FileBackend:
+    # The filesystem primitives LambdaTable functions are made of. Paths use "/" like Qt does.
+    # Every backend gives the same results, so recover commands do not depend on which one ran.
+    name = ""
+    _current: "FileBackend | None" = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def current() -> "FileBackend":
+        backend = FileBackend._current
+        if backend is None:
+            backend = FileBackend.use(os.environ.get(BACKEND_ENV, OsBackend.name))
+        return backend
+
+    @staticmethod
+    def use(backend: "str | FileBackend") -> "FileBackend":
+        # a name("os", "qt") or an instance. The Qt backend imports PySide2 only here
+        if isinstance(backend, str):
+            backends = {OsBackend.name: OsBackend, QtBackend.name: QtBackend}
+            if backend not in backends:
+                raise ValueError(f"Unknown FileBackend {backend!r}, expected one of {sorted(backends)}")
+            backend = backends[backend]()
+        with FileBackend._lock:
+            FileBackend._current = backend
+        return backend
+
+    def homePath(self) -> str:
+        return (os.environ["USERPROFILE"] if sys.platform == "win32" else os.environ["HOME"]).replace(os.sep, "/")
+
+    def absoluteFilePath(self, pre: str, rel: str) -> str:
+        raise NotImplementedError
+
+    def absolutePath(self, pth: str) -> str:
+        # the absolute dir pth is in
+        raise NotImplementedError
+
+    def exists(self, pth: str) -> bool:
+        raise NotImplementedError
+
+    def isDir(self, pth: str) -> bool:
+        raise NotImplementedError
+
+    def mkpath(self, pth: str) -> bool:
+        raise NotImplementedError
+
+    def rmpath(self, pth: str) -> bool:
+        # remove the empty dir pth, then its parents while they are empty
+        raise NotImplementedError
+
+    def removeRecursively(self, pth: str) -> bool:
+        raise NotImplementedError
+
+    def removeFile(self, pth: str) -> bool:
+        raise NotImplementedError
+
+    def rename(self, pth: str, newPath: str) -> bool:
+        # fails if newPath exists
+        raise NotImplementedError
+
+    def createNew(self, pth: str) -> bool:
+        # an empty file, fails if pth exists
+        raise NotImplementedError
+
+    def link(self, pth: str, linkPath: str) -> bool:
+        raise NotImplementedError
+
+    def hasTrash(self) -> bool:
+        return True
+
+    def moveToTrash(self, pth: str) -> str | None:
+        # where pth is in the trash, None when it failed
+        raise NotImplementedError
+
+
+class OsBackend(FileBackend):
+    # os/os.scandir only, no import of Qt. The trash follows the freedesktop.org trash specification.
+    # Where there is none(Windows, macOS) moveToTrash and link are the Qt backend's: the recycle bin/Finder trash and
+    # .lnk shortcuts need its APIs, PySide2 is imported on first use there
+    name = "os"
+
+    def __init__(self):
+        self._qt: "QtBackend | None" = None
+
+    TRASH_NAME_ATTEMPTS = 100
+
+    @staticmethod
+    def HasXdgTrash() -> bool:
+        return sys.platform != "win32" and sys.platform != "darwin"
+
+    @staticmethod
+    def TrashName(baseName: str, attempt: int) -> str:
+        # baseName first, then a unique suffix: no probing of .2, .3, ... through every name taken before
+        if attempt == 0:
+            return baseName
+        return f"{baseName}.{time.time_ns():x}{os.urandom(2).hex()}"
+
+    def _qtBackend(self) -> "QtBackend":
+        if self._qt is None:
+            self._qt = QtBackend()
+        return self._qt
+
+    def absoluteFilePath(self, pre: str, rel: str) -> str:
+        if os.path.isabs(rel):
+            return rel
+        base = os.path.abspath(pre) if pre else os.getcwd()
+        return base.replace(os.sep, "/").rstrip("/") + "/" + rel
+
+    def absolutePath(self, pth: str) -> str:
+        pth = self.absoluteFilePath("", pth)
+        parent = pth.rsplit("/", 1)[0]  # like QFileInfo, "x/" is in "x"
+        return parent or "/"
+
+    # calls on paths go through DirFdContext: relative to an open dir fd when executer runs with one
+
+    def exists(self, pth: str) -> bool:
+        try:
+            DirFdContext.Call(os.stat, pth)
+        except (OSError, ValueError):
+            return False
+        return True
+
+    def isDir(self, pth: str) -> bool:
+        try:
+            return stat.S_ISDIR(DirFdContext.Call(os.stat, pth).st_mode)
+        except (OSError, ValueError):
+            return False
+
+    def mkpath(self, pth: str) -> bool:
+        pth = pth.rstrip("/") or "/"
+        try:
+            DirFdContext.Call(os.mkdir, pth, 0o777)
+        except FileExistsError:
+            return self.isDir(pth)
+        except FileNotFoundError:  # parents first
+            parent = os.path.dirname(pth)
+            if parent == pth or not self.mkpath(parent):
+                return False
+            try:
+                DirFdContext.Call(os.mkdir, pth, 0o777)
+            except FileExistsError:
+                return self.isDir(pth)
+            except OSError:
+                return False
+        except OSError:
+            return False
+        return True
+
+    def rmpath(self, pth: str) -> bool:
+        pth = self.absoluteFilePath("", pth).rstrip("/")
+        removed = False
+        while pth:
+            try:
+                if not stat.S_ISDIR(os.stat(pth).st_mode):
+                    return False
+                os.rmdir(pth)
+            except OSError:
+                return removed
+            removed = True
+            pth = pth.rsplit("/", 1)[0]
+        return True
+
+    def removeRecursively(self, pth: str) -> bool:
+        if not os.path.isdir(pth):
+            return True
+        failed = list()
+
+        def onError(func, failedPath, excInfo):
+            try:  # like QDir.removeRecursively: a read-only entry is made writable and removed
+                os.chmod(failedPath, stat.S_IWRITE | stat.S_IREAD | stat.S_IEXEC)
+                func(failedPath)
+            except OSError:
+                failed.append(failedPath)
+
+        shutil.rmtree(pth, onerror=onError)
+        return not failed and not os.path.lexists(pth)
+
+    def removeFile(self, pth: str) -> bool:
+        try:
+            DirFdContext.Call(os.remove, pth)
+        except OSError:
+            return False
+        return True
+
+    def rename(self, pth: str, newPath: str) -> bool:
+        try:
+            DirFdContext.RenameNoReplace(pth, newPath)  # fails when newPath exists, also when created meanwhile
+        except OSError:
+            return False
+        return True
+
+    def createNew(self, pth: str) -> bool:
+        try:
+            os.close(DirFdContext.Call(os.open, pth, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0),
+                                       0o666))
+        except OSError:
+            return False
+        return True
+
+    def link(self, pth: str, linkPath: str) -> bool:
+        if not OsBackend.HasXdgTrash():
+            return self._qtBackend().link(pth, linkPath)
+        try:
+            os.symlink(pth, linkPath)
+        except OSError:
+            return False
+        return True
+
+    def trashDir(self, pth: str) -> str | None:
+        # the home trash when pth is on the home filesystem, else $topdir/.Trash-$uid
+        dataHome = os.environ.get("XDG_DATA_HOME") or os.path.join(self.homePath(), ".local/share")
+        homeTrash = os.path.join(dataHome, "Trash")
+        try:
+            dev = os.lstat(pth).st_dev
+            os.makedirs(dataHome, exist_ok=True)
+            if os.stat(dataHome).st_dev == dev:
+                return homeTrash
+        except OSError:
+            return None
+        top = os.path.dirname(os.path.abspath(pth))
+        while os.path.dirname(top) != top and os.stat(os.path.dirname(top)).st_dev == dev:
+            top = os.path.dirname(top)
+        return os.path.join(top, f".Trash-{os.getuid()}") if hasattr(os, "getuid") else None
+
+    def hasTrash(self) -> bool:
+        return OsBackend.HasXdgTrash() or self._qtBackend().hasTrash()
+
+    def moveToTrash(self, pth: str) -> str | None:
+        if not OsBackend.HasXdgTrash():
+            return self._qtBackend().moveToTrash(pth)
+        trash = self.trashDir(pth)
+        if trash is None:
+            return None
+        filesDir, infoDir = os.path.join(trash, "files"), os.path.join(trash, "info")
+        try:
+            os.makedirs(filesDir, mode=0o700, exist_ok=True)
+            os.makedirs(infoDir, mode=0o700, exist_ok=True)
+        except OSError:
+            return None
+        absPath = os.path.abspath(pth)
+        baseName = os.path.basename(absPath.rstrip("/")) or "root"
+        info = ("[Trash Info]\nPath=" + quote(absPath) + "\nDeletionDate=" + time.strftime("%Y-%m-%dT%H:%M:%S") + "\n")
+        for attempt in range(OsBackend.TRASH_NAME_ATTEMPTS):
+            name = OsBackend.TrashName(baseName, attempt)
+            infoPath = os.path.join(infoDir, name + ".trashinfo")
+            try:  # the info file is created exclusively first, it reserves the name
+                fd = os.open(infoPath, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            except FileExistsError:
+                continue
+            except OSError:
+                return None
+            with os.fdopen(fd, "w") as f:
+                f.write(info)
+            trashPath = os.path.join(filesDir, name)
+            try:
+                DirFdContext.RenameNoReplace(absPath, trashPath)
+            except FileExistsError:
+                os.remove(infoPath)
+                continue
+            except OSError:
+                os.remove(infoPath)
+                return None
+            return trashPath.replace(os.sep, "/")
+        return None
+
+
+class QtBackend(FileBackend):
+    # QDir/QFile, what FileOperation was built on. PySide2 is imported when this backend is created
+    name = "qt"
+
+    def __init__(self):
+        from PySide2.QtCore import QDir, QFile, QFileInfo, QIODevice
+        self.QDir, self.QFile, self.QFileInfo, self.QIODevice = QDir, QFile, QFileInfo, QIODevice
+
+    def absoluteFilePath(self, pre: str, rel: str) -> str:
+        return self.QDir(pre).absoluteFilePath(rel)
+
+    def absolutePath(self, pth: str) -> str:
+        return self.QFileInfo(pth).absolutePath()
+
+    def exists(self, pth: str) -> bool:
+        return self.QFile.exists(pth)
+
+    def isDir(self, pth: str) -> bool:
+        return self.QDir(pth).exists()
+
+    def mkpath(self, pth: str) -> bool:
+        # QDir.mkpath fails when another thread creates one of the dirs at the same time
+        return self.QDir().mkpath(pth) or self.QDir(pth).exists()
+
+    def rmpath(self, pth: str) -> bool:
+        return self.QDir().rmpath(pth)
+
+    def removeRecursively(self, pth: str) -> bool:
+        return self.QDir(pth).removeRecursively()
+
+    def removeFile(self, pth: str) -> bool:
+        return self.QDir().remove(pth)
+
+    def rename(self, pth: str, newPath: str) -> bool:
+        return self.QFile.rename(pth, newPath)
+
+    def createNew(self, pth: str) -> bool:
+        textFile = self.QFile(pth)
+        ret = textFile.open(self.QIODevice.NewOnly)
+        textFile.close()
+        return ret
+
+    def link(self, pth: str, linkPath: str) -> bool:
+        return self.QFile.link(pth, linkPath)
+
+    def hasTrash(self) -> bool:
+        return hasattr(self.QFile, "moveToTrash")  # Qt >= 5.15
+
+    def moveToTrash(self, pth: str) -> str | None:
+        file = self.QFile(pth)
+        if not self.hasTrash():
+            return None
+        return file.fileName() if file.moveToTrash() else None
@@ -1,14 +1,59 @@
-from PySide2.QtCore import QFile, QFileInfo, QDir, QDirIterator, QIODevice
+from BatchControl import BatchControl
+from BatchJournal import BatchJournal
+from BatchScheduler import BatchScheduler
+from CopyEngine import CopyEngine, CopyStats
+from DeleteEngine import DeleteEngine, DeleteStats
+from DirFdContext import DirFdContext
+from FileBackend import FileBackend
+from Instrumentation import Instrumentation
+from LiveDirIndex import LiveDirIndex
+from MoveEngine import MoveEngine
+from PathMatcher import PathMatcher
+from RecoverCompactor import RecoverCompactor
+from RecoverLog import RecoverLog
+from StagedDelete import StagingArea, StagingReaper, StagingUnavailable
+from StatCache import StatCache
+from TrashBin import TrashBin
+from TreeIndex import TreeIndex
+from VerifyEngine import VerifyEngine
 import enum
+import re
 from typing import Callable
 
 import sys
 import os
+import time
+
+class _LazyClassAttribute:
+    # computed at each access instead of at import
+    def __init__(self, func: Callable[[], str]):
+        self.func = func
+
+    def __get__(self, instance, owner) -> str:
+        return self.func()
+
 
-DEFAULT_PATH = os.environ["USERPROFILE"] if sys.platform == "win32" else os.environ['HOME']
-DEFAULT_PATH_DIR = QDir(DEFAULT_PATH)
 class SystemPath:
-    starredPath = DEFAULT_PATH_DIR.absoluteFilePath("Documents")
+    starredPath = _LazyClassAttribute(lambda: FileBackend.current().absoluteFilePath(
+        FileBackend.current().homePath(), "Documents"))
+
+
+def __getattr__(name: str):
+    # DEFAULT_PATH and DEFAULT_PATH_DIR(a QDir, needs PySide2) are computed on first use, not at import
+    if name == "DEFAULT_PATH":
+        return FileBackend.current().homePath()
+    if name == "DEFAULT_PATH_DIR":
+        from PySide2.QtCore import QDir
+        return QDir(FileBackend.current().homePath())
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+CPDIR_WORKERS = min(8, os.cpu_count() or 1)
+CPDIR_LARGE_FILE_SIZE = 64 << 20  # bytes, files not smaller than it are copied on their own pool
+MOVE_WORKERS = CPDIR_WORKERS  # rename across devices, see MoveEngine
+MOVE_VERIFY_CHECKSUM = True  # False: the copy is verified by size and mtime only
+RMDIR_WORKERS = CPDIR_WORKERS  # subtrees rmdir removes in parallel, see DeleteEngine
+STAGING_REAPER = True  # executer starts the shared StagingReaper: staged entries are deleted after its retention
 
 
 class FileOperation:
@@ -29,6 +74,12 @@ class FileOperation:
         CANNOT_MAKE_LINK = 12
         DST_LINK_INEXIST = 13
         CANNOT_REMOVE_LINK = 14
+        CANCELLED = 15
+        SIZE_MISMATCH = 16
+        CHECKSUM_MISMATCH = 17
+        VERIFY_READ_FAILED = 18
+        INVALID_PATTERN = 19
+        STAGING_UNAVAILABLE = 20
         UNKNOWN_ERROR = -1
 
     BATCH_COMMAND_LIST_TYPE = list[tuple]
@@ -41,151 +92,506 @@ class FileOperation:
             return fullPath[:ind + 1], fullPath[(ind + 1):]
         return fullPath[:ind], fullPath[(ind + 1):]
 
+    # existence checks are answered by the LiveDirIndex watching pth, else go through the StatCache of the running
+    # executer, when it has one
+    @staticmethod
+    def _exists(pth: str) -> bool:
+        index = LiveDirIndex.For(pth)
+        if index is not None:
+            kind = index.kind(pth)
+            if kind is not None:
+                return kind != LiveDirIndex.ABSENT
+        cache = StatCache.current()
+        if cache is None:
+            Instrumentation.countFsCalls()
+            return FileBackend.current().exists(pth)
+        return cache.exists(pth)
+
+    @staticmethod
+    def _isDir(pth: str) -> bool:
+        index = LiveDirIndex.For(pth)
+        if index is not None:
+            kind = index.kind(pth)
+            if kind is not None:
+                return kind == LiveDirIndex.DIR
+        cache = StatCache.current()
+        if cache is None:
+            Instrumentation.countFsCalls()
+            return FileBackend.current().isDir(pth)
+        return cache.isDir(pth)
+
+    # every mutating call reports what it changed
+    @staticmethod
+    def _created(pth: str) -> None:
+        Instrumentation.countFsCalls()
+        StatCache.NotifyCreated(pth)
+        LiveDirIndex.NotifyChanged()
+
+    @staticmethod
+    def _removed(pth: str, emptyParents: bool = False) -> None:
+        Instrumentation.countFsCalls()
+        StatCache.NotifyRemoved(pth, emptyParents)
+        DirFdContext.NotifyRemoved(pth, emptyParents)
+        LiveDirIndex.NotifyChanged()
+
     @staticmethod
     def rmpath(pre: str, rel: str) -> RETURN_TYPE:
 
-        pth = QDir(pre).absoluteFilePath(rel)
-        if not QDir(pth).exists():
+        pth = FileBackend.current().absoluteFilePath(pre, rel)
+        if not FileOperation._isDir(pth):
             return FileOperation.ErrorCode.OK, list()  # already inexists
-        ret = QDir(pre).rmpath(rel)
-        return (FileOperation.ErrorCode.OK, ["mkpath", pre, rel]) if ret else (FileOperation.ErrorCode.CANNOT_REMOVE_DIR, list())
+        ret = FileBackend.current().rmpath(pth)
+        FileOperation._removed(pth, emptyParents=True)
+        if not ret and not FileBackend.current().isDir(pth):
+            return FileOperation.ErrorCode.OK, list()  # removed meanwhile by a parallel command, e.g. a twin rmpath
+        return (FileOperation.ErrorCode.OK, [("mkpath", pre, rel)]) if ret else (FileOperation.ErrorCode.CANNOT_REMOVE_DIR, list())
 
     @staticmethod
-    def rmdir(pre: str, rel: str) -> RETURN_TYPE:
-
-        pth = QDir(pre).absoluteFilePath(rel)
-        if not QDir(pth).exists():
+    def rmdir(pre: str, rel: str, maxWorkers: int = RMDIR_WORKERS, deleteStats: DeleteStats = None) -> RETURN_TYPE:
+        # the tree is removed by DeleteEngine(dir fds, subtrees on maxWorkers threads) where the OS supports it
+        pth = FileBackend.current().absoluteFilePath(pre, rel)
+        if not FileOperation._isDir(pth):
             return FileOperation.ErrorCode.OK, list()
-        ret = QDir(pth).removeRecursively()
+        if DeleteEngine.Supported() and not os.path.islink(pth):
+            ret = DeleteEngine.removeTree(pth, maxWorkers, deleteStats)
+        else:
+            ret = FileBackend.current().removeRecursively(pth)
+        FileOperation._removed(pth)
         return (FileOperation.ErrorCode.OK, list()) if ret else (FileOperation.ErrorCode.CANNOT_REMOVE_DIR, list())
 
+    @staticmethod
+    def rmtree(pre: str, rel: str, files: list[str] = (), dirs: list[str] = (),
+               maxWorkers: int = RMDIR_WORKERS) -> RETURN_TYPE:
+        # The compacted undo of a subtree the batch created, see RecoverCompactor. files/dirs: what the batch created
+        # under it. When the tree holds nothing else it goes in one rmdir, then its parents while empty like rmpath.
+        # Otherwise only the listed entries are removed and the foreign ones are kept, like the rmfile/rmpath it replaces
+        pth = FileBackend.current().absoluteFilePath(pre, rel)
+        if not FileOperation._isDir(pth):
+            return FileOperation.ErrorCode.OK, list()
+        try:
+            foundDirs, foundFiles = CopyEngine.ScanTree(pth)
+        except OSError:
+            return FileOperation.ErrorCode.CANNOT_REMOVE_DIR, list()
+        created = set(files).union(dirs)
+        if not created.issuperset(foundDirs) or not all(f in created for f, _ in foundFiles):
+            for f in files:
+                FileOperation.rmfile(pth, f)
+            for d in sorted(dirs, reverse=True):  # children before their parent
+                FileOperation.rmpath(pth, d)
+            return FileOperation.rmpath(pre, rel)
+        ret, _ = FileOperation.rmdir(pre, rel, maxWorkers)
+        if ret != FileOperation.ErrorCode.OK:
+            return ret, list()
+        FileBackend.current().rmpath(FileBackend.current().absolutePath(pth))
+        FileOperation._removed(pth, emptyParents=True)
+        return FileOperation.ErrorCode.OK, [("mkpath", pre, rel)]
+
     @staticmethod
     def rmfile(pre: str, rel: str) -> RETURN_TYPE:
 
-        pth = QDir(pre).absoluteFilePath(rel)
-        if not QFileInfo.exists(pth):
+        pth = FileBackend.current().absoluteFilePath(pre, rel)
+        if not FileOperation._exists(pth):
             return FileOperation.ErrorCode.OK, list()
-        ret = QDir(pre).remove(rel)
+        ret = FileBackend.current().removeFile(pth)
+        FileOperation._removed(pth)
         return (FileOperation.ErrorCode.OK, list()) if ret else (FileOperation.ErrorCode.CANNOT_REMOVE_FILE, list())
 
     @staticmethod
-    def moveToTrash(pre: str, rel: str) -> RETURN_TYPE:
+    def _CanStage(pth: str) -> bool:
+        # whether stageDelete of pth would find a staging dir, asked before a command changes anything
+        try:
+            StagingArea.StagingDirFor(pth)
+        except OSError:
+            return False
+        return True
 
-        pth = QDir(pre).absoluteFilePath(rel)
-        if not QFile.exists(pth):
+    @staticmethod
+    def stageDelete(pre: str, rel: str, pin: bool = False) -> RETURN_TYPE:
+        # O(1) delete of a file or a whole tree: one rename into the staging dir of its filesystem.
+        # StagingReaper deletes it physically later, until then the rename recover brings it back.
+        # pin: StagingReaper keeps it until the batch ends(see StagingArea.release), for commands that undo themselves
+        pth = FileBackend.current().absoluteFilePath(pre, rel)
+        if not FileOperation._exists(pth):
             return FileOperation.ErrorCode.OK, list()
-        file = QFile(pth)
-        ret = file.moveToTrash()
-        return (FileOperation.ErrorCode.OK, [("rename", "", file.fileName(), "", pth)]) if ret else (
+        try:
+            stagingDir, stagedName = StagingArea.stage(pth, pin)
+        except StagingUnavailable:  # refused: a delete without its undo is what rmdir/rmfile are for
+            Instrumentation.emit(Instrumentation.ERROR, f"No staging dir for {pth}")
+            return FileOperation.ErrorCode.STAGING_UNAVAILABLE, list()
+        except OSError:
+            return FileOperation.ErrorCode.CANNOT_REMOVE_DIR if FileOperation._isDir(pth) else FileOperation.ErrorCode.CANNOT_REMOVE_FILE, list()
+        FileOperation._removed(pth)
+        FileOperation._created(os.path.join(stagingDir, stagedName))
+        return FileOperation.ErrorCode.OK, [("rename", stagingDir, stagedName, pre, rel)]
+
+    @staticmethod
+    def moveToTrash(pre: str, rel: str) -> RETURN_TYPE:
+        # the TrashBin index remembers where pth went, see TrashBin.restore
+        pth = FileBackend.current().absoluteFilePath(pre, rel)
+        if not FileOperation._exists(pth):
+            return FileOperation.ErrorCode.OK, list()
+        trashPath = TrashBin.trash([pth])[0]
+        FileOperation._removed(pth)
+        if trashPath:
+            FileOperation._created(trashPath)
+        return (FileOperation.ErrorCode.OK, [("rename", "", trashPath, "", pth)]) if trashPath else (
             FileOperation.ErrorCode.UNKNOWN_ERROR, list())
 
+    @staticmethod
+    def moveAllToTrash(pre: str, rels: list[str]) -> RETURN_TYPE:
+        # moveToTrash of every pre/rel in one TrashBin pass, with the recover each one would have
+        pths = [FileBackend.current().absoluteFilePath(pre, rel) for rel in rels]
+        pths = [pth for pth in pths if FileOperation._exists(pth)]
+        cmds: FileOperation.BATCH_COMMAND_LIST_TYPE = list()
+        failed = False
+        for pth, trashPath in zip(pths, TrashBin.trash(pths)):
+            FileOperation._removed(pth)
+            if not trashPath:
+                failed = True
+                continue
+            FileOperation._created(trashPath)
+            cmds.append(("rename", "", trashPath, "", pth))
+        return (FileOperation.ErrorCode.UNKNOWN_ERROR if failed else FileOperation.ErrorCode.OK), cmds
+
     @staticmethod
     def rename(pre: str, rel: str, to: str, toRel: str) -> RETURN_TYPE:
-        pth = QDir(pre).absoluteFilePath(rel)
-        if not QFile.exists(pth):
+        pth = FileBackend.current().absoluteFilePath(pre, rel)
+        if not FileOperation._exists(pth):
             return FileOperation.ErrorCode.SRC_INEXIST, list()
-        absNewPath: str = QDir(to).absoluteFilePath(toRel)
-        if QFile(absNewPath).exists():
+        absNewPath: str = FileBackend.current().absoluteFilePath(to, toRel)
+        if FileOperation._exists(absNewPath):
             return FileOperation.ErrorCode.DST_FILE_OR_PATH_ALREADY_EXIST, list()
         cmds: FileOperation.BATCH_COMMAND_LIST_TYPE = list()
-        preNewPathFolder = QFileInfo(absNewPath).absolutePath()
-        if not QDir(preNewPathFolder).exists():
-            preNewPathFolderRet = QDir().mkpath(preNewPathFolder)  # only remove dirs
+        preNewPathFolder = FileBackend.current().absolutePath(absNewPath)
+        if not FileOperation._isDir(preNewPathFolder):
+            preNewPathFolderRet = FileBackend.current().mkpath(preNewPathFolder)  # only remove dirs
+            FileOperation._created(preNewPathFolder)
             if not preNewPathFolderRet:
                 return FileOperation.ErrorCode.DST_PRE_DIR_CANNOT_MAKE, list()
             cmds.append(("rmpath", "", preNewPathFolder))
-        ret = QFile.rename(pth, absNewPath)
-        if not ret:
-            return FileOperation.ErrorCode.UNKNOWN_ERROR, cmds
+        if not MoveEngine.SameDevice(pth, preNewPathFolder):  # rename(2) cannot move across devices
+            ret = MoveEngine.move(pth, absNewPath, MOVE_WORKERS, CPDIR_LARGE_FILE_SIZE, checksum=MOVE_VERIFY_CHECKSUM)
+            FileOperation._removed(pth)
+            FileOperation._created(absNewPath)
+            if ret.staged is not None:  # the source is only in the staging dir
+                cmds.append(("rename", *ret.staged, pre, rel))
+            if not ret.ok:
+                Instrumentation.emit(Instrumentation.ERROR, f"Failed MoveEngine.move({pth}, {absNewPath}) at {ret.step}")
+                return FileOperation.ErrorCode.CANCELLED if ret.step == MoveEngine.CANCELLED else FileOperation.ErrorCode.UNKNOWN_ERROR, cmds
+        else:
+            ret = FileBackend.current().rename(pth, absNewPath)
+            FileOperation._removed(pth)
+            FileOperation._created(absNewPath)
+            if not ret:
+                return FileOperation.ErrorCode.UNKNOWN_ERROR, cmds
         cmds.append(("rename", to, toRel, pre, rel))
         return FileOperation.ErrorCode.OK, cmds
 
     @staticmethod
-    def cpfile(pre: str, rel: str, to: str) -> RETURN_TYPE:
-        pth = QDir(pre).absoluteFilePath(rel)
-        if not QFileInfo.exists(pth):
+    def cpfile(pre: str, rel: str, to: str, copyStats: CopyStats = None, reflink: bool = False,
+               verify: bool = False) -> RETURN_TYPE:
+        # reflink: a copy-on-write clone where the filesystem supports it, a normal copy elsewhere
+        # verify: the copy is read back and compared with the source by blake2b digest
+        pth = FileBackend.current().absoluteFilePath(pre, rel)
+        if not FileOperation._exists(pth):
             return FileOperation.ErrorCode.SRC_INEXIST, list()
-        if not QDir(to).exists():
+        if not FileOperation._isDir(to):
             return FileOperation.ErrorCode.DST_DIR_INEXIST, list()
         
-        toPth = QDir(to).absoluteFilePath(rel)
-        if QFile.exists(toPth):
+        toPth = FileBackend.current().absoluteFilePath(to, rel)
+        if FileOperation._exists(toPth):
             return FileOperation.ErrorCode.DST_FILE_ALREADY_EXIST, list()
 
         cmds: FileOperation.BATCH_COMMAND_LIST_TYPE = list()
-        prePath = QFileInfo(toPth).absolutePath()
-        if not QDir(prePath).exists():
-            prePathRet = QDir().mkpath(prePath)  # only remove dirs
+        prePath = FileBackend.current().absolutePath(toPth)
+        if not FileOperation._isDir(prePath):
+            prePathRet = FileBackend.current().mkpath(prePath)  # only remove dirs
+            FileOperation._created(prePath)
             if not prePathRet:
                 return FileOperation.ErrorCode.DST_PRE_DIR_CANNOT_MAKE, list()
             cmds.append(("rmpath", "", prePath))
-        ret = QFile(pth).copy(toPth)
-        if not ret:
+        ret = CopyEngine.copyFile(pth, toPth, reflink)
+        StatCache.NotifyCreated(toPth)
+        if copyStats is not None:
+            copyStats.add(ret, toPth)
+        if not ret.ok:
             return FileOperation.ErrorCode.UNKNOWN_ERROR, cmds
         cmds.append(("rmfile", to, rel))
+        if verify:
+            return FileOperation._verifyCopy(os.path.dirname(pth), os.path.dirname(toPth), [os.path.basename(pth)]), cmds
         return FileOperation.ErrorCode.OK, cmds
 
     @staticmethod
-    def cpdir(pre: str, rel: str, to: str) -> RETURN_TYPE:
-        pth = QDir(pre).absoluteFilePath(rel)
-        if not QFile.exists(pth):
+    def cpdir(pre: str, rel: str, to: str, copyStats: CopyStats = None, maxWorkers: int = CPDIR_WORKERS,
+              largeFileSize: int = CPDIR_LARGE_FILE_SIZE, resume: bool = False, checksum: bool = False,
+              reflink: bool = False, dedup: bool = False, verify: bool = False, manifestPath: str = None) -> RETURN_TYPE:
+        # resume: an existing destination dir is completed instead of refused. Files already there with the same
+        # size and mtime(same size and blake2b digest when checksum) are kept, others are copied again.
+        # The recover list only holds what this run created.
+        # reflink, dedup: see CopyEngine.copyFiles, copyStats(perFile=True) tells the method of every file
+        # verify: every file is compared with its source by blake2b digest on a process pool. manifestPath: digests are
+        # kept there, a later verify re-reads only files whose size, mtime or inode changed
+        pth = FileBackend.current().absoluteFilePath(pre, rel)
+        if not FileOperation._exists(pth):
             return FileOperation.ErrorCode.SRC_INEXIST, list()
-        if not QDir(to).exists():
+        if not FileOperation._isDir(to):
             return FileOperation.ErrorCode.DST_DIR_INEXIST, list()
-        toPth: str = QDir(to).absoluteFilePath(rel)
-        if QFile.exists(toPth):
-            return FileOperation.ErrorCode.DST_FOLDER_ALREADY_EXIST, list()  # dir or file
+        toPth: str = FileBackend.current().absoluteFilePath(to, rel)
+        resuming = False
+        if FileOperation._exists(toPth):
+            if not resume:
+                return FileOperation.ErrorCode.DST_FOLDER_ALREADY_EXIST, list()  # dir or file
+            if not FileOperation._isDir(toPth):
+                return FileOperation.ErrorCode.DST_FILE_ALREADY_EXIST, list()
+            resuming = True
+        recoverList = RecoverLog()  # one ("rmfile", toPth, toRel) per file, toPth is stored only once
+        checkpoint = BatchJournal.Checkpoint()  # every step is journaled as it completes, see BatchJournal.rollback
+
+        if not resuming:
+            mkRootPthRet = FileBackend.current().mkpath(toPth)
+            StatCache.NotifyCreated(toPth)  # the whole new subtree
+            if not mkRootPthRet:
+                Instrumentation.emit(Instrumentation.ERROR, f"Failed mkpath({toPth})")
+                return FileOperation.ErrorCode.UNKNOWN_ERROR, recoverList
+            recoverList.append(("rmpath", to, rel))
+            checkpoint(recoverList[-1:])
+
+        # phase 1: enumerate once and create the whole skeleton, parent before child
+        try:
+            dirs, files = CopyEngine.ScanTree(pth, withSize=maxWorkers > 1 or dedup)
+        except OSError:
+            Instrumentation.emit(Instrumentation.ERROR, f"Failed CopyEngine.ScanTree({pth})")
+            return FileOperation.ErrorCode.UNKNOWN_ERROR, recoverList
+        for toRel in dirs:
+            toPath = toPth + "/" + toRel
+            try:
+                os.mkdir(toPath)
+            except FileExistsError:
+                if not os.path.isdir(toPath):
+                    return FileOperation.ErrorCode.DST_FILE_ALREADY_EXIST, recoverList
+                continue
+            except OSError:
+                Instrumentation.emit(Instrumentation.ERROR, f"Failed os.mkdir({toPath})")
+                return FileOperation.ErrorCode.UNKNOWN_ERROR, recoverList
+            recoverList.append(("rmpath", toPth, toRel))
+            checkpoint(recoverList[-1:])
+        allFiles = files
+        if resuming:
+            ret, files, recover = FileOperation._cpdirPending(pth, toPth, files, maxWorkers, checksum)
+            recoverList += recover  # before the copies' rmfile, so undo removes the new copy first
+            checkpoint(recover)
+            StatCache.NotifyCreated(toPth)  # dirs made and stale files staged in it
+            if ret != FileOperation.ErrorCode.OK:
+                return ret, recoverList
+
+        # phase 2: copy files on a pool. Only files really copied get a recover command, in enumeration order
+        jobs = [(pth + "/" + toRel, toPth + "/" + toRel, size) for toRel, size in files]
+        results = CopyEngine.copyFiles(jobs, maxWorkers, largeFileSize, copyStats, reflink, dedup,
+                                       lambda ind: checkpoint([("rmfile", toPth, files[ind][0])]))
+        for (toRel, _), cpRet in zip(files, results):
+            if cpRet:
+                recoverList.append(("rmfile", toPth, toRel))
+        if False in results:
+            failedInd = results.index(False)
+            Instrumentation.emit(Instrumentation.ERROR, f"Failed CopyEngine.copyFile({jobs[failedInd][0]}, {jobs[failedInd][1]})")
+            return FileOperation.ErrorCode.UNKNOWN_ERROR, recoverList
+        if None in results:  # cancelled between files
+            return FileOperation.ErrorCode.CANCELLED, recoverList
+        if verify:
+            return FileOperation._verifyCopy(pth, toPth, [toRel for toRel, _ in allFiles], manifestPath), recoverList
+        return FileOperation.ErrorCode.OK, recoverList
+
+    @staticmethod
+    def _verifyCopy(src: str, dst: str, rels: list[str], manifestPath: str = None) -> ErrorCode:
+        report = VerifyEngine.verifyTree(src, dst, rels, manifestPath)
+        for mismatch in report.mismatches:
+            Instrumentation.emit(Instrumentation.ERROR, f"Verify {src}/{mismatch.rel} -> {dst}/{mismatch.rel}: {mismatch.reason}")
+        if report.ok:
+            return FileOperation.ErrorCode.OK
+        return {VerifyEngine.SIZE: FileOperation.ErrorCode.SIZE_MISMATCH,
+                VerifyEngine.CHECKSUM: FileOperation.ErrorCode.CHECKSUM_MISMATCH,
+                VerifyEngine.UNREADABLE: FileOperation.ErrorCode.VERIFY_READ_FAILED}[report.mismatches[0].reason]
+
+    @staticmethod
+    def _cpdirPending(pth: str, toPth: str, files: list[tuple[str, int]], maxWorkers: int,
+                      checksum: bool) -> tuple[ErrorCode, list[tuple[str, int]], list[tuple]]:
+        # files of a resumed cpdir still to copy. Stale(partial or changed, maybe edited by the user) destination
+        # files are staged first, their recover is returned too. None is touched without a staging dir
+        existed = [os.path.lexists(toPth + "/" + toRel) for toRel, _ in files]
+        candidates = [f for f, e in zip(files, existed) if e]
+        isDone = lambda f: CopyEngine.upToDate(pth + "/" + f[0], toPth + "/" + f[0], checksum)
+        if maxWorkers > 1 and checksum and len(candidates) > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=maxWorkers) as pool:
+                done = set(f[0] for f, ok in zip(candidates, pool.map(isDone, candidates)) if ok)
+        else:
+            done = set(f[0] for f in candidates if isDone(f))
+        stale = [f[0] for f in candidates if f[0] not in done]
+        if stale and not FileOperation._CanStage(toPth + "/" + stale[0]):
+            return FileOperation.ErrorCode.STAGING_UNAVAILABLE, list(), list()
+        pending = list()
         recoverList = list()
+        for (toRel, size), e in zip(files, existed):
+            if toRel in done:
+                continue
+            if e:
+                toPath = toPth + "/" + toRel
+                if os.path.isdir(toPath) and not os.path.islink(toPath):
+                    return FileOperation.ErrorCode.DST_FOLDER_ALREADY_EXIST, list(), recoverList
+                ret, recover = FileOperation.stageDelete(toPth, toRel, pin=True)
+                recoverList += recover
+                if ret != FileOperation.ErrorCode.OK:
+                    Instrumentation.emit(Instrumentation.ERROR, f"Failed FileOperation.stageDelete({toPath})")
+                    return ret, list(), recoverList
+            pending.append((toRel, size))
+        return FileOperation.ErrorCode.OK, pending, recoverList
 
-        mkRootPthRet = QDir(to).mkpath(rel)
-        if not mkRootPthRet:
-            print(f"Failed QDir({to}).mkpath({rel})")
+    @staticmethod
+    def syncdir(pre: str, rel: str, to: str, delete: bool = False, copyStats: CopyStats = None,
+                maxWorkers: int = CPDIR_WORKERS, largeFileSize: int = CPDIR_LARGE_FILE_SIZE) -> RETURN_TYPE:
+        # Incremental cpdir: makes to/rel like pre/rel using the TreeIndex the last sync to to/rel left.
+        # Source files whose size, mtime and inode match the index are skipped without touching the destination.
+        # delete: entries gone from the source are removed from the destination too.
+        # Replaced and removed destination entries are staged and pinned until the batch ends(see stageDelete), so
+        # the recover list undoes the sync. Without a staging dir for them nothing is synced: STAGING_UNAVAILABLE
+        pth = FileBackend.current().absoluteFilePath(pre, rel)
+        if not FileOperation._isDir(pth):
+            return FileOperation.ErrorCode.SRC_DIR_INEXIST, list()
+        if not FileOperation._isDir(to):
+            return FileOperation.ErrorCode.DST_DIR_INEXIST, list()
+        toPth: str = FileBackend.current().absoluteFilePath(to, rel)
+        recoverList = RecoverLog()
+        checkpoint = BatchJournal.Checkpoint()
+        indexDir, indexName = TreeIndex.IndexDir(), TreeIndex.IndexName(toPth)
+        if os.path.lexists(indexDir + "/" + indexName) and not FileOperation._CanStage(indexDir + "/" + indexName):
+            return FileOperation.ErrorCode.STAGING_UNAVAILABLE, list()
+        if FileOperation._exists(toPth):
+            if not FileOperation._isDir(toPth):
+                return FileOperation.ErrorCode.DST_FILE_ALREADY_EXIST, list()
+            if not FileOperation._CanStage(toPth + "/" + indexName):  # any entry of toPth
+                return FileOperation.ErrorCode.STAGING_UNAVAILABLE, list()
+            last = TreeIndex.Load(indexDir + "/" + indexName)
+            if last is None or last.src != pth:
+                last = TreeIndex.Scan(toPth)  # no usable index, every file is compared with the destination one
+        else:
+            mkRootPthRet = FileBackend.current().mkpath(toPth)
+            FileOperation._created(toPth)
+            if not mkRootPthRet:
+                return FileOperation.ErrorCode.DST_PRE_DIR_CANNOT_MAKE, recoverList
+            recoverList.append(("rmpath", to, rel))
+            checkpoint(recoverList[-1:])
+            last = TreeIndex()
+        try:
+            now = TreeIndex.Scan(pth)
+        except OSError:
+            Instrumentation.emit(Instrumentation.ERROR, f"Failed TreeIndex.Scan({pth})")
             return FileOperation.ErrorCode.UNKNOWN_ERROR, recoverList
-        recoverList.append(("rmpath", to, rel))
-
-        # or shutil.copytree(pth, toPth)
-        src = QDirIterator(pth, [], QDir.NoDotAndDotDot | QDir.Dirs | QDir.Files, QDirIterator.Subdirectories)
-        relN = len(pth) + 1
-        while src.hasNext():
-            src.next()
-            fromPth = src.filePath()
-            toRel = fromPth[relN:]
-            toPath = QDir(toPth).absoluteFilePath(toRel)
-            if src.fileInfo().isDir():  # dir
-                if QFile.exists(toPath):
-                    if QFileInfo(toPath).isFile():
-                        return FileOperation.ErrorCode.DST_FILE_ALREADY_EXIST, recoverList
-                mkpthRet = QDir(toPth).mkpath(toRel)
-                if not mkpthRet:
-                    print(f"Failed QDir({toPth}).mkpath({toRel})")
-                    return FileOperation.ErrorCode.UNKNOWN_ERROR, recoverList
-                recoverList.append(("rmpath", toPth, toRel))
-            else:  # file
-                cpRet = QFile(fromPth).copy(toPath)
-                if not cpRet:
-                    print(f"Failed QFile({fromPth}).copy({toPath})")
-                    return FileOperation.ErrorCode.UNKNOWN_ERROR, recoverList
+
+        # what changed since the last sync, only these destination entries are looked at
+        changed = [toRel for toRel, e in now.files.items() if last.files.get(toRel) != e]
+        goneFiles = [toRel for toRel in last.files if toRel not in now.files]
+        goneDirs = [toRel for toRel in last.dirs if toRel not in now.dirs]
+        if not delete:  # only what is in the way of a new entry of the other kind
+            goneFiles = [toRel for toRel in goneFiles if toRel in now.dirs]
+            goneDirs = [toRel for toRel in goneDirs if toRel in now.files]
+        goneDirSet = set(goneDirs)
+        gone = [toRel for toRel in sorted(goneDirs + goneFiles)
+                if not any(parent in goneDirSet for parent in FileOperation._RelParents(toRel))]
+
+        # phase 1: stage what is removed or replaced, then make the new dirs
+        toCopy: list[tuple[str, int]] = list()
+        for toRel in changed:
+            toPath = toPth + "/" + toRel
+            if os.path.lexists(toPath):
+                if CopyEngine.upToDate(pth + "/" + toRel, toPath):
+                    continue
+                if toRel not in goneDirSet:
+                    gone.append(toRel)
+            toCopy.append((toRel, now.files[toRel].size))
+        for toRel in gone:
+            ret, recover = FileOperation.stageDelete(toPth, toRel, pin=True)
+            recoverList += recover
+            checkpoint(recover)
+            if ret != FileOperation.ErrorCode.OK:
+                return ret, recoverList
+        for toRel in sorted(now.dirs - last.dirs):
+            toPath = toPth + "/" + toRel
+            try:
+                os.mkdir(toPath)
+            except FileExistsError:
+                if not os.path.isdir(toPath):
+                    return FileOperation.ErrorCode.DST_FILE_ALREADY_EXIST, recoverList
+                continue
+            except OSError:
+                Instrumentation.emit(Instrumentation.ERROR, f"Failed os.mkdir({toPath})")
+                return FileOperation.ErrorCode.UNKNOWN_ERROR, recoverList
+            recoverList.append(("rmpath", toPth, toRel))
+            checkpoint(recoverList[-1:])
+        StatCache.NotifyCreated(toPth)
+
+        # phase 2: copy the added and changed files
+        jobs = [(pth + "/" + toRel, toPth + "/" + toRel, size) for toRel, size in toCopy]
+        results = CopyEngine.copyFiles(jobs, maxWorkers, largeFileSize, copyStats,
+                                       onCopied=lambda ind: checkpoint([("rmfile", toPth, toCopy[ind][0])]))
+        for (toRel, _), cpRet in zip(toCopy, results):
+            if cpRet:
                 recoverList.append(("rmfile", toPth, toRel))
+        if False in results:
+            failedInd = results.index(False)
+            Instrumentation.emit(Instrumentation.ERROR, f"Failed CopyEngine.copyFile({jobs[failedInd][0]}, {jobs[failedInd][1]})")
+            return FileOperation.ErrorCode.UNKNOWN_ERROR, recoverList
+        if None in results:  # cancelled between files
+            return FileOperation.ErrorCode.CANCELLED, recoverList
+
+        # phase 3: the new index, the old one is staged so undoing the sync brings it back
+        if not delete:  # entries kept in the destination stay known, so a later delete sync can find them
+            now.dirs |= set(toRel for toRel in last.dirs if toRel not in now.files)
+            now.files.update((toRel, e) for toRel, e in last.files.items()
+                             if toRel not in now.files and toRel not in now.dirs)
+        indexPath = indexDir + "/" + indexName
+        ret, recover = FileOperation.stageDelete(indexDir, indexName, pin=True)
+        recoverList += recover
+        checkpoint(recover)
+        if ret != FileOperation.ErrorCode.OK:
+            return ret, recoverList
+        try:
+            now.save(indexPath)
+        except OSError:
+            Instrumentation.emit(Instrumentation.ERROR, f"Failed TreeIndex.save({indexPath})")
+            return FileOperation.ErrorCode.UNKNOWN_ERROR, recoverList
+        FileOperation._created(indexPath)
+        recoverList.append(("rmfile", indexDir, indexName))
+        checkpoint(recoverList[-1:])
         return FileOperation.ErrorCode.OK, recoverList
 
+    @staticmethod
+    def _RelParents(rel: str) -> list[str]:
+        parents = list()
+        ind = rel.find("/")
+        while ind != -1:
+            parents.append(rel[:ind])
+            ind = rel.find("/", ind + 1)
+        return parents
+
     @staticmethod
     def touch(pre: str, rel: str) -> RETURN_TYPE:
-        if not QDir(pre).exists():
+        if not FileOperation._isDir(pre):
             return FileOperation.ErrorCode.DST_DIR_INEXIST, list()
-        pth = QDir(pre).absoluteFilePath(rel)
-        textFile = QFile(pth)
-        if textFile.exists():
+        pth = FileBackend.current().absoluteFilePath(pre, rel)
+        if FileOperation._exists(pth):
             return FileOperation.ErrorCode.OK, list()  # after all it exists
 
         cmds: FileOperation.BATCH_COMMAND_LIST_TYPE = list()
-        prePath = QFileInfo(pth).absolutePath()
-        if not QDir(prePath).exists():
-            prePathRet = QDir().mkpath(prePath)
+        prePath = FileBackend.current().absolutePath(pth)
+        if not FileOperation._isDir(prePath):
+            prePathRet = FileBackend.current().mkpath(prePath)
+            FileOperation._created(prePath)
             if not prePathRet:
                 return FileOperation.ErrorCode.DST_PRE_DIR_CANNOT_MAKE, cmds
             cmds.append(("rmpath", "", prePath))
 
-        ret = textFile.open(QIODevice.NewOnly)
+        ret = FileBackend.current().createNew(pth)
+        FileOperation._created(pth)
         if not ret:
             return FileOperation.ErrorCode.UNKNOWN_ERROR, cmds
         cmds.append(("rmfile", pre, rel))
@@ -193,77 +599,176 @@ class FileOperation:
 
     @staticmethod
     def mkpath(pre: str, rel: str) -> RETURN_TYPE:
-        preDir = QDir(pre)
-        if not preDir.exists():
+        if not FileOperation._isDir(pre):
             return FileOperation.ErrorCode.DST_DIR_INEXIST, list()
-        if preDir.exists(rel):
+        pth = FileBackend.current().absoluteFilePath(pre, rel)
+        if FileOperation._exists(pth):
             return FileOperation.ErrorCode.OK, list()  # after all it exists
 
-        ret = preDir.mkpath(rel)
+        ret = FileBackend.current().mkpath(pth)
+        FileOperation._created(pth)
         return (FileOperation.ErrorCode.OK, [("rmpath", pre, rel)]) if ret else (
             FileOperation.ErrorCode.UNKNOWN_ERROR, list())
 
+    # glob verbs: the files under pre/rel matching pattern(see PathMatcher) are found in one scandir pass and each one
+    # gets the command an expanded batch would have, ("rmfile", pre, rel/file) and so on, with the same recover.
+    # They stop at the first failed file like cpdir, the recover list then holds what was done until there
+
+    @staticmethod
+    def _globbed(pre: str, rel: str, pattern: str, to: str | None,
+                 run: Callable[[str], tuple[ErrorCode, list[tuple]]]) -> RETURN_TYPE:
+        pth = FileBackend.current().absoluteFilePath(pre, rel)
+        if not FileOperation._isDir(pth):
+            return FileOperation.ErrorCode.SRC_DIR_INEXIST, list()
+        if to is not None and not FileOperation._isDir(to):
+            return FileOperation.ErrorCode.DST_DIR_INEXIST, list()
+        try:
+            PathMatcher.Compile(pattern)
+        except (re.error, TypeError):
+            return FileOperation.ErrorCode.INVALID_PATTERN, list()
+        prune = FileBackend.current().absoluteFilePath(to, rel) if to is not None else None
+        recoverList = RecoverLog()
+        checkpoint = BatchJournal.Checkpoint()
+        try:
+            for fileRel in PathMatcher.Walk(pth, pattern, prune):
+                ret, recover = run(rel.rstrip("/") + "/" + fileRel if rel else fileRel)
+                recoverList += recover
+                checkpoint(recover)
+                if ret != FileOperation.ErrorCode.OK:
+                    return ret, recoverList
+        except OSError:
+            Instrumentation.emit(Instrumentation.ERROR, f"Failed PathMatcher.Walk({pth})")
+            return FileOperation.ErrorCode.UNKNOWN_ERROR, recoverList
+        return FileOperation.ErrorCode.OK, recoverList
+
+    @staticmethod
+    def rmglob(pre: str, rel: str, pattern: str) -> RETURN_TYPE:
+        return FileOperation._globbed(pre, rel, pattern, None, lambda fileRel: FileOperation.rmfile(pre, fileRel))
+
     @staticmethod
-    def executer(aBatch: BATCH_COMMAND_LIST_TYPE, srcCommand: BATCH_COMMAND_LIST_TYPE = None) -> tuple[bool, BATCH_COMMAND_LIST_TYPE]:
-        recoverList: FileOperation.BATCH_COMMAND_LIST_TYPE = list()
+    def mvglob(pre: str, rel: str, pattern: str, to: str) -> RETURN_TYPE:
+        return FileOperation._globbed(pre, rel, pattern, to,
+                                      lambda fileRel: FileOperation.rename(pre, fileRel, to, fileRel))
+
+    @staticmethod
+    def cpglob(pre: str, rel: str, pattern: str, to: str) -> RETURN_TYPE:
+        return FileOperation._globbed(pre, rel, pattern, to, lambda fileRel: FileOperation.cpfile(pre, fileRel, to))
+
+    @staticmethod
+    def _execute(cmds: tuple) -> RETURN_TYPE:
+        if not cmds:
+            return FileOperation.ErrorCode.OK, list()
+        try:
+            return FileOperation.LambdaTable[cmds[0]](*cmds[1:])
+        finally:
+            LiveDirIndex.NotifyChanged()  # also what a command changed without reporting it, e.g., cpdir's files
+
+    @staticmethod
+    def executer(aBatch: BATCH_COMMAND_LIST_TYPE, srcCommand: BATCH_COMMAND_LIST_TYPE = None, maxWorkers: int = 1,
+                 journal: BatchJournal = None, statCache: StatCache = None,
+                 control: BatchControl = None, dirFds: DirFdContext = None,
+                 compactRecover: bool = False) -> tuple[bool, BATCH_COMMAND_LIST_TYPE]:
+        # maxWorkers > 1: commands whose paths are independent run concurrently, see BatchScheduler.levels
+        # journal: intent and recover of every command are logged, see BatchJournal.rollback after a crash
+        # statCache: existence checks are cached for this run only, its hits/misses stay for the caller
+        # control: progress callbacks and cooperative cancel, commands not started then fail with CANCELLED
+        # dirFds: paths are resolved relative to open fds of the commands' pre/to dirs, closed when the run ends
+        # compactRecover: the recover of every subtree the batch created is one rmtree, see RecoverCompactor
+        # Per command stats go to Instrumentation hooks, nothing is measured when no hook is registered
+        start = time.perf_counter()
+        if STAGING_REAPER:
+            StagingReaper.ensureRunning()
+        run = FileOperation._execute
+        if statCache is not None:
+            run = statCache.bound(run)
+        if dirFds is not None:
+            run = dirFds.bound(run)
+        if control is not None:
+            run = control.bound(run, (FileOperation.ErrorCode.CANCELLED, list()))
+        if Instrumentation.hooks:
+            run = Instrumentation.instrumented(run)
+        if journal is not None:
+            journal.begin(len(aBatch))
+            run = journal.wrap(run)
+        if maxWorkers > 1:
+            results = BatchScheduler.execute(aBatch, run, maxWorkers)
+        else:
+            results = map(run, aBatch)
+        recoverList = RecoverLog()  # compact until the batch ends
         failedCommandCnt = 0
-        for ind, cmds in enumerate(aBatch):
+        for ind, (cmds, (ret, recover)) in enumerate(zip(aBatch, results)):
             if not cmds:
                 continue
             k: str = cmds[0]
             vals: tuple[str] = cmds[1:]
-            ret, recover = FileOperation.LambdaTable[k](*vals)
             if ret != FileOperation.ErrorCode.OK:
                 failedCommandCnt += 1
-                print(f"{k}{vals}")
+                Instrumentation.emit(Instrumentation.COMMAND_FAILED, (k, vals, ret))
             if k == "moveToTrash" and srcCommand:  # name in trashbin is now changed compared with last time in trashbin
                 assert len(recover) <= 1, f"moveToTrash recover command can only <= 1. Here is[{len(recover)}]"
                 if len(recover) == 1:
                     srcCommand[-ind - 1] = recover[0]
                 else:
                     srcCommand[-ind - 1] = tuple()
-            recoverList += recover
-        if failedCommandCnt != 0:
-            print("Above %d command(s) failed." % failedCommandCnt)
-        recoverList.reverse()  # in-place reverse
+            recoverList += recover  # batch order, so the reversed list undoes dependent commands last-first
+        Instrumentation.emit(Instrumentation.BATCH_DONE, {"commands": len(aBatch), "failed": failedCommandCnt,
+                                                          "seconds": time.perf_counter() - start})
+        if journal is not None:
+            journal.end(failedCommandCnt == 0)
+        StagingArea.release(recoverList)  # committed, staged entries may be reaped now
+        if statCache is not None:
+            statCache.clear()
+        if dirFds is not None:
+            dirFds.close()
+        recoverList.reverse()  # in-place reverse, O(1) for RecoverLog
+        if compactRecover:
+            recoverList = RecoverCompactor.compact(recoverList)
         return failedCommandCnt == 0, recoverList
 
     @staticmethod
-    def link(pre: str, rel: str, to: str = SystemPath.starredPath) -> tuple[bool, BATCH_COMMAND_LIST_TYPE]:
-        pth = QDir(pre).absoluteFilePath(rel)
-        if not QFile.exists(pth):
+    def link(pre: str, rel: str, to: str = None) -> tuple[bool, BATCH_COMMAND_LIST_TYPE]:
+        # to: SystemPath.starredPath when None
+        to = SystemPath.starredPath if to is None else to
+        pth = FileBackend.current().absoluteFilePath(pre, rel)
+        if not FileOperation._exists(pth):
             return FileOperation.ErrorCode.SRC_INEXIST, list()
-        if not QDir(to).exists():
+        if not FileOperation._isDir(to):
             return FileOperation.ErrorCode.DST_DIR_INEXIST, list()
-        toPath: str = QDir(to).absoluteFilePath(rel) + ".lnk"
-        toFile = QFile(toPath)
+        toPath: str = FileBackend.current().absoluteFilePath(to, rel) + ".lnk"
 
         cmds: FileOperation.BATCH_COMMAND_LIST_TYPE = list()
-        if toFile.exists():
-            if not QFile(toPath).moveToTrash():
+        if FileOperation._exists(toPath):
+            trashPath = FileBackend.current().moveToTrash(toPath)
+            if not trashPath:
                 return FileOperation.ErrorCode.CANNOT_REMOVE_FILE, cmds
-            cmds.append(("rename", "", toFile.fileName(), "", toPath))
+            FileOperation._removed(toPath)
+            cmds.append(("rename", "", trashPath, "", toPath))
 
-        prePath = QFileInfo(toPath).absolutePath()
-        if not QDir(prePath).exists():
-            prePathRet = QDir().mkpath(prePath)
+        prePath = FileBackend.current().absolutePath(toPath)
+        if not FileOperation._isDir(prePath):
+            prePathRet = FileBackend.current().mkpath(prePath)
+            FileOperation._created(prePath)
             if not prePathRet:
                 return FileOperation.ErrorCode.DST_PRE_DIR_CANNOT_MAKE, cmds
             cmds.append(("rmpath", "", prePath))
 
-        if not QFile.link(pth, toPath):
+        linkRet = FileBackend.current().link(pth, toPath)
+        FileOperation._created(toPath)
+        if not linkRet:
             return FileOperation.ErrorCode.CANNOT_MAKE_LINK, cmds
         cmds.append(("unlink", pre, rel + ".lnk", to))
         return FileOperation.ErrorCode.OK, cmds
 
     @staticmethod
-    def unlink(pre: str, rel: str, to: str = SystemPath.starredPath) -> bool:
+    def unlink(pre: str, rel: str, to: str = None) -> bool:
+        to = SystemPath.starredPath if to is None else to
         cmds: FileOperation.BATCH_COMMAND_LIST_TYPE = list()
-        toPath = QDir(to).absoluteFilePath(rel)
-        if not QFile.exists(toPath):
+        toPath = FileBackend.current().absoluteFilePath(to, rel)
+        if not FileOperation._exists(toPath):
             return FileOperation.ErrorCode.OK, cmds  # after all it not exist
 
-        ret = QDir().remove(toPath)
+        ret = FileBackend.current().removeFile(toPath)
+        FileOperation._removed(toPath)
         if not ret:
             return FileOperation.ErrorCode.CANNOT_REMOVE_LINK, cmds
         cmds.append(("link", pre, rel[:-4], to))  # move the trailing ".lnk"
@@ -271,14 +776,16 @@ class FileOperation:
 
     LambdaTable: dict[
         str, Callable[[], tuple[ErrorCode, list[tuple]]]] = \
-        {"rmfile": rmfile, "rmpath": rmpath, "rmdir": rmdir, "moveToTrash": moveToTrash,
+        {"rmfile": rmfile, "rmpath": rmpath, "rmdir": rmdir, "rmtree": rmtree, "moveToTrash": moveToTrash,
+         "moveAllToTrash": moveAllToTrash, "stageDelete": stageDelete,
          "touch": touch, "mkpath": mkpath,
          "rename": rename,
-         "cpfile": cpfile, "cpdir": cpdir,
+         "cpfile": cpfile, "cpdir": cpdir, "syncdir": syncdir,
+         "rmglob": rmglob, "mvglob": mvglob, "cpglob": cpglob,
          "link": link, "unlink": unlink}
 
 
 if __name__ == "__main__":
     # ret = QFile.rename(r"D:\aaaaaaaaaaa2", r"E:\aaaaaaaaaaa2")
-    fi = QDir("").absoluteFilePath("C:/")
+    fi = FileBackend.current().absoluteFilePath("", "C:/")
     print(fi)
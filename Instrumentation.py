@@ -0,0 +1,148 @@
+from typing import Any, Callable, NamedTuple
+import logging
+import threading
+import time
+
+logger = logging.getLogger("FileOperation")
+
+
+class CommandStats(NamedTuple):
+    verb: str
+    args: tuple
+    errorCode: Any  # FileOperation.ErrorCode
+    seconds: float
+    bytesMoved: int
+    fsCalls: int  # filesystem calls issued through FileOperation/CopyEngine, an approximation of syscalls
+
+
+class CommandCounters:
+    # bytes and filesystem calls of the command running now, may be shared with CopyEngine pool threads
+    __slots__ = ("bytesMoved", "fsCalls", "_lock")
+
+    def __init__(self):
+        self.bytesMoved = 0
+        self.fsCalls = 0
+        self._lock = threading.Lock()
+
+    def add(self, bytesMoved: int = 0, fsCalls: int = 0) -> None:
+        with self._lock:
+            self.bytesMoved += bytesMoved
+            self.fsCalls += fsCalls
+
+
+class LatencyHistogram:
+    # power-of-two buckets in microseconds: bucket i counts latencies in [2^(i-1), 2^i) us
+    BUCKETS = 40
+
+    def __init__(self):
+        self.buckets = [0] * LatencyHistogram.BUCKETS
+        self.count = 0
+        self.totalSeconds = 0.0
+        self.maxSeconds = 0.0
+
+    def add(self, seconds: float) -> None:
+        us = int(seconds * 1e6)
+        self.buckets[min(us.bit_length(), LatencyHistogram.BUCKETS - 1)] += 1
+        self.count += 1
+        self.totalSeconds += seconds
+        self.maxSeconds = max(self.maxSeconds, seconds)
+
+    def percentile(self, p: float) -> float:
+        # upper bound(seconds) of the bucket holding the p-th percentile
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return (1 << i) / 1e6
+        return self.maxSeconds
+
+
+class Instrumentation:
+    # Events executer and the LambdaTable functions emit. Hooks are called as hook(event, payload)
+    COMMAND = "command"  # payload: CommandStats, only emitted when some hook is registered
+    COMMAND_FAILED = "commandFailed"  # payload: (verb, args, ErrorCode)
+    BATCH_DONE = "batchDone"  # payload: {"commands", "failed", "seconds"}
+    ERROR = "error"  # payload: message
+
+    hooks: list[Callable[[str, Any], None]] = list()
+    _local = threading.local()
+
+    @staticmethod
+    def addHook(hook: Callable[[str, Any], None]) -> None:
+        Instrumentation.hooks = Instrumentation.hooks + [hook]  # copy on write, emit may be iterating
+
+    @staticmethod
+    def removeHook(hook: Callable[[str, Any], None]) -> None:
+        Instrumentation.hooks = [h for h in Instrumentation.hooks if h is not hook]
+
+    @staticmethod
+    def emit(event: str, payload: Any) -> None:
+        for hook in Instrumentation.hooks:
+            hook(event, payload)
+        if event == Instrumentation.COMMAND_FAILED:
+            if logger.isEnabledFor(logging.WARNING):
+                verb, args, ret = payload
+                logger.warning("%s%s failed: %s", verb, args, ret)
+        elif event == Instrumentation.BATCH_DONE:
+            if payload["failed"]:
+                logger.warning("%d of %d command(s) failed.", payload["failed"], payload["commands"])
+        elif event == Instrumentation.ERROR:
+            logger.error("%s", payload)
+
+    @staticmethod
+    def Current() -> CommandCounters | None:
+        return getattr(Instrumentation._local, "counters", None)
+
+    @staticmethod
+    def attach(counters: CommandCounters | None) -> CommandCounters | None:
+        # returns the counters attached before, to be attached again once the work for counters is done
+        previous = getattr(Instrumentation._local, "counters", None)
+        Instrumentation._local.counters = counters
+        return previous
+
+    @staticmethod
+    def countFsCalls(n: int = 1) -> None:
+        counters = getattr(Instrumentation._local, "counters", None)
+        if counters is not None:
+            counters.add(fsCalls=n)
+
+    @staticmethod
+    def instrumented(run: Callable[[tuple], tuple]) -> Callable[[tuple], tuple]:
+        def measured(cmds: tuple) -> tuple:
+            if not cmds:
+                return run(cmds)
+            counters = CommandCounters()
+            previous = Instrumentation.attach(counters)  # e.g., of a command running a nested batch
+            start = time.perf_counter()
+            try:
+                ret, recover = run(cmds)
+            finally:
+                Instrumentation.attach(previous)
+            Instrumentation.emit(Instrumentation.COMMAND, CommandStats(cmds[0], tuple(cmds[1:]), ret,
+                                                                       time.perf_counter() - start,
+                                                                       counters.bytesMoved, counters.fsCalls))
+            return ret, recover
+        return measured
+
+
+class LatencyHistograms:
+    # a hook keeping one LatencyHistogram per verb: Instrumentation.addHook(LatencyHistograms())
+    def __init__(self):
+        self.histograms: dict[str, LatencyHistogram] = dict()
+        self.bytesMoved: dict[str, int] = dict()
+        self.fsCalls: dict[str, int] = dict()
+        self._lock = threading.Lock()
+
+    def __call__(self, event: str, payload: Any) -> None:
+        if event != Instrumentation.COMMAND:
+            return
+        with self._lock:
+            histogram = self.histograms.get(payload.verb)
+            if histogram is None:
+                histogram = self.histograms[payload.verb] = LatencyHistogram()
+            histogram.add(payload.seconds)
+            self.bytesMoved[payload.verb] = self.bytesMoved.get(payload.verb, 0) + payload.bytesMoved
+            self.fsCalls[payload.verb] = self.fsCalls.get(payload.verb, 0) + payload.fsCalls
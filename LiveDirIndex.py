@@ -0,0 +1,404 @@
+import ctypes
+import ctypes.util
+import errno
+import math
+import struct
+import sys
+import threading
+import time
+
+import os
+import stat
+
+# inotify(7)
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_DONT_FOLLOW = 0x2000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0)
+
+
+class LiveDirIndex:
+    # In-memory index of a watched root kept current by Linux inotify: kind(and size) of every entry, the names of
+    # every dir. FileOperation asks it before any syscall, for existence checks and for the tree enumeration of
+    # cpdir/rmtree(CopyEngine.ScanTree). When it cannot answer(not under root, a symlink on the way, the inotify queue
+    # overflowed, the watch limit was reached) it says None and the caller does the real syscall.
+    # Events are read by a thread. FileOperation reports every change it makes(NotifyChanged), the next query reads
+    # the pending events first: the batch always sees its own changes, others' within the thread's latency.
+    # After an overflow the thread rebuilds the index, it answers None meanwhile.
+    DIR = "dir"
+    FILE = "file"
+    LINK = "link"  # a symlink, what it points to is not watched
+    ABSENT = "absent"
+    WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | \
+        IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW
+    EVENT = struct.Struct("iIII")  # wd, mask, cookie, len, then len bytes of NUL padded name
+    READ_SIZE = 64 << 10
+
+    _libc = None
+    _indexes: list["LiveDirIndex"] = list()  # watching now, see Watch
+    _registryLock = threading.Lock()
+
+    @staticmethod
+    def _Libc():
+        if LiveDirIndex._libc is None:
+            libc = None
+            if sys.platform.startswith("linux"):
+                try:
+                    libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+                    libc.inotify_init1.argtypes = [ctypes.c_int]
+                    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+                    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+                except (OSError, AttributeError):
+                    libc = None
+            LiveDirIndex._libc = libc or False
+        return LiveDirIndex._libc or None
+
+    @staticmethod
+    def Supported() -> bool:
+        return LiveDirIndex._Libc() is not None
+
+    @staticmethod
+    def Key(pth: str) -> str:
+        return os.path.normcase(os.path.abspath(pth))
+
+    @staticmethod
+    def Watch(root: str) -> "LiveDirIndex":
+        # index root and keep it current until close(). FileOperation uses it for every path under root
+        index = LiveDirIndex(root)
+        index.start()
+        with LiveDirIndex._registryLock:
+            LiveDirIndex._indexes = LiveDirIndex._indexes + [index]
+        return index
+
+    @staticmethod
+    def For(pth: str) -> "LiveDirIndex | None":
+        indexes = LiveDirIndex._indexes
+        if not indexes:
+            return None
+        key = LiveDirIndex.Key(pth)
+        for index in indexes:
+            if key == index.root or key.startswith(index._prefix):
+                return index
+        return None
+
+    @staticmethod
+    def NotifyChanged() -> None:
+        # the caller changed something: the next query of every index reads the events it caused first
+        for index in LiveDirIndex._indexes:
+            index._dirty = True
+
+    def __init__(self, root: str):
+        self.root = LiveDirIndex.Key(root)
+        self._prefix = self.root.rstrip(os.sep) + os.sep
+        self._lock = threading.RLock()
+        self._kinds: dict[str, str] = dict()
+        self._sizes: dict[str, int | None] = dict()  # None: changed since, stat again when asked
+        self._children: dict[str, dict[str, None]] = dict()  # dir -> names in it, an ordered set
+        self._wds: dict[int, str] = dict()
+        self._wdOf: dict[str, int] = dict()
+        self._fd: int | None = None
+        self._wakeRead, self._wakeWrite = os.pipe()
+        self._thread: threading.Thread | None = None
+        self._stopped = False
+        self._dirty = False
+        self._valid = False
+        self._needsRebuild = False
+        self._lastRead = time.monotonic()
+        self.hits = 0  # queries answered
+        self.misses = 0  # queries left to a syscall
+        self.events = 0
+        self.overflows = 0
+        self.rebuilds = 0
+
+    def start(self) -> None:
+        libc = LiveDirIndex._Libc()
+        if libc is None:
+            raise OSError(errno.ENOSYS, "inotify is not supported")
+        with self._lock:
+            self._rebuild()
+        self._thread = threading.Thread(target=self._run, name=f"LiveDirIndex({self.root})", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        with LiveDirIndex._registryLock:
+            LiveDirIndex._indexes = [index for index in LiveDirIndex._indexes if index is not self]
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._valid = False
+        os.write(self._wakeWrite, b"x")
+        if self._thread is not None:
+            self._thread.join()
+        for fd in (self._fd, self._wakeRead, self._wakeWrite):
+            if fd is not None:
+                os.close(fd)
+        self._fd = None
+
+    # ---- building and events, under self._lock ----
+
+    def _rebuild(self) -> None:
+        libc = LiveDirIndex._Libc()
+        if self._fd is not None:
+            os.close(self._fd)  # its watches and queued events go with it
+        self._kinds.clear()
+        self._sizes.clear()
+        self._children.clear()
+        self._wds.clear()
+        self._wdOf.clear()
+        self._needsRebuild = False
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            self._fd = None
+            self._valid = False
+            return
+        self.rebuilds += 1
+        self._lastRead = time.monotonic()
+        if not os.path.isdir(self.root) or os.path.islink(self.root):
+            self._valid = False
+            return
+        self._kinds[self.root] = LiveDirIndex.DIR
+        self._sizes[self.root] = 0
+        self._valid = self._addTree(self.root)
+
+    def _addTree(self, key: str) -> bool:
+        # watch key and the dirs under it, then list them. False when the watch limit is reached
+        libc = LiveDirIndex._Libc()
+        stack = [key]
+        while stack:
+            d = stack.pop()
+            wd = libc.inotify_add_watch(self._fd, os.fsencode(d), LiveDirIndex.WATCH_MASK)
+            if wd < 0:
+                if ctypes.get_errno() in (errno.ENOENT, errno.ENOTDIR):
+                    continue  # gone meanwhile, its parent's event drops it
+                return False
+            self._wds[wd] = d
+            self._wdOf[d] = wd
+            self._children.setdefault(d, dict())
+            try:
+                with os.scandir(d) as it:
+                    for entry in it:
+                        k = os.path.join(d, entry.name)
+                        if entry.is_dir(follow_symlinks=False):
+                            self._set(k, LiveDirIndex.DIR, 0)
+                            stack.append(k)
+                        elif entry.is_symlink():
+                            self._set(k, LiveDirIndex.LINK, None)
+                        else:
+                            self._set(k, LiveDirIndex.FILE, entry.stat(follow_symlinks=False).st_size)
+            except OSError:
+                continue
+        return True
+
+    def _set(self, key: str, kind: str, size: int | None) -> None:
+        self._kinds[key] = kind
+        self._sizes[key] = size
+        self._children.setdefault(os.path.dirname(key), dict())[os.path.basename(key)] = None
+
+    def _addPath(self, key: str) -> None:
+        try:
+            st = os.lstat(key)
+        except OSError:
+            return  # gone meanwhile, its delete event follows
+        if stat.S_ISDIR(st.st_mode):
+            self._set(key, LiveDirIndex.DIR, 0)
+            if not self._addTree(key):
+                self._overflowed()
+        elif stat.S_ISLNK(st.st_mode):
+            self._set(key, LiveDirIndex.LINK, None)
+        else:
+            self._set(key, LiveDirIndex.FILE, st.st_size)
+
+    def _drop(self, key: str) -> None:
+        libc = LiveDirIndex._Libc()
+        siblings = self._children.get(os.path.dirname(key))
+        if siblings is not None:
+            siblings.pop(os.path.basename(key), None)
+        stack = [key]
+        while stack:
+            k = stack.pop()
+            kind = self._kinds.pop(k, None)
+            self._sizes.pop(k, None)
+            if kind != LiveDirIndex.DIR:
+                continue
+            stack += [os.path.join(k, name) for name in self._children.pop(k, ())]
+            wd = self._wdOf.pop(k, None)
+            if wd is not None:
+                self._wds.pop(wd, None)
+                libc.inotify_rm_watch(self._fd, wd)  # EINVAL when the kernel dropped it already
+
+    def _overflowed(self) -> None:
+        self.overflows += 1
+        self._valid = False
+        self._needsRebuild = True
+        os.write(self._wakeWrite, b"x")  # the thread rebuilds
+
+    def _apply(self, wd: int, mask: int, name: str) -> None:
+        self.events += 1
+        if mask & IN_Q_OVERFLOW:
+            self._overflowed()
+            return
+        d = self._wds.get(wd)
+        if d is None:
+            return
+        if mask & IN_IGNORED:
+            del self._wds[wd]
+            if self._wdOf.get(d) == wd:
+                del self._wdOf[d]
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            if d == self.root:
+                self._overflowed()
+            return
+        if not name:
+            return
+        key = os.path.join(d, name)
+        if mask & (IN_DELETE | IN_MOVED_FROM):
+            self._drop(key)
+        elif mask & (IN_CREATE | IN_MOVED_TO):
+            self._drop(key)
+            self._addPath(key)
+        elif key in self._sizes:
+            self._sizes[key] = None
+
+    def _readEvents(self) -> None:
+        while self._fd is not None and not self._needsRebuild:
+            try:
+                data = os.read(self._fd, LiveDirIndex.READ_SIZE)
+            except BlockingIOError:
+                break
+            except OSError:
+                self._overflowed()
+                break
+            self._lastRead = time.monotonic()
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, nameLen = LiveDirIndex.EVENT.unpack_from(data, offset)
+                offset += LiveDirIndex.EVENT.size
+                name = os.fsdecode(data[offset:offset + nameLen].split(b"\0", 1)[0])
+                offset += nameLen
+                self._apply(wd, mask, name)
+        self._lastRead = time.monotonic()
+
+    def _run(self) -> None:
+        import select  # only started where inotify is, like the Linux-only imports of staleness
+        while True:
+            fd = self._fd
+            try:
+                readable, _, _ = select.select([self._wakeRead] + ([fd] if fd is not None else []), [], [])
+            except (OSError, ValueError):
+                readable = [self._wakeRead]
+            if self._wakeRead in readable:
+                os.read(self._wakeRead, 64)
+            with self._lock:
+                if self._stopped:
+                    return
+                self._readEvents()
+                if self._needsRebuild:
+                    self._rebuild()
+
+    def _sync(self) -> None:
+        if self._dirty:
+            self._dirty = False
+            self._readEvents()
+
+    # ---- queries ----
+
+    def kind(self, pth: str) -> str | None:
+        # DIR, FILE or ABSENT like os.stat would tell, None when the index cannot say
+        key = LiveDirIndex.Key(pth)
+        if key != self.root and not key.startswith(self._prefix):
+            return None
+        with self._lock:
+            self._sync()
+            if not self._valid:
+                self.misses += 1
+                return None
+            probe = key
+            kind = self._kinds.get(probe)
+            while kind is None and probe != self.root:
+                probe = os.path.dirname(probe)
+                kind = self._kinds.get(probe)
+            if kind == LiveDirIndex.LINK or kind is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return kind if probe == key else LiveDirIndex.ABSENT  # nothing of that name in an indexed dir
+
+    def scanTree(self, pth: str, withSize: bool = False) -> tuple[list[str], list[tuple[str, int]]] | None:
+        # CopyEngine.ScanTree of pth from the index, None when it cannot say
+        with self._lock:
+            if self.kind(pth) != LiveDirIndex.DIR:
+                return None
+            dirs: list[str] = list()
+            files: list[tuple[str, int]] = list()
+            stack: list[tuple[str, str]] = [(LiveDirIndex.Key(pth), "")]
+            while stack:
+                absDir, relDir = stack.pop()
+                subDirs = list()
+                for name in self._children.get(absDir, ()):
+                    k = os.path.join(absDir, name)
+                    rel = relDir + name
+                    kind = self._kinds[k]
+                    if kind == LiveDirIndex.DIR:
+                        dirs.append(rel)
+                        subDirs.append((k, rel + "/"))
+                    elif kind == LiveDirIndex.LINK and os.path.isdir(k):
+                        dirs.append(rel)  # listed but not descended into, like ScanTree
+                    else:
+                        files.append((rel, self._size(k) if withSize else 0))
+                stack += reversed(subDirs)
+            return dirs, files
+
+    def _size(self, key: str) -> int:
+        size = self._sizes.get(key)
+        if size is None:
+            try:
+                size = os.stat(key).st_size
+            except OSError:
+                return 0
+            if self._kinds.get(key) == LiveDirIndex.FILE:
+                self._sizes[key] = size
+        return size
+
+    # ---- reports ----
+
+    def staleness(self) -> float:
+        # seconds the index may lag behind the tree: 0.0 when no event is waiting, else since events were last read.
+        # inf while it cannot answer(overflowed, rebuilding, closed)
+        with self._lock:
+            if not self._valid or self._fd is None:
+                return math.inf
+            import fcntl
+            import termios
+            pending = struct.pack("i", 0)
+            try:
+                pending = fcntl.ioctl(self._fd, termios.FIONREAD, pending)
+            except OSError:
+                return math.inf
+            if not struct.unpack("i", pending)[0]:
+                return 0.0
+            return time.monotonic() - self._lastRead
+
+    def footprint(self) -> int:
+        # approximate bytes held by the index: its dicts, the paths and the names
+        with self._lock:
+            total = sum(sys.getsizeof(d) for d in (self._kinds, self._sizes, self._children, self._wds, self._wdOf))
+            total += sum(sys.getsizeof(k) for k in self._kinds)
+            total += sum(sys.getsizeof(names) + sum(sys.getsizeof(n) for n in names)
+                         for names in self._children.values())
+            return total
+
+    def __len__(self) -> int:
+        return len(self._kinds)
@@ -0,0 +1,149 @@
+from typing import NamedTuple
+import shutil
+import time
+
+import os
+import stat
+
+from CopyEngine import CopyEngine, CopyStats
+from DirFdContext import DirFdContext
+from StagedDelete import StagingArea, StagingUnavailable
+
+
+class MoveResult(NamedTuple):
+    ok: bool
+    step: str  # the step that failed, "" when ok
+    staged: tuple[str, str] | None  # (stagingDir, stagedName) of the source when it could not be put back
+
+
+class MoveEngine:
+    # Moves across filesystems, where rename(2) fails with EXDEV. Steps, each one safe to be interrupted:
+    #   COPY:    stream src into a hidden sibling of dst, files on a pool(see CopyEngine.copyFiles)
+    #   VERIFY:  every file of the copy matches its source(size and blake2b digest when checksum)
+    #   STAGE:   rename src into the staging dir of its filesystem, it is still there until the end
+    #   PUBLISH: rename the hidden copy to dst, never replacing a dst created meanwhile
+    #   COMMIT:  delete the staged source. Its failure leaves it to StagingReaper, the move still succeeded
+    # Before COPY a durable pin records src, the hidden copy and dst in the staging dir(see StagingArea.pin). A failed
+    # step undoes itself; if the process dies instead, StagingReaper keeps the staged src and, once the process is
+    # gone, renames it back and removes the hidden copy unless it was published(see StagingArea.recoverMoves).
+    COPY = "copy"
+    VERIFY = "verify"
+    STAGE = "stage"
+    PUBLISH = "publish"
+    CANCELLED = "cancelled"
+
+    @staticmethod
+    def SameDevice(src: str, dstParent: str) -> bool:
+        try:
+            return os.lstat(src).st_dev == os.stat(dstParent).st_dev
+        except OSError:
+            return True  # let rename report it
+
+    @staticmethod
+    def _copy(src: str, tmp: str, maxWorkers: int, largeFileSize: int, copyStats: CopyStats | None,
+              checksum: bool) -> str:
+        # the failed step, "" when tmp is a verified copy of src
+        st = os.lstat(src)
+        if stat.S_ISLNK(st.st_mode):
+            os.symlink(os.readlink(src), tmp)
+            return ""
+        if not stat.S_ISDIR(st.st_mode):
+            if not stat.S_ISREG(st.st_mode):
+                return MoveEngine.COPY  # a FIFO, socket or device node, reading it may block forever
+            results = CopyEngine.copyFiles([(src, tmp, st.st_size)], 1, largeFileSize, copyStats)
+            if results[0] is None:
+                return MoveEngine.CANCELLED
+            if not results[0]:
+                return MoveEngine.COPY
+            return "" if CopyEngine.upToDate(src, tmp, checksum) else MoveEngine.VERIFY
+
+        links: list[str] = list()  # kept as symlinks
+        others: list[str] = list()
+        dirs, files = CopyEngine.ScanTree(src, withSize=True, links=links, others=others)
+        if others:
+            return MoveEngine.COPY
+        os.mkdir(tmp)
+        for rel in dirs:
+            os.mkdir(tmp + "/" + rel)
+        for rel in links:
+            os.symlink(os.readlink(src + "/" + rel), tmp + "/" + rel)
+        jobs = [(src + "/" + rel, tmp + "/" + rel, size) for rel, size in files]
+        results = CopyEngine.copyFiles(jobs, maxWorkers, largeFileSize, copyStats)
+        if False in results:
+            return MoveEngine.COPY
+        if None in results:
+            return MoveEngine.CANCELLED
+        if checksum and maxWorkers > 1 and len(jobs) > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=maxWorkers) as pool:
+                verified = all(pool.map(lambda job: CopyEngine.upToDate(job[0], job[1], checksum), jobs))
+        else:
+            verified = all(CopyEngine.upToDate(s, d, checksum) for s, d, _ in jobs)
+        if not verified:
+            return MoveEngine.VERIFY
+        for rel in reversed([""] + dirs):  # children first, writing into a dir changes its mtime
+            dirSt = os.stat(src + "/" + rel)
+            os.chmod(tmp + "/" + rel, dirSt.st_mode & 0o7777)
+            os.utime(tmp + "/" + rel, ns=(dirSt.st_atime_ns, dirSt.st_mtime_ns))
+        return ""
+
+    @staticmethod
+    def _remove(pth: str) -> None:
+        if os.path.isdir(pth) and not os.path.islink(pth):
+            shutil.rmtree(pth, ignore_errors=True)
+        else:
+            try:
+                os.remove(pth)
+            except OSError:
+                pass
+
+    @staticmethod
+    def move(src: str, dst: str, maxWorkers: int = 1, largeFileSize: int = 64 << 20, copyStats: CopyStats = None,
+             checksum: bool = True) -> MoveResult:
+        # dst must not exist, its parent must
+        tmp = os.path.join(os.path.dirname(dst), f".{os.path.basename(dst)}.moving-{time.time_ns()}")
+        try:
+            stagingDir = StagingArea.StagingDirFor(src)
+            stagedName = StagingArea.StagedName(src)
+            StagingArea.pin(stagingDir, stagedName, {"move": src, "tmp": tmp, "dst": dst})
+        except StagingUnavailable:
+            stagingDir = None
+        except OSError:
+            return MoveResult(False, MoveEngine.STAGE, None)
+        try:
+            failedStep = MoveEngine._copy(src, tmp, maxWorkers, largeFileSize, copyStats, checksum)
+        except OSError:
+            failedStep = MoveEngine.COPY
+        if failedStep:
+            MoveEngine._remove(tmp)
+            if stagingDir:
+                StagingArea.unpin(stagingDir, stagedName)
+            return MoveResult(False, failedStep, None)
+        if stagingDir is None:  # publish first, then delete src for real: it is never the only copy lost
+            try:
+                DirFdContext.RenameNoReplace(tmp, dst)
+            except OSError:
+                MoveEngine._remove(tmp)
+                return MoveResult(False, MoveEngine.PUBLISH, None)
+            MoveEngine._remove(src)
+            return MoveResult(True, "", None)
+        staged = os.path.join(stagingDir, stagedName)
+        try:
+            os.rename(src, staged)
+        except OSError:
+            MoveEngine._remove(tmp)
+            StagingArea.unpin(stagingDir, stagedName)
+            return MoveResult(False, MoveEngine.STAGE, None)
+        try:
+            DirFdContext.RenameNoReplace(tmp, dst)  # FileExistsError when dst appeared during the copy
+        except OSError:
+            MoveEngine._remove(tmp)
+            try:
+                DirFdContext.RenameNoReplace(staged, src)
+            except OSError:  # stays pinned: StagingReaper puts it back once this process is gone
+                return MoveResult(False, MoveEngine.PUBLISH, (stagingDir, stagedName))
+            StagingArea.unpin(stagingDir, stagedName)
+            return MoveResult(False, MoveEngine.PUBLISH, None)
+        MoveEngine._remove(staged)
+        StagingArea.unpin(stagingDir, stagedName)
+        return MoveResult(True, "", None)
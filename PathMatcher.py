@@ -0,0 +1,44 @@
+from functools import lru_cache
+from typing import Callable, Iterator
+import fnmatch
+import re
+
+import os
+
+
+class PathMatcher:
+    # The filter of the glob verbs(rmglob, mvglob, cpglob): a glob, or a regex after "re:".
+    # It is matched against the file's path relative to the root, with "/". A glob without "/" is matched against the
+    # file name only, e.g., "*.tmp" is every .tmp file at any depth. Like fnmatch, "*" also matches "/".
+    # A regex is searched, anchor it with ^...$ if needed
+    REGEX_PREFIX = "re:"
+
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def Compile(pattern: str) -> tuple[Callable[[str], re.Match | None], bool]:
+        # (match function, whether it takes the relative path instead of the name), raises re.error
+        if pattern.startswith(PathMatcher.REGEX_PREFIX):
+            return re.compile(pattern[len(PathMatcher.REGEX_PREFIX):]).search, True
+        return re.compile(fnmatch.translate(pattern)).match, "/" in pattern
+
+    @staticmethod
+    def Walk(root: str, pattern: str, prune: str = None) -> Iterator[str]:
+        # Relative paths of the matching files(anything but a dir, symlinks are not followed), one os.scandir per dir.
+        # A dir is read to the end before its matches are yielded, so the caller may remove or move them meanwhile.
+        # prune: a dir not descended into, e.g., the destination of mvglob when it is under root
+        match, byPath = PathMatcher.Compile(pattern)
+        prune = os.path.normcase(os.path.abspath(prune)) if prune else None
+        stack: list[tuple[str, str]] = [(root, "")]
+        while stack:
+            absDir, relDir = stack.pop()
+            with os.scandir(absDir) as it:
+                entries = sorted(it, key=lambda e: e.name)
+            subDirs = list()
+            for entry in entries:
+                rel = relDir + entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if prune is None or os.path.normcase(os.path.abspath(entry.path)) != prune:
+                        subDirs.append((entry.path, rel + "/"))
+                elif match(rel if byPath else entry.name):
+                    yield rel
+            stack += reversed(subDirs)
@@ -0,0 +1,79 @@
+import os
+
+from BatchScheduler import BatchScheduler
+from RecoverLog import RecoverLog
+
+
+class RecoverCompactor:
+    # Folds the recover commands of a subtree the batch created itself into one
+    #   ("rmtree", pre, rel, files, dirs)
+    # files/dirs: what the batch created under it, relative with "/". A root is a dir whose recover is rmpath, i.e.,
+    # the batch made it. Its rmfile/rmpath(and inner rmtree) commands after the last exception are folded: an exception
+    # is any other recover command touching the root, a path under it or above it, e.g., the rename moving back a file
+    # which existed before the batch. Exceptions and the removals before them stay where they are, so everything that
+    # existed beforehand is back in place before the rmtree runs.
+    REMOVALS = ("rmfile", "rmpath", "rmtree")
+
+    @staticmethod
+    def _RemovedPath(cmds: tuple) -> str | None:
+        if len(cmds) < 3 or cmds[0] not in RecoverCompactor.REMOVALS or \
+                not isinstance(cmds[1], str) or not isinstance(cmds[2], str):
+            return None
+        return os.path.abspath(os.path.join(cmds[1], cmds[2]))
+
+    @staticmethod
+    def _Created(cmds: tuple) -> tuple[list[str], list[str]]:
+        if cmds[0] == "rmtree" and len(cmds) > 4:
+            return list(cmds[3]), list(cmds[4])
+        return list(), list()
+
+    @staticmethod
+    def compact(recoverList: list[tuple]) -> RecoverLog:
+        # recoverList in undo order(as executer returns it), so is the result
+        commands = list(recoverList)
+        names = [RecoverCompactor._RemovedPath(cmds) for cmds in commands]
+        keys = [os.path.normcase(name) if name is not None else None for name in names]
+        roots = {key for cmds, key in zip(commands, keys) if key is not None and cmds[0] != "rmfile"}
+        pending: dict[str, list[int]] = dict()  # root -> removals under it, in undo order
+        exceptionUnder: dict[str, int] = dict()  # path -> the last exception touching it or anything under it
+        exceptionAt: dict[str, int] = dict()  # path -> the last exception touching exactly it
+        lastBarrier = -1
+        replaced: dict[int, tuple] = dict()
+        folded: set[int] = set()
+        for ind, (cmds, key) in enumerate(zip(commands, keys)):
+            if not cmds:
+                continue
+            if key is None:
+                pths = BatchScheduler.touchedPaths(cmds)
+                if pths is BatchScheduler.BARRIER:
+                    lastBarrier = ind
+                    continue
+                for pth in pths:
+                    if pth == BatchScheduler.TRASH_KEY:
+                        continue
+                    exceptionAt[pth] = ind
+                    for a in BatchScheduler.Ancestors(pth):
+                        exceptionUnder[a] = ind
+                continue
+            ancestors = BatchScheduler.Ancestors(key)
+            if key in roots:
+                since = max(lastBarrier, exceptionUnder.get(key, -1), *(exceptionAt.get(a, -1) for a in ancestors[1:]))
+                inner = [i for i in pending.pop(key, ()) if i > since and i not in folded]
+                if inner:
+                    files, dirs = RecoverCompactor._Created(replaced.get(ind, cmds))
+                    for i in inner:
+                        rel = names[i][len(names[ind]):].lstrip(os.sep).replace(os.sep, "/")
+                        innerCmds = replaced.get(i, commands[i])
+                        if innerCmds[0] == "rmfile":
+                            files.append(rel)
+                            continue
+                        dirs.append(rel)
+                        innerFiles, innerDirs = RecoverCompactor._Created(innerCmds)
+                        files += [rel + "/" + f for f in innerFiles]
+                        dirs += [rel + "/" + d for d in innerDirs]
+                    folded.update(inner)
+                    replaced[ind] = ("rmtree", cmds[1], cmds[2], tuple(files), tuple(dirs))
+            for a in ancestors[1:]:
+                if a in roots:
+                    pending.setdefault(a, list()).append(ind)
+        return RecoverLog(replaced.get(ind, cmds) for ind, cmds in enumerate(commands) if ind not in folded)
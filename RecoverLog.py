@@ -0,0 +1,150 @@
+from array import array
+from collections.abc import Iterable, Sequence
+
+
+class RecoverLog(Sequence):
+    # A list of command tuples stored by columns:
+    #   _ops:      one byte per command, index into _verbs
+    #   _argStart: where the command's args begin in _args(one more item than commands)
+    #   _args:     >= 0 index into _strings, < 0 is -(index + 1) into the interned _prefixes
+    # Directory prefixes(e.g., the "to" of every ("rmfile", to, rel) that cpdir appends) are stored once.
+    # It reads like BATCH_COMMAND_LIST_TYPE: len, bool, [i], [a:b], iteration and reversed() give tuples, == and +
+    # work with lists. It is what executer and the multi-file verbs return, json.dumps needs list() of it.
+    __slots__ = ("_verbs", "_verbIndex", "_prefixes", "_prefixIndex", "_strings", "_ops", "_argStart", "_args",
+                 "_overrides", "_reversed")
+
+    EMPTY_OP = 255  # the empty tuple, e.g., a moveToTrash command that needs no recover
+    # positions of args which are directory prefixes, others are usually unique relative paths
+    PREFIX_POSITIONS: dict[str, tuple[int, ...]] = {
+        "rmfile": (0,), "rmpath": (0,), "rmdir": (0,), "rmtree": (0,), "moveToTrash": (0,), "stageDelete": (0,),
+        "touch": (0,), "mkpath": (0,),
+        "rename": (0, 2), "cpfile": (0, 2), "cpdir": (0, 2), "syncdir": (0, 2), "link": (0, 2), "unlink": (0, 2),
+    }
+
+    def __init__(self, commands: Iterable[tuple] = ()):
+        self._verbs: list[str] = list()
+        self._verbIndex: dict[str, int] = dict()
+        self._prefixes: list[str] = list()
+        self._prefixIndex: dict[str, int] = dict()
+        self._strings: list = list()
+        self._ops = array('B')
+        self._argStart = array('Q', [0])
+        self._args = array('q')
+        self._overrides: dict[int, tuple] = dict()  # physical index -> command assigned by __setitem__
+        self._reversed = False
+        self.extend(commands)
+
+    @staticmethod
+    def fromList(commands: Iterable[tuple]) -> "RecoverLog":
+        return RecoverLog(commands)
+
+    def toList(self) -> list[tuple]:
+        return list(iter(self))
+
+    def _intern(self, s: str) -> int:
+        ind = self._prefixIndex.get(s)
+        if ind is None:
+            ind = self._prefixIndex[s] = len(self._prefixes)
+            self._prefixes.append(s)
+        return -(ind + 1)
+
+    def _materialize(self) -> None:
+        # make physical order the logical order, needed only when appending after reverse()
+        commands = self.toList()
+        self._ops = array('B')
+        self._argStart = array('Q', [0])
+        self._args = array('q')
+        self._strings = list()
+        self._overrides = dict()
+        self._reversed = False
+        self.extend(commands)
+
+    def append(self, cmd: tuple) -> None:
+        if self._reversed:
+            self._materialize()
+        if not cmd:
+            self._ops.append(RecoverLog.EMPTY_OP)
+            self._argStart.append(len(self._args))
+            return
+        verb = cmd[0]
+        op = self._verbIndex.get(verb)
+        if op is None:
+            if len(self._verbs) == RecoverLog.EMPTY_OP:
+                raise ValueError(f"RecoverLog supports at most {RecoverLog.EMPTY_OP} verbs")
+            op = self._verbIndex[verb] = len(self._verbs)
+            self._verbs.append(verb)
+        prefixPositions = RecoverLog.PREFIX_POSITIONS.get(verb, ())
+        for pos, arg in enumerate(cmd[1:]):
+            if pos in prefixPositions and isinstance(arg, str):
+                self._args.append(self._intern(arg))
+            else:
+                self._args.append(len(self._strings))
+                self._strings.append(arg)
+        self._ops.append(op)
+        self._argStart.append(len(self._args))
+
+    def extend(self, commands: Iterable[tuple]) -> None:
+        for cmd in commands:
+            self.append(cmd)
+
+    def __iadd__(self, commands: Iterable[tuple]) -> "RecoverLog":
+        self.extend(commands)
+        return self
+
+    def __add__(self, commands: Iterable[tuple]) -> list[tuple]:
+        # a new list, like list + list, the log itself is unchanged
+        return [*self, *commands]
+
+    def __radd__(self, commands: Iterable[tuple]) -> list[tuple]:
+        return [*commands, *self]
+
+    def reverse(self) -> None:
+        # in-place and O(1), like list.reverse() but no item moves
+        self._reversed = not self._reversed
+
+    def _decode(self, physical: int) -> tuple:
+        if physical in self._overrides:
+            return self._overrides[physical]
+        op = self._ops[physical]
+        if op == RecoverLog.EMPTY_OP:
+            return tuple()
+        args = [self._prefixes[-a - 1] if a < 0 else self._strings[a]
+                for a in self._args[self._argStart[physical]:self._argStart[physical + 1]]]
+        return (self._verbs[op], *args)
+
+    def _physical(self, ind: int) -> int:
+        n = len(self._ops)
+        if ind < 0:
+            ind += n
+        if not 0 <= ind < n:
+            raise IndexError("RecoverLog index out of range")
+        return n - 1 - ind if self._reversed else ind
+
+    def __len__(self) -> int:
+        return len(self._ops)
+
+    def __getitem__(self, ind: int | slice) -> tuple | list[tuple]:
+        if isinstance(ind, slice):
+            return [self[i] for i in range(*ind.indices(len(self)))]
+        return self._decode(self._physical(ind))
+
+    def __setitem__(self, ind: int, cmd: tuple) -> None:
+        self._overrides[self._physical(ind)] = tuple(cmd)
+
+    def __iter__(self):
+        physicals = range(len(self._ops) - 1, -1, -1) if self._reversed else range(len(self._ops))
+        for physical in physicals:
+            yield self._decode(physical)
+
+    def __reversed__(self):
+        physicals = range(len(self._ops)) if self._reversed else range(len(self._ops) - 1, -1, -1)
+        for physical in physicals:
+            yield self._decode(physical)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (RecoverLog, list)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"RecoverLog({self.toList()!r})"
@@ -0,0 +1,367 @@
+import threading
+import time
+
+import errno
+import json
+import os
+import stat
+
+
+class StagingUnavailable(OSError):
+    # no private staging dir fits the path's filesystem: nothing can be deleted recoverably there
+    pass
+
+
+class StagingArea:
+    # One staging directory per filesystem(st_dev). Moving a path into it is a single rename,
+    # so it costs the same for one file or a tree of millions of entries.
+    # A staging dir is private to its user like a trash dir: made 0o700, and an existing one is used only when it is a
+    # real dir owned by the user that nobody else can enter. On the home filesystem it is in the user's data dir, else
+    # STAGING_DIR_NAME-$uid in the highest writable dir of the filesystem, never in the root dir
+    STAGING_DIR_NAME = ".FileOperationStaging"
+    HOME_STAGING_DIR_NAME = "FileOperationStaging"  # in $XDG_DATA_HOME
+    KNOWN_DIRS_NAME = "FileOperationStaging.dirs"  # beside it: every staging dir of the user a line each, see knownStagingDirs
+    # Pins: one durable marker per staged name in this subdir of the staging dir, StagingReaper never deletes a pinned
+    # name. A pin {"pid"} holds what a running batch may still need for its undo, released when executer ends, see
+    # release. A pin {"pid", "move": src, "tmp", "dst"} is an interrupted MoveEngine.move once pid is gone,
+    # StagingReaper puts the source back(see recoverMoves).
+    PINS_DIR_NAME = ".pins"
+    _stagingDirs: dict[int, str] = dict()  # st_dev -> staging dir
+    _lock = threading.Lock()
+
+    @staticmethod
+    def Private(stagingDir: str) -> str:
+        # stagingDir made or checked, see the class comment
+        os.makedirs(os.path.dirname(stagingDir), exist_ok=True)
+        try:
+            os.mkdir(stagingDir, 0o700)
+        except FileExistsError:
+            pass
+        st = os.lstat(stagingDir)
+        if not stat.S_ISDIR(st.st_mode):
+            raise StagingUnavailable(errno.ENOTDIR, "the staging dir is not a dir", stagingDir)
+        if hasattr(os, "getuid") and (st.st_uid != os.getuid() or st.st_mode & 0o077):
+            raise StagingUnavailable(errno.EPERM, "the staging dir is not private to this user", stagingDir)
+        return stagingDir
+
+    @staticmethod
+    def IsPrivate(stagingDir: str) -> bool:
+        # like Private, without making it
+        try:
+            st = os.lstat(stagingDir)
+        except OSError:
+            return False
+        return stat.S_ISDIR(st.st_mode) and not (
+                hasattr(os, "getuid") and (st.st_uid != os.getuid() or st.st_mode & 0o077))
+
+    @staticmethod
+    def register(stagingDir: str) -> str:
+        # use stagingDir for every path on its filesystem, instead of one at the top of the mount
+        StagingArea.Private(stagingDir)
+        dev = os.stat(stagingDir).st_dev
+        with StagingArea._lock:
+            new = StagingArea._stagingDirs.get(dev) != stagingDir
+            StagingArea._stagingDirs[dev] = stagingDir
+        if new:
+            StagingArea._remember(stagingDir)
+        return stagingDir
+
+    @staticmethod
+    def stagingDirs() -> list[str]:
+        # the ones of this process
+        with StagingArea._lock:
+            return list(StagingArea._stagingDirs.values())
+
+    @staticmethod
+    def KnownDirsPath() -> str:
+        return os.path.join(os.path.dirname(StagingArea.HomeStagingDir()), StagingArea.KNOWN_DIRS_NAME)
+
+    @staticmethod
+    def _remember(stagingDir: str) -> None:
+        # recorded for StagingReaper of any later process of the user
+        if stagingDir in StagingArea._ReadKnownDirs():
+            return
+        try:
+            os.makedirs(os.path.dirname(StagingArea.KnownDirsPath()), exist_ok=True)
+            with open(StagingArea.KnownDirsPath(), "a", encoding="utf-8") as f:
+                f.write(stagingDir + "\n")
+        except OSError:
+            pass
+
+    @staticmethod
+    def _ReadKnownDirs() -> list[str]:
+        try:
+            with open(StagingArea.KnownDirsPath(), encoding="utf-8") as f:
+                return [line.rstrip("\n") for line in f if line.strip()]
+        except OSError:
+            return list()
+
+    @staticmethod
+    def knownStagingDirs() -> list[str]:
+        # the staging dirs of this process, then the ones any process of the user recorded that are still private
+        dirs = StagingArea.stagingDirs()
+        for stagingDir in StagingArea._ReadKnownDirs():
+            if stagingDir not in dirs and StagingArea.IsPrivate(stagingDir):
+                dirs.append(stagingDir)
+        return dirs
+
+    @staticmethod
+    def HomeStagingDir() -> str:
+        dataHome = os.environ.get("XDG_DATA_HOME") or os.path.join(os.path.expanduser("~"), ".local/share")
+        return os.path.join(dataHome, StagingArea.HOME_STAGING_DIR_NAME)
+
+    @staticmethod
+    def StagingDirFor(pth: str) -> str:
+        # raises StagingUnavailable when there is no private staging dir on pth's filesystem
+        parent = os.path.dirname(os.path.abspath(pth))
+        dev = os.stat(parent).st_dev
+        with StagingArea._lock:
+            stagingDir = StagingArea._stagingDirs.get(dev)
+        if stagingDir is not None:
+            try:  # it may have been deleted or replaced since it was registered
+                if os.stat(StagingArea.Private(stagingDir)).st_dev == dev:
+                    return stagingDir
+            except OSError:
+                pass
+            with StagingArea._lock:
+                if StagingArea._stagingDirs.get(dev) == stagingDir:
+                    del StagingArea._stagingDirs[dev]
+        homeStagingDir = StagingArea.HomeStagingDir()
+        try:
+            os.makedirs(os.path.dirname(homeStagingDir), exist_ok=True)
+            onHome = os.stat(os.path.dirname(homeStagingDir)).st_dev == dev
+        except OSError:
+            onHome = False
+        if onHome:
+            return StagingArea.register(homeStagingDir)
+        # the highest writable ancestor that is still on this filesystem
+        chain = [parent]
+        while True:
+            up = os.path.dirname(chain[-1])
+            if up == chain[-1] or os.stat(up).st_dev != dev:
+                break
+            chain.append(up)
+        top = next((d for d in reversed(chain) if os.access(d, os.W_OK)), None)
+        if top is None or os.path.dirname(top) == top:  # never litter /
+            raise StagingUnavailable(errno.EACCES, "no staging dir on this filesystem", pth)
+        name = StagingArea.STAGING_DIR_NAME + (f"-{os.getuid()}" if hasattr(os, "getuid") else "")
+        return StagingArea.register(os.path.join(top, name))
+
+    @staticmethod
+    def StagedName(pth: str) -> str:
+        # staged time leads the name, so the reaper knows the age without any stat
+        return f"{time.time_ns()}-{threading.get_ident()}-{os.path.basename(pth)}"
+
+    @staticmethod
+    def StagedTime(stagedName: str) -> float:
+        try:
+            return int(stagedName.split("-", 1)[0]) / 1e9
+        except ValueError:
+            return 0.0
+
+    @staticmethod
+    def stage(pth: str, pin: bool = False) -> tuple[str, str]:
+        # pin: the staged name is pinned before pth moves, the caller or executer releases it
+        stagingDir = StagingArea.StagingDirFor(pth)
+        stagedName = StagingArea.StagedName(pth)
+        if pin:
+            StagingArea.pin(stagingDir, stagedName)
+        try:
+            os.rename(pth, os.path.join(stagingDir, stagedName))
+        except OSError:
+            if pin:
+                StagingArea.unpin(stagingDir, stagedName)
+            raise
+        return stagingDir, stagedName
+
+    @staticmethod
+    def pin(stagingDir: str, stagedName: str, note: dict = None) -> None:
+        # the marker is on disk(fsync-ed, with its dir entry) when this returns
+        pinsDir = os.path.join(stagingDir, StagingArea.PINS_DIR_NAME)
+        os.makedirs(pinsDir, 0o700, exist_ok=True)
+        fd = os.open(os.path.join(pinsDir, stagedName), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.write(fd, json.dumps({"pid": os.getpid(), **(note or {})}).encode("utf-8"))
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        dirFd = os.open(pinsDir, os.O_RDONLY)
+        try:
+            os.fsync(dirFd)
+        finally:
+            os.close(dirFd)
+
+    @staticmethod
+    def unpin(stagingDir: str, stagedName: str) -> None:
+        try:
+            os.remove(os.path.join(stagingDir, StagingArea.PINS_DIR_NAME, stagedName))
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def pins(stagingDir: str) -> dict[str, dict]:
+        # staged name -> note of every pin in stagingDir, an unreadable marker still pins
+        pinsDir = os.path.join(stagingDir, StagingArea.PINS_DIR_NAME)
+        try:
+            names = os.listdir(pinsDir)
+        except OSError:
+            return dict()
+        pins = dict()
+        for name in names:
+            try:
+                with open(os.path.join(pinsDir, name), "rb") as f:
+                    pins[name] = json.loads(f.read())
+            except (OSError, ValueError):
+                pins[name] = dict()
+        return pins
+
+    @staticmethod
+    def release(recoverList: list[tuple]) -> None:
+        # unpin what the rename recovers of a finished batch bring back, except interrupted moves
+        stagingDirs = set(StagingArea.stagingDirs())
+        for cmds in recoverList:
+            if cmds and cmds[0] == "rename" and cmds[1] in stagingDirs:
+                pinPath = os.path.join(cmds[1], StagingArea.PINS_DIR_NAME, cmds[2])
+                if os.path.exists(pinPath) and "move" not in StagingArea.pins(cmds[1]).get(cmds[2], dict()):
+                    StagingArea.unpin(cmds[1], cmds[2])
+
+    @staticmethod
+    def Alive(pid: int) -> bool:
+        if pid == os.getpid():
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except (OSError, ValueError, TypeError):
+            return True  # e.g., EPERM: it runs as another user
+        return True
+
+    @staticmethod
+    def recoverMoves(stagingDir: str) -> int:
+        # Finishes the pins of stagingDir whose process is gone: an interrupted move gets its source back and its
+        # hidden copy removed, unless the copy was published already. Pins of names no longer staged are dropped.
+        # Returns the sources put back
+        restored = 0
+        for stagedName, note in StagingArea.pins(stagingDir).items():
+            staged = os.path.join(stagingDir, stagedName)
+            if "move" not in note:
+                if not os.path.lexists(staged):
+                    StagingArea.unpin(stagingDir, stagedName)
+                continue
+            if StagingArea.Alive(note.get("pid")):
+                continue
+            src, tmp, dst = note["move"], note.get("tmp"), note.get("dst")
+            published = not (tmp and os.path.lexists(tmp)) and dst and os.path.lexists(dst)
+            if os.path.lexists(staged) and not published:
+                if os.path.lexists(src):
+                    continue  # something new took its place, left for a human
+                try:
+                    os.rename(staged, src)
+                except OSError:
+                    continue
+                restored += 1
+            if tmp and os.path.lexists(tmp):
+                from MoveEngine import MoveEngine
+                MoveEngine._remove(tmp)
+            StagingArea.unpin(stagingDir, stagedName)
+        return restored
+
+
+class StagingReaper(threading.Thread):
+    # Physically deletes staged items older than retentionSeconds, at most bytesPerSecond(0: unlimited), in every
+    # staging dir the user has(see StagingArea.knownStagingDirs).
+    # A staged item can be restored by its rename recover command until the reaper takes it. Pinned items are kept,
+    # and interrupted moves are rolled back first(see StagingArea.recoverMoves).
+    # executer starts one shared reaper per process(see ensureRunning), others are for callers with their own limits
+    _shared: "StagingReaper | None" = None
+    _sharedLock = threading.Lock()
+
+    @staticmethod
+    def ensureRunning() -> "StagingReaper":
+        with StagingReaper._sharedLock:
+            if StagingReaper._shared is None or not StagingReaper._shared.is_alive():
+                StagingReaper._shared = StagingReaper()
+                StagingReaper._shared.start()
+            return StagingReaper._shared
+    def __init__(self, retentionSeconds: float = 3600, bytesPerSecond: int = 0, scanIntervalSeconds: float = 60):
+        super().__init__(name="StagingReaper", daemon=True)
+        self.retentionSeconds = retentionSeconds
+        self.bytesPerSecond = bytesPerSecond
+        self.scanIntervalSeconds = scanIntervalSeconds
+        self.entriesRemoved = 0
+        self.bytesRemoved = 0
+        self._stopEvent = threading.Event()
+        self._windowStart = time.monotonic()
+        self._windowBytes = 0
+
+    def stop(self, wait: bool = True) -> None:
+        self._stopEvent.set()
+        if wait and self.is_alive():
+            self.join()
+
+    def run(self) -> None:
+        while not self._stopEvent.is_set():
+            try:
+                self.reapOnce()
+            except OSError:
+                pass  # e.g., a staging dir removed while it was walked, the next scan tries again
+            self._stopEvent.wait(self.scanIntervalSeconds)
+
+    def reapOnce(self) -> int:
+        reaped = 0
+        deadline = time.time() - self.retentionSeconds
+        for stagingDir in StagingArea.knownStagingDirs():
+            StagingArea.recoverMoves(stagingDir)
+            try:
+                names = os.listdir(stagingDir)
+            except OSError:
+                continue
+            pinned = StagingArea.pins(stagingDir)
+            for name in sorted(names):  # oldest first
+                if self._stopEvent.is_set():
+                    return reaped
+                if name == StagingArea.PINS_DIR_NAME or name in pinned or StagingArea.StagedTime(name) > deadline:
+                    continue
+                self._remove(os.path.join(stagingDir, name))
+                reaped += 1
+        return reaped
+
+    def _throttle(self, size: int) -> None:
+        if not self.bytesPerSecond:
+            return
+        self._windowBytes += size
+        ahead = self._windowBytes / self.bytesPerSecond - (time.monotonic() - self._windowStart)
+        if ahead > 0:
+            self._stopEvent.wait(ahead)
+        if time.monotonic() - self._windowStart > 1:
+            self._windowStart, self._windowBytes = time.monotonic(), 0
+
+    def _removeEntry(self, pth: str, st: os.stat_result) -> None:
+        try:
+            if stat.S_ISDIR(st.st_mode):
+                os.rmdir(pth)
+            else:
+                os.unlink(pth)
+        except OSError:
+            return
+        self.entriesRemoved += 1
+        self.bytesRemoved += st.st_size
+        self._throttle(st.st_size)
+
+    def _remove(self, pth: str) -> None:
+        try:
+            st = os.lstat(pth)
+        except OSError:
+            return
+        if stat.S_ISDIR(st.st_mode):
+            for root, dirs, files in os.walk(pth, topdown=False):
+                for name in files + dirs:
+                    entry = os.path.join(root, name)
+                    try:
+                        self._removeEntry(entry, os.lstat(entry))
+                    except OSError:
+                        pass
+                    if self._stopEvent.is_set():
+                        return
+        self._removeEntry(pth, st)
@@ -0,0 +1,204 @@
+from typing import Callable
+import threading
+
+import os
+import stat
+
+from DirFdContext import DirFdContext
+from Instrumentation import Instrumentation
+
+
+class StatCache:
+    # Stat results(None for inexist) of one executer run, keyed by absolute path.
+    # Every LambdaTable function reports what it mutated(created/removed/renamed), which drops
+    # exactly the entries that may have changed: the path, its cached descendants, and for creation
+    # the negative entries of its ancestors(mkpath may have made them).
+    # A miss stats outside the lock, its result is not cached when the path or an ancestor was invalidated meanwhile
+    # by another thread, which would have put back what the invalidation dropped.
+    # A hit is one dict lookup of the path as given: a normalized path is its own key, another absolute spelling of it
+    # is an alias dropped with its key. Only misses and mutations normalize and walk ancestors.
+    _local = threading.local()
+    _MISSING = object()
+
+    def __init__(self):
+        self._entries: dict[str, os.stat_result | None] = dict()
+        self._aliases: dict[str, os.stat_result | None] = dict()  # other absolute spelling -> entry of its key
+        self._aliasesOf: dict[str, list[str]] = dict()  # key -> its spellings in _aliases
+        self._children: dict[str, set[str]] = dict()  # cached path -> its cached direct children
+        self._generation = 0  # bumped by every invalidation while a stat is in flight
+        self._invalidated: dict[str, int] = dict()  # path -> generation of its last invalidation, while in flight
+        self._inFlight = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0  # == stat syscalls issued
+
+    @staticmethod
+    def Key(pth: str) -> str:
+        return os.path.normcase(os.path.abspath(pth))
+
+    @staticmethod
+    def current() -> "StatCache | None":
+        return getattr(StatCache._local, "cache", None)
+
+    def bound(self, run: Callable[[tuple], tuple]) -> Callable[[tuple], tuple]:
+        # run with this cache active in whichever thread run is called
+        def cached(cmds: tuple) -> tuple:
+            StatCache._local.cache = self
+            try:
+                return run(cmds)
+            finally:
+                StatCache._local.cache = None
+        return cached
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._aliases.clear()
+            self._aliasesOf.clear()
+            self._children.clear()
+            self._invalidated.clear()
+
+    def stat(self, pth: str) -> os.stat_result | None:
+        with self._lock:
+            st = self._entries.get(pth, StatCache._MISSING)
+            if st is StatCache._MISSING:
+                st = self._aliases.get(pth, StatCache._MISSING)
+            if st is not StatCache._MISSING:
+                self.hits += 1
+                return st
+        key = StatCache.Key(pth)
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._alias(pth, key)
+                return self._entries[key]
+            self.misses += 1
+            self._inFlight += 1
+            generation = self._generation
+        Instrumentation.countFsCalls()
+        try:
+            st = DirFdContext.Call(os.stat, key)
+        except (OSError, ValueError):
+            st = None
+        with self._lock:
+            self._inFlight -= 1
+            stale = self._invalidatedSince(key, generation)
+            if not self._inFlight:
+                self._invalidated.clear()
+            if stale:
+                return st
+            self._entries[key] = st
+            self._alias(pth, key)
+            # link key up to the first ancestor already linked, so dropping any ancestor reaches it
+            child, parent = key, os.path.dirname(key)
+            while parent != child:
+                siblings = self._children.get(parent)
+                if siblings is not None:
+                    siblings.add(child)
+                    break
+                self._children[parent] = {child}
+                child, parent = parent, os.path.dirname(parent)
+        return st
+
+    def exists(self, pth: str) -> bool:
+        return self.stat(pth) is not None
+
+    def isDir(self, pth: str) -> bool:
+        st = self.stat(pth)
+        return st is not None and stat.S_ISDIR(st.st_mode)
+
+    def isFile(self, pth: str) -> bool:
+        st = self.stat(pth)
+        return st is not None and stat.S_ISREG(st.st_mode)
+
+    def _alias(self, pth: str, key: str) -> None:
+        # caller holds the lock. Relative paths are not aliased, their key depends on the cwd of each call
+        if pth != key and os.path.isabs(pth) and pth not in self._aliases:
+            self._aliases[pth] = self._entries[key]
+            self._aliasesOf.setdefault(key, list()).append(pth)
+
+    def _invalidatedSince(self, key: str, generation: int) -> bool:
+        # key or an ancestor was invalidated after generation, caller holds the lock
+        if not self._invalidated:
+            return False
+        while True:
+            if self._invalidated.get(key, -1) > generation:
+                return True
+            parent = os.path.dirname(key)
+            if parent == key:
+                return False
+            key = parent
+
+    def _invalidate(self, key: str) -> None:
+        # caller holds the lock
+        if self._inFlight:
+            self._generation += 1
+            self._invalidated[key] = self._generation
+
+    def _unlink(self, key: str) -> None:
+        # drop the links of key and its ancestors once they have neither an entry nor cached children,
+        # caller holds the lock
+        while key not in self._entries and not self._children.get(key):
+            self._children.pop(key, None)
+            parent = os.path.dirname(key)
+            if parent == key or parent not in self._children:
+                return
+            self._children[parent].discard(key)
+            key = parent
+
+    def _drop(self, key: str) -> None:
+        # key and its cached subtree, caller holds the lock
+        stack = [key]
+        while stack:
+            k = stack.pop()
+            self._entries.pop(k, None)
+            for alias in self._aliasesOf.pop(k, ()):
+                del self._aliases[alias]
+            stack += self._children.pop(k, ())
+        self._unlink(key)
+
+    def created(self, pth: str) -> None:
+        key = StatCache.Key(pth)
+        with self._lock:
+            self._drop(key)
+            self._invalidate(key)
+            parent = os.path.dirname(key)
+            while parent != key:
+                st = self._entries.get(parent, StatCache._MISSING)
+                if st is None:
+                    self._drop(parent)
+                elif st is not StatCache._MISSING and not self._inFlight:
+                    return  # an existing ancestor, none above it can be cached as inexist
+                self._invalidate(parent)  # it may be made by this creation
+                key, parent = parent, os.path.dirname(parent)
+
+    def removed(self, pth: str, emptyParents: bool = False) -> None:
+        # emptyParents: like QDir.rmpath, the removal may have taken empty ancestors too
+        key = StatCache.Key(pth)
+        with self._lock:
+            self._drop(key)
+            self._invalidate(key)
+            if not emptyParents:
+                return
+            parent = os.path.dirname(key)
+            while parent != key:
+                self._entries.pop(parent, None)
+                for alias in self._aliasesOf.pop(parent, ()):
+                    del self._aliases[alias]
+                self._unlink(parent)
+                self._invalidate(parent)
+                key, parent = parent, os.path.dirname(parent)
+
+    # helpers for LambdaTable functions: no-op when no cache is active in this thread
+
+    @staticmethod
+    def NotifyCreated(pth: str) -> None:
+        cache = StatCache.current()
+        if cache is not None:
+            cache.created(pth)
+
+    @staticmethod
+    def NotifyRemoved(pth: str, emptyParents: bool = False) -> None:
+        cache = StatCache.current()
+        if cache is not None:
+            cache.removed(pth, emptyParents)
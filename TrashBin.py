@@ -0,0 +1,403 @@
+from typing import NamedTuple
+from urllib.parse import quote
+import json
+import threading
+import time
+
+import os
+import stat
+
+from DeleteEngine import DeleteEngine
+from DirFdContext import DirFdContext
+from FileBackend import FileBackend, OsBackend
+
+TRASH_INDEX_NAME = "FileOperationIndex.jsonl"  # beside files/ and info/ of the trash dir
+
+
+class TrashEntry(NamedTuple):
+    origPath: str
+    name: str  # in files/ and, + ".trashinfo", in info/
+    deletedAt: float  # time.time()
+    size: int | None  # bytes, None for a dir until purge sums it
+
+
+class PurgeStats(NamedTuple):
+    entries: int
+    bytesRemoved: int
+
+
+class _Index:
+    # The entries of one trash dir by original path and by name, replayed from its append-only index file:
+    #   {"o": original path, "n": name, "d": deleted at, "s": size} when trashed, {"n": name} when restored or purged
+    def __init__(self, trashDir: str):
+        self.trashDir = trashDir
+        self.pth = os.path.join(trashDir, TRASH_INDEX_NAME)
+        self.byOrig: dict[str, list[TrashEntry]] = dict()  # oldest first
+        self.byName: dict[str, TrashEntry] = dict()
+        self.records = 0
+        self.identity = None  # TrashBin.Identity of the file when it was read or written last
+        self.size = 0  # bytes of the file replayed into byOrig/byName
+        self.lock = threading.RLock()
+
+    def load(self) -> None:
+        self.byOrig.clear()
+        self.byName.clear()
+        self.records = 0
+        self.size = 0
+        self.identity = None
+        self._replay()
+
+    def _replay(self) -> None:
+        # the records from self.size on, up to the last complete line: one being appended is read next time
+        try:
+            with open(self.pth, "rb") as f:
+                identity = TrashBin.Identity(os.fstat(f.fileno()))
+                f.seek(self.size)
+                data = f.read()
+        except OSError:
+            return
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # torn by a crash
+            self.records += 1
+            if "o" in record:
+                self._add(TrashEntry(record["o"], record["n"], record["d"], record["s"]))
+            else:
+                self._drop(record["n"])
+        self.size += end
+        self.identity = identity
+
+    def refresh(self) -> None:
+        # catch up with what other processes appended, a replaced or truncated file is loaded again
+        try:
+            identity = TrashBin.Identity(os.stat(self.pth))
+        except OSError:
+            identity = None
+        if identity is not None and identity == self.identity:
+            return
+        if identity is None or self.identity is None or identity[:2] != self.identity[:2] or identity[2] < self.size:
+            self.load()
+        else:
+            self._replay()
+
+    def _openLocked(self):
+        # the index file for appending, locked against other processes' appends and rewrites
+        while True:
+            f = open(self.pth, "ab")
+            try:
+                import fcntl
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            except (ImportError, OSError):
+                return f
+            try:
+                if TrashBin.Identity(os.stat(self.pth))[:2] == TrashBin.Identity(os.fstat(f.fileno()))[:2]:
+                    return f
+            except OSError:
+                pass
+            f.close()  # rewritten while waiting for the lock
+
+    def _add(self, entry: TrashEntry) -> None:
+        self._drop(entry.name)
+        self.byName[entry.name] = entry
+        self.byOrig.setdefault(entry.origPath, list()).append(entry)
+
+    def _drop(self, name: str) -> TrashEntry | None:
+        entry = self.byName.pop(name, None)
+        if entry is not None:
+            entries = self.byOrig[entry.origPath]
+            entries.remove(entry)
+            if not entries:
+                del self.byOrig[entry.origPath]
+        return entry
+
+    def append(self, added: list[TrashEntry], dropped: list[str]) -> None:
+        # one write for the whole call, the file is rewritten when most of its records are dead
+        lines = [json.dumps({"o": e.origPath, "n": e.name, "d": e.deletedAt, "s": e.size}) for e in added]
+        lines += [json.dumps({"n": name}) for name in dropped]
+        data = "".join(line + "\n" for line in lines).encode("utf-8")
+        with self._openLocked() as f:
+            self.refresh()  # others' records go before ours
+            for name in dropped:
+                self._drop(name)
+            for entry in added:
+                self._add(entry)
+            self.records += len(lines)
+            if self.records > 2 * len(self.byName) + TrashBin.COMPACT_MIN_RECORDS:
+                self._compact()
+                return
+            f.write(data)
+            f.flush()
+            identity = TrashBin.Identity(os.fstat(f.fileno()))
+        if self.identity is not None and identity[:2] == self.identity[:2] and identity[2] == self.size + len(data):
+            self.identity, self.size = identity, identity[2]
+
+    def rewrite(self) -> None:
+        # only the live entries, merged with what other processes appended meanwhile
+        with self._openLocked():
+            self.refresh()
+            self._compact()
+
+    def _compact(self) -> None:
+        # the file lock is held
+        tmp = self.pth + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for e in self.byName.values():
+                f.write(json.dumps({"o": e.origPath, "n": e.name, "d": e.deletedAt, "s": e.size}) + "\n")
+        os.replace(tmp, self.pth)
+        st = os.stat(self.pth)
+        self.identity, self.size = TrashBin.Identity(st), st.st_size
+        self.records = len(self.byName)
+
+
+class TrashBin:
+    # Bulk moveToTrash and an index of what it trashed: original path -> entry in the trash dir, persisted in the trash
+    # dir, so a restore is a dict lookup and a rename instead of a scan of info/. The trash is the freedesktop.org one
+    # of OsBackend: each trash dir's files/ and info/ are listed once per call and names are picked from that, every
+    # .trashinfo is still created exclusively. Other backends trash path by path, their XDG trash is indexed too.
+    # purge keeps the indexed entries under a size and an age. Entries trashed by others are not touched.
+    COMPACT_MIN_RECORDS = 1024
+    _indexes: dict[str, _Index] = dict()  # trash dir -> its index
+    _lock = threading.Lock()
+
+    @staticmethod
+    def Identity(st: os.stat_result) -> tuple[int, int, int, int]:
+        # another file, or the same one grown or rewritten in place
+        return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+    @staticmethod
+    def _IndexOf(trashDir: str) -> _Index:
+        # (re)loaded when its file is not the one it read or wrote last, e.g., another process appended to it
+        with TrashBin._lock:
+            index = TrashBin._indexes.get(trashDir)
+            if index is None:
+                index = TrashBin._indexes[trashDir] = _Index(trashDir)
+        with index.lock:
+            index.refresh()
+        return index
+
+    @staticmethod
+    def _TrashDirOf(origPath: str) -> str | None:
+        # the trash dir origPath goes to, its nearest existing ancestor tells which filesystem
+        backend = FileBackend.current()
+        if not isinstance(backend, OsBackend):
+            backend = OsBackend()
+        pth = os.path.abspath(origPath)
+        while not os.path.lexists(pth) and os.path.dirname(pth) != pth:
+            pth = os.path.dirname(pth)
+        return backend.trashDir(pth)
+
+    @staticmethod
+    def _Size(st: os.stat_result) -> int | None:
+        return None if stat.S_ISDIR(st.st_mode) else st.st_size
+
+    @staticmethod
+    def trash(paths: list[str]) -> list[str | None]:
+        # where each path is now in the trash, None for the ones that failed or did not exist
+        backend = FileBackend.current()
+        if not isinstance(backend, OsBackend) or not OsBackend.HasXdgTrash():
+            return TrashBin._trashEach(paths)
+        results: list[str | None] = [None] * len(paths)
+        byTrashDir: dict[str, list[tuple[int, str, os.stat_result]]] = dict()
+        devTrash: dict[int, str | None] = dict()  # st_dev -> trash dir, asked once per filesystem
+        for ind, pth in enumerate(paths):
+            absPath = os.path.abspath(pth)
+            try:
+                st = os.lstat(absPath)
+            except OSError:
+                continue
+            if st.st_dev not in devTrash:
+                devTrash[st.st_dev] = backend.trashDir(absPath)
+            trashDir = devTrash[st.st_dev]
+            if trashDir is not None:
+                byTrashDir.setdefault(trashDir, list()).append((ind, absPath, st))
+        for trashDir, items in byTrashDir.items():
+            for ind, trashPath in TrashBin._trashInto(trashDir, items):
+                results[ind] = trashPath
+        return results
+
+    @staticmethod
+    def _trashInto(trashDir: str, items: list[tuple[int, str, os.stat_result]]) -> list[tuple[int, str]]:
+        filesDir, infoDir = os.path.join(trashDir, "files"), os.path.join(trashDir, "info")
+        try:
+            os.makedirs(filesDir, mode=0o700, exist_ok=True)
+            os.makedirs(infoDir, mode=0o700, exist_ok=True)
+            taken = set(os.listdir(filesDir))
+            taken.update(name[:-len(".trashinfo")] for name in os.listdir(infoDir) if name.endswith(".trashinfo"))
+        except OSError:
+            return list()
+        deletionDate = time.strftime("%Y-%m-%dT%H:%M:%S")
+        now = time.time()
+        done: list[tuple[int, str]] = list()
+        added: list[TrashEntry] = list()
+        for ind, absPath, st in items:
+            baseName = os.path.basename(absPath.rstrip("/")) or "root"
+            info = "[Trash Info]\nPath=" + quote(absPath) + "\nDeletionDate=" + deletionDate + "\n"
+            for attempt in range(OsBackend.TRASH_NAME_ATTEMPTS):
+                name = OsBackend.TrashName(baseName, attempt)
+                if name in taken:
+                    continue
+                taken.add(name)
+                infoPath = os.path.join(infoDir, name + ".trashinfo")
+                try:  # reserves the name, others may trash meanwhile
+                    fd = os.open(infoPath, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                except FileExistsError:
+                    continue
+                except OSError:
+                    break
+                with os.fdopen(fd, "w") as f:
+                    f.write(info)
+                trashPath = os.path.join(filesDir, name)
+                try:
+                    DirFdContext.RenameNoReplace(absPath, trashPath)
+                except FileExistsError:
+                    os.remove(infoPath)
+                    continue
+                except OSError:
+                    os.remove(infoPath)
+                    break
+                done.append((ind, trashPath.replace(os.sep, "/")))
+                added.append(TrashEntry(absPath, name, now, TrashBin._Size(st)))
+                break
+        if added:
+            index = TrashBin._IndexOf(trashDir)
+            with index.lock:
+                index.append(added, list())
+        return done
+
+    @staticmethod
+    def _trashEach(paths: list[str]) -> list[str | None]:
+        backend = FileBackend.current()
+        results: list[str | None] = list()
+        for pth in paths:
+            absPath = os.path.abspath(pth)
+            try:
+                st = os.lstat(absPath)
+            except OSError:
+                results.append(None)
+                continue
+            trashPath = backend.moveToTrash(absPath)
+            results.append(trashPath)
+            if trashPath:
+                TrashBin.record(absPath, trashPath, TrashBin._Size(st))
+        return results
+
+    @staticmethod
+    def record(origPath: str, trashPath: str, size: int | None = None) -> None:
+        # index a path trashed by somebody else(e.g., FileBackend.moveToTrash), when it is in a freedesktop.org trash
+        filesDir = os.path.dirname(os.path.abspath(trashPath))
+        if os.path.basename(filesDir) != "files":
+            return
+        index = TrashBin._IndexOf(os.path.dirname(filesDir))
+        with index.lock:
+            index.append([TrashEntry(os.path.abspath(origPath), os.path.basename(trashPath), time.time(), size)],
+                         list())
+
+    @staticmethod
+    def lookup(origPath: str) -> tuple[str, TrashEntry] | None:
+        # (trash dir, the latest entry trashed from origPath that is still in the trash)
+        absPath = os.path.abspath(origPath)
+        trashDir = TrashBin._TrashDirOf(absPath)
+        if trashDir is None:
+            return None
+        index = TrashBin._IndexOf(trashDir)
+        with index.lock:
+            for entry in reversed(index.byOrig.get(absPath, ())):
+                if os.path.lexists(os.path.join(trashDir, "files", entry.name)):
+                    return trashDir, entry
+        return None
+
+    @staticmethod
+    def restore(origPath: str) -> bool:
+        # the latest entry trashed from origPath back to it, its missing parent dirs are made. False when there is
+        # no such entry or origPath exists again
+        found = TrashBin.lookup(origPath)
+        if found is None:
+            return False
+        trashDir, entry = found
+        if os.path.lexists(entry.origPath):
+            return False
+        try:
+            os.makedirs(os.path.dirname(entry.origPath), exist_ok=True)
+            os.rename(os.path.join(trashDir, "files", entry.name), entry.origPath)
+        except OSError:
+            return False
+        try:
+            os.remove(os.path.join(trashDir, "info", entry.name + ".trashinfo"))
+        except OSError:
+            pass
+        index = TrashBin._IndexOf(trashDir)
+        with index.lock:
+            index.append(list(), [entry.name])
+        return True
+
+    @staticmethod
+    def entries(trashDir: str) -> list[TrashEntry]:
+        index = TrashBin._IndexOf(trashDir)
+        with index.lock:
+            return list(index.byName.values())
+
+    @staticmethod
+    def _TreeSize(pth: str) -> int:
+        total = 0
+        stack = [pth]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        else:
+                            total += entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                continue
+        return total
+
+    @staticmethod
+    def purge(trashDir: str, maxBytes: int = None, maxAgeSeconds: float = None) -> PurgeStats:
+        # deletes indexed entries older than maxAgeSeconds, then the oldest ones until the rest fits in maxBytes.
+        # Entries whose file is gone(restored by a rename recover, emptied by the desktop) are dropped from the index
+        index = TrashBin._IndexOf(trashDir)
+        filesDir, infoDir = os.path.join(trashDir, "files"), os.path.join(trashDir, "info")
+        with index.lock:
+            alive: list[TrashEntry] = list()
+            gone: list[str] = list()
+            for entry in sorted(index.byName.values(), key=lambda e: e.deletedAt):
+                if not os.path.lexists(os.path.join(filesDir, entry.name)):
+                    gone.append(entry.name)
+                elif entry.size is None:
+                    alive.append(entry._replace(size=TrashBin._TreeSize(os.path.join(filesDir, entry.name))))
+                else:
+                    alive.append(entry)
+            total = sum(e.size for e in alive)
+            cutoff = time.time() - maxAgeSeconds if maxAgeSeconds is not None else None
+            purged = 0
+            bytesRemoved = 0
+            for entry in alive:
+                if not (cutoff is not None and entry.deletedAt < cutoff) and (maxBytes is None or total <= maxBytes):
+                    break  # oldest first: the rest is younger and fits
+                pth = os.path.join(filesDir, entry.name)
+                if os.path.isdir(pth) and not os.path.islink(pth):
+                    ok = DeleteEngine.removeTree(pth) if DeleteEngine.Supported() else \
+                        OsBackend().removeRecursively(pth)
+                else:
+                    try:
+                        os.remove(pth)
+                        ok = True
+                    except OSError:
+                        ok = False
+                if not ok:
+                    continue
+                try:
+                    os.remove(os.path.join(infoDir, entry.name + ".trashinfo"))
+                except OSError:
+                    pass
+                gone.append(entry.name)
+                total -= entry.size
+                purged += 1
+                bytesRemoved += entry.size
+            if gone:
+                index.append(list(), gone)
+        return PurgeStats(purged, bytesRemoved)
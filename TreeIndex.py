@@ -0,0 +1,71 @@
+from typing import NamedTuple
+import hashlib
+import json
+import os
+
+from CopyEngine import CopyEngine
+
+
+class Entry(NamedTuple):
+    size: int
+    mtimeNs: int
+    ino: int
+
+
+class TreeIndex:
+    # What the last syncdir copied: the source root and, per relative path, the source file's size, mtime and inode.
+    # Stored as one JSON file per destination root in the user's cache(see IndexDir), never inside the synced tree.
+    # An entry that still matches the source is not looked at again.
+    VERSION = 1
+
+    def __init__(self, src: str = "", dirs: set[str] = None, files: dict[str, Entry] = None):
+        self.src = src
+        self.dirs: set[str] = dirs if dirs is not None else set()
+        self.files: dict[str, Entry] = files if files is not None else dict()
+
+    @staticmethod
+    def IndexDir() -> str:
+        cacheHome = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        return os.path.join(cacheHome, "FileOperation", "syncdir")
+
+    @staticmethod
+    def IndexName(dst: str) -> str:
+        # the index of the destination root dst in IndexDir
+        return hashlib.sha256(os.path.abspath(dst).encode("utf-8", "surrogateescape")).hexdigest() + ".json"
+
+    @staticmethod
+    def Load(pth: str) -> "TreeIndex | None":
+        # None when missing, unreadable or of another version: the caller falls back to comparing destination files
+        try:
+            with open(pth, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(data, dict) or data.get("version") != TreeIndex.VERSION:
+            return None
+        try:
+            return TreeIndex(data["src"], set(data["dirs"]), {rel: Entry(*e) for rel, e in data["files"].items()})
+        except (KeyError, TypeError):
+            return None
+
+    def save(self, pth: str) -> None:
+        # write aside and rename, a crash leaves the old index or the new one
+        os.makedirs(os.path.dirname(pth), exist_ok=True)
+        tmp = pth + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": TreeIndex.VERSION, "src": self.src, "dirs": sorted(self.dirs),
+                       "files": {rel: list(e) for rel, e in self.files.items()}}, f, separators=(",", ":"))
+        os.replace(tmp, pth)
+
+    @staticmethod
+    def Scan(root: str) -> "TreeIndex":
+        # CopyEngine.ScanTree, with size, mtime and inode of files. A file gone since it was listed is left out
+        dirs, files = CopyEngine.ScanTree(root)
+        index = TreeIndex(root, set(dirs))
+        for rel, _ in files:
+            try:
+                st = os.stat(root + "/" + rel)
+            except FileNotFoundError:
+                continue
+            index.files[rel] = Entry(st.st_size, st.st_mtime_ns, st.st_ino)
+        return index
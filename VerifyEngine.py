@@ -0,0 +1,129 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+import json
+
+import os
+
+from CopyEngine import CopyEngine
+
+VERIFY_WORKERS = os.cpu_count() or 1
+VERIFY_INLINE_BYTES = 64 << 20  # below it hashing in the calling thread is faster than starting a pool
+
+
+class Mismatch(NamedTuple):
+    rel: str
+    reason: str  # VerifyEngine.SIZE, VerifyEngine.CHECKSUM or VerifyEngine.UNREADABLE
+
+
+class VerifyReport(NamedTuple):
+    ok: bool
+    mismatches: list[Mismatch]
+    filesHashed: int  # source and destination files really read, the others came from the manifest
+    bytesHashed: int
+
+
+def _DigestPair(pair: tuple[str | None, str | None]) -> tuple[bytes | None, bytes | None]:
+    # digests of (src, dst), None for a side not asked for or unreadable
+    def digestOf(pth: str | None) -> bytes | None:
+        if pth is None:
+            return None
+        try:
+            return CopyEngine.Digest(pth)
+        except OSError:
+            return None
+    return digestOf(pair[0]), digestOf(pair[1])
+
+
+class ChecksumManifest:
+    # rel -> stat keys(size, mtime, inode) of source and destination and their common blake2b digest.
+    # A later verify of the same trees re-reads only the side whose stat keys changed.
+    VERSION = 1
+
+    def __init__(self, src: str = "", dst: str = "", files: dict[str, list] = None):
+        self.src = src
+        self.dst = dst
+        self.files: dict[str, list] = files if files is not None else dict()
+
+    @staticmethod
+    def StatKey(st: os.stat_result) -> list[int]:
+        return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+    @staticmethod
+    def Load(pth: str) -> "ChecksumManifest":
+        # an empty manifest when missing or unreadable
+        try:
+            with open(pth, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == ChecksumManifest.VERSION:
+                return ChecksumManifest(data["src"], data["dst"], data["files"])
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+        return ChecksumManifest()
+
+    def save(self, pth: str) -> None:
+        tmp = pth + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": ChecksumManifest.VERSION, "src": self.src, "dst": self.dst, "files": self.files}, f,
+                      separators=(",", ":"))
+        os.replace(tmp, pth)
+
+
+class VerifyEngine:
+    SIZE = "size"
+    CHECKSUM = "checksum"
+    UNREADABLE = "unreadable"
+
+    @staticmethod
+    def verifyTree(src: str, dst: str, rels: list[str], manifestPath: str = None,
+                   workers: int = VERIFY_WORKERS) -> VerifyReport:
+        # dst/rel has the content of src/rel for every rel. Sizes are compared first, then blake2b digests hashed on
+        # a thread pool: hashlib releases the GIL while hashing. manifestPath: digests of unchanged files are taken
+        # from it, and it is rewritten
+        manifest = ChecksumManifest.Load(manifestPath) if manifestPath else ChecksumManifest()
+        if (manifest.src, manifest.dst) != (src, dst):
+            manifest = ChecksumManifest(src, dst)
+        mismatches: list[Mismatch] = list()
+        pending: list[tuple[str, list[int], list[int], str | None, str | None]] = list()
+        for rel in rels:
+            try:
+                srcSt, dstSt = os.stat(src + "/" + rel), os.stat(dst + "/" + rel)
+            except OSError:
+                mismatches.append(Mismatch(rel, VerifyEngine.UNREADABLE))
+                continue
+            if srcSt.st_size != dstSt.st_size:
+                mismatches.append(Mismatch(rel, VerifyEngine.SIZE))
+                continue
+            srcKey, dstKey = ChecksumManifest.StatKey(srcSt), ChecksumManifest.StatKey(dstSt)
+            known = manifest.files.get(rel)
+            srcDigest = known[6] if known and known[:3] == srcKey else None
+            dstDigest = known[6] if known and known[3:6] == dstKey else None
+            if srcDigest is not None and dstDigest is not None:
+                continue
+            pending.append((rel, srcKey, dstKey, srcDigest, dstDigest))
+
+        pairs = [(None if srcDigest else src + "/" + rel, None if dstDigest else dst + "/" + rel)
+                 for rel, _, _, srcDigest, dstDigest in pending]
+        sizes = [p[1][0] * ((pair[0] is not None) + (pair[1] is not None)) for p, pair in zip(pending, pairs)]
+        digests = VerifyEngine._digests(pairs, sizes, workers)
+        for (rel, srcKey, dstKey, srcDigest, dstDigest), (srcNew, dstNew), pair in zip(pending, digests, pairs):
+            srcDigest = srcDigest or (srcNew.hex() if srcNew else None)
+            dstDigest = dstDigest or (dstNew.hex() if dstNew else None)
+            if (pair[0] and srcNew is None) or (pair[1] and dstNew is None):
+                mismatches.append(Mismatch(rel, VerifyEngine.UNREADABLE))
+            elif srcDigest != dstDigest:
+                mismatches.append(Mismatch(rel, VerifyEngine.CHECKSUM))
+                manifest.files.pop(rel, None)
+            else:
+                manifest.files[rel] = srcKey + dstKey + [srcDigest]
+        if manifestPath:
+            manifest.save(manifestPath)
+        filesHashed = sum((s is not None) + (d is not None) for s, d in pairs)
+        return VerifyReport(not mismatches, sorted(mismatches), filesHashed, sum(sizes))
+
+    @staticmethod
+    def _digests(pairs: list[tuple[str | None, str | None]], sizes: list[int],
+                 workers: int) -> list[tuple[bytes | None, bytes | None]]:
+        if workers <= 1 or len(pairs) <= 1 or sum(sizes) < VERIFY_INLINE_BYTES:
+            return [_DigestPair(pair) for pair in pairs]
+        with ThreadPoolExecutor(max_workers=min(workers, len(pairs))) as pool:
+            return list(pool.map(_DigestPair, pairs))
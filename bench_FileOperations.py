@@ -0,0 +1,242 @@
+import argparse
+import json
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+
+import os
+import platform
+import sys
+
+from BatchJournal import BatchJournal
+from CopyEngine import CopyEngine
+from FileBackend import FileBackend
+from FileOperation import FileOperation
+from StagedDelete import StagingArea
+from StatCache import StatCache
+
+# File size distributions: name -> function(random.Random) -> bytes
+DISTRIBUTIONS = {
+    "empty": lambda rnd: 0,
+    "small": lambda rnd: int(rnd.lognormvariate(8, 1.5)) % (1 << 20),  # median ~3 KiB
+    "mixed": lambda rnd: int(rnd.lognormvariate(8, 1.5)) % (1 << 20) if rnd.random() < 0.99 else rnd.randrange(8 << 20, 64 << 20),
+    "large": lambda rnd: rnd.randrange(16 << 20, 128 << 20),
+}
+FANOUT = 32  # entries per directory of a generated tree
+TRASH_VERBS = {"moveToTrash", "moveAllToTrash"}
+
+
+class BenchFailed(Exception):
+    pass
+
+
+def GenerateTree(root: str, entries: int, distribution: str, seed: int = 0) -> tuple[list[str], int]:
+    # about entries files and dirs, FANOUT per dir. Returns relative file paths and total bytes
+    rnd = random.Random(seed)
+    sizeOf = DISTRIBUTIONS[distribution]
+    files: list[str] = list()
+    totalBytes = 0
+    dirs = [""]
+    chunk = os.urandom(1 << 20)
+    created = 0
+    while created < entries:
+        parent = dirs[len(files) // FANOUT % len(dirs)] if dirs else ""
+        if created % FANOUT == FANOUT - 1:
+            rel = f"{parent}d{created}/"
+            os.mkdir(os.path.join(root, rel))
+            dirs.append(rel)
+        else:
+            rel = f"{parent}f{created}.bin"
+            size = sizeOf(rnd)
+            with open(os.path.join(root, rel), "wb") as f:
+                while size > 0:
+                    f.write(chunk[:size])
+                    size -= len(chunk)
+            files.append(rel)
+            totalBytes += os.path.getsize(os.path.join(root, rel))
+        created += 1
+    return files, totalBytes
+
+
+class Bench:
+    def __init__(self, base: str, entries: int, distribution: str, workers: int, label: str):
+        self.base = base
+        self.label = label  # the filesystem the run is on, e.g., /dev/shm
+        self.entries = entries
+        self.distribution = distribution
+        self.workers = workers
+        self.results: list[dict] = list()
+        self.verbs: set[str] = set()  # LambdaTable verbs measured
+
+    def record(self, name: str, seconds: float, ops: int, nBytes: int = 0, **extra) -> None:
+        result = {"name": name, "entries": self.entries, "distribution": self.distribution, "fs": self.label,
+                  "seconds": seconds, "ops": ops, "opsPerSecond": ops / seconds if seconds else None,
+                  "bytes": nBytes, "bytesPerSecond": nBytes / seconds if seconds and nBytes else None}
+        result.update(extra)
+        self.results.append(result)
+        print(f"{name:32} {self.entries:>9} {self.distribution:6} {seconds:9.3f}s {result['opsPerSecond'] or 0:12.0f} ops/s",
+              file=sys.stderr)
+        if extra.get("ok") is False:  # a failed run measures nothing
+            raise BenchFailed(f"{name} failed, entries={self.entries} {self.distribution} on {self.label}")
+
+    def fresh(self, name: str) -> str:
+        pth = os.path.join(self.base, name)
+        if os.path.exists(pth):
+            shutil.rmtree(pth)
+        os.makedirs(pth)
+        return pth
+
+    def timed(self, name: str, aBatch: list[tuple], nBytes: int = 0, ops: int = None, **executerKwargs) -> None:
+        # ops: what the batch really does, e.g., the files of one cpglob command
+        self.verbs.update(cmds[0] for cmds in aBatch)
+        start = time.perf_counter()
+        ok, _ = FileOperation.executer(aBatch, **executerKwargs)
+        seconds = time.perf_counter() - start
+        self.record(name, seconds, len(aBatch) if ops is None else ops, nBytes, ok=ok)
+
+    def run(self) -> list[dict]:
+        # the trash and the syncdir index are kept under base, the user's own are never touched
+        dirs = {"XDG_DATA_HOME": os.path.join(self.base, ".data"), "XDG_CACHE_HOME": os.path.join(self.base, ".cache")}
+        environ = {key: os.environ.get(key) for key in dirs}
+        os.environ.update(dirs)
+        try:
+            return self._run()
+        finally:
+            for key, value in environ.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+
+    def _run(self) -> list[dict]:
+        n = self.entries
+        src = self.fresh("src")
+        files, totalBytes = GenerateTree(src, n, self.distribution)
+        StagingArea.register(os.path.join(self.base, StagingArea.STAGING_DIR_NAME))
+
+        # one verb at a time, driven through executer so every verb is measured the same way
+        work = self.fresh("work")
+        self.timed("touch", [("touch", work, f"t/{i % 64}/{i}.txt") for i in range(n)])
+        self.timed("mkpath", [("mkpath", work, f"m/{i % 64}/{i}") for i in range(n)])
+        self.timed("rename", [("rename", work, f"t/{i % 64}/{i}.txt", work, f"r/{i % 64}/{i}.txt") for i in range(n)])
+        self.timed("rmfile", [("rmfile", work, f"r/{i % 64}/{i}.txt") for i in range(n)])
+        self.timed("rmpath", [("rmpath", work, f"m/{i % 64}/{i}") for i in range(n)])
+        self.timed("cpfile", [("cpfile", src, rel, work) for rel in files], totalBytes)
+        os.mkdir(os.path.join(work, "l"))
+        self.timed("link", [("link", src, rel, work + "/l") for rel in files[:n]])
+        self.timed("unlink", [("unlink", src, rel + ".lnk", work + "/l") for rel in files[:n]])
+        self.timed("stageDelete", [("stageDelete", work, rel) for rel in files])
+        self.timed("rmdir", [("rmdir", self.base, "work")])
+        if FileBackend.current().hasTrash():
+            trashWork = self.fresh("trash")
+            self.timed("touch(moveToTrash setup)", [("touch", trashWork, f"{i}.txt") for i in range(min(n, 1000))])
+            self.timed("moveToTrash", [("moveToTrash", trashWork, f"{i}.txt") for i in range(min(n, 1000))])
+            self.timed("touch(moveAllToTrash setup)", [("touch", trashWork, f"{i}.txt") for i in range(min(n, 1000))])
+            self.timed("moveAllToTrash", [("moveAllToTrash", trashWork, [f"{i}.txt" for i in range(min(n, 1000))])],
+                       ops=min(n, 1000))
+
+        # cpdir against shutil.copytree
+        dst = self.fresh("dst")
+        start = time.perf_counter()
+        ret, _ = FileOperation.cpdir(self.base, "src", dst, maxWorkers=1)
+        self.record("cpdir(maxWorkers=1)", time.perf_counter() - start, n, totalBytes, ok=ret == FileOperation.ErrorCode.OK)
+        dst = self.fresh("dst")
+        start = time.perf_counter()
+        ret, _ = FileOperation.cpdir(self.base, "src", dst, maxWorkers=self.workers)
+        self.record(f"cpdir(maxWorkers={self.workers})", time.perf_counter() - start, n, totalBytes,
+                    ok=ret == FileOperation.ErrorCode.OK)
+        self.verbs.add("cpdir")
+        dirs = CopyEngine.ScanTree(os.path.join(dst, "src"))[0]
+        self.timed("rmtree", [("rmtree", dst, "src", files, dirs)], ops=n)
+        dst = self.fresh("dst")
+        start = time.perf_counter()
+        shutil.copytree(src, os.path.join(dst, "src"))
+        self.record("shutil.copytree", time.perf_counter() - start, n, totalBytes)
+        shutil.rmtree(dst)
+
+        # syncdir: a first sync copies everything, a second one only compares with its index
+        dst = self.fresh("dst")
+        self.timed("syncdir(first)", [("syncdir", self.base, "src", dst, False, None, self.workers)], totalBytes, ops=n)
+        self.timed("syncdir(unchanged)", [("syncdir", self.base, "src", dst, False, None, self.workers)], ops=n)
+
+        # the glob verbs, each one walks the whole tree
+        globbed, moved = self.fresh("globbed"), self.fresh("moved")
+        self.timed("cpglob", [("cpglob", self.base, "src", "*.bin", globbed)], totalBytes, ops=len(files))
+        self.timed("mvglob", [("mvglob", globbed, "src", "*.bin", moved)], ops=len(files))
+        self.timed("rmglob", [("rmglob", moved, "src", "*.bin")], ops=len(files))
+        for pth in (dst, globbed, moved):
+            shutil.rmtree(pth)
+
+        # executer throughput: plain, parallel, journaled, stat cached
+        for name, kwargs in (("executer", {}), (f"executer(maxWorkers={self.workers})", {"maxWorkers": self.workers}),
+                             ("executer(statCache)", {"statCache": StatCache()})):
+            work = self.fresh("work")
+            self.timed(name, [("touch", work, f"e/{i % 64}/{i}.txt") for i in range(n)], **kwargs)
+        work = self.fresh("work")
+        with BatchJournal(os.path.join(self.base, "bench.journal")) as journal:
+            self.timed("executer(journal)", [("touch", work, f"e/{i % 64}/{i}.txt") for i in range(n)], journal=journal)
+        self.results[-1].update(journalSyncs=journal.syncs, journalSeconds=journal.seconds)
+        os.remove(os.path.join(self.base, "bench.journal"))
+        shutil.rmtree(os.path.join(self.base, "work"))
+        shutil.rmtree(src)
+        missing = set(FileOperation.LambdaTable) - self.verbs
+        if not FileBackend.current().hasTrash():
+            missing -= TRASH_VERBS
+        if missing:
+            raise BenchFailed(f"verbs not measured: {sorted(missing)}")
+        return self.results
+
+
+def Metadata() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"commit": commit, "python": sys.version, "platform": platform.platform(), "cpus": os.cpu_count(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def Compare(results: list[dict], baselinePath: str, threshold: float) -> list[str]:
+    # results slower than baseline by more than threshold(0.1 == 10%)
+    with open(baselinePath) as f:
+        baseline = {(r["name"], r["entries"], r["distribution"], r["fs"]): r for r in json.load(f)["results"]}
+    regressions = list()
+    for r in results:
+        old = baseline.get((r["name"], r["entries"], r["distribution"], r["fs"]))
+        if old and old["seconds"] and r["seconds"] > old["seconds"] * (1 + threshold):
+            regressions.append(f"{r['name']} entries={r['entries']} {r['distribution']} on {r['fs']}: "
+                               f"{old['seconds']:.3f}s -> {r['seconds']:.3f}s")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every FileOperation.LambdaTable verb and executer")
+    parser.add_argument("--entries", type=int, nargs="+", default=[1000, 10000], help="tree sizes, e.g. 1000 1000000")
+    parser.add_argument("--distribution", nargs="+", default=["small"], choices=list(DISTRIBUTIONS))
+    parser.add_argument("--base", nargs="+", default=[tempfile.gettempdir()],
+                        help="where trees are generated, e.g. /dev/shm(tmpfs) and a disk path")
+    parser.add_argument("--workers", type=int, default=min(8, os.cpu_count() or 1))
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--compare", help="results of an earlier run, exit 1 on regression")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    allResults = list()
+    for base in args.base:
+        for distribution in args.distribution:
+            for entries in args.entries:
+                benchDir = tempfile.mkdtemp(prefix="FileOperationBench", dir=base)
+                try:
+                    allResults += Bench(benchDir, entries, distribution, args.workers, base).run()
+                finally:
+                    shutil.rmtree(benchDir, ignore_errors=True)
+    with open(args.output, "w") as f:
+        json.dump({"metadata": Metadata(), "results": allResults}, f, indent=1)
+    if args.compare:
+        regressions = Compare(allResults, args.compare, args.threshold)
+        for line in regressions:
+            print("REGRESSION " + line, file=sys.stderr)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,96 @@
+from PySide2.QtCore import QDir, QFileInfo
+import asyncio
+import os
+import shutil
+import unittest
+
+from AsyncFileOperation import AsyncFileOperation, BatchCancelled
+from BatchControl import BatchControl
+from FileOperation import FileOperation
+
+TEST_SRC_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/DONT_CHANGE")
+TEST_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/COPY_REMOVABLE")
+
+
+class AsyncFileOperationTest(unittest.TestCase):
+    def setUp(self) -> None:
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        shutil.copytree(TEST_SRC_DIR, TEST_DIR)
+        return super().setUp()
+
+    def tearDown(self):
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        return super().tearDown()
+
+    def test_execute_with_progress(self):
+        aBatch = [("touch", TEST_DIR, f"p/{i}.txt") for i in range(30)]
+        events = list()
+
+        async def main():
+            async with AsyncFileOperation() as asyncOperation:
+                return await asyncOperation.execute(aBatch, progress=events.append, maxWorkers=4)
+        ok, recover = asyncio.run(main())
+        self.assertTrue(ok)
+        self.assertEqual(len(os.listdir(os.path.join(TEST_DIR, "p"))), 30)
+        self.assertEqual(events[-1].commandsDone, 30)
+        self.assertEqual(events[-1].commandsTotal, 30)
+        done = [e.commandsDone for e in events]
+        self.assertEqual(done, sorted(done))
+        self.assertTrue(FileOperation.executer(recover)[0])
+        self.assertFalse(os.path.exists(os.path.join(TEST_DIR, "p")))
+
+    def test_cpdir_with_progress(self):
+        os.mkdir(os.path.join(TEST_DIR, "to"))
+        events = list()
+
+        async def main():
+            async with AsyncFileOperation() as asyncOperation:
+                return await asyncOperation.cpdir(TEST_DIR, "a", os.path.join(TEST_DIR, "to"), progress=events.append)
+        ret, _ = asyncio.run(main())
+        self.assertEqual(ret, FileOperation.ErrorCode.OK)
+        srcFiles = [f for _, _, files in os.walk(os.path.join(TEST_DIR, "a")) for f in files]
+        self.assertEqual(events[-1].filesCopied, len(srcFiles))
+
+    def test_control_cancel_between_commands(self):
+        aBatch = [("touch", TEST_DIR, f"c/{i}.txt") for i in range(10)]
+        control = BatchControl(onProgress=lambda c: c.cancel() if c.commandsDone == 3 else None)
+        ok, recover = FileOperation.executer(aBatch, control=control)
+        self.assertFalse(ok)
+        self.assertEqual(sorted(os.listdir(os.path.join(TEST_DIR, "c"))), ["0.txt", "1.txt", "2.txt"])
+        self.assertTrue(FileOperation.executer(recover)[0])
+        self.assertFalse(os.path.exists(os.path.join(TEST_DIR, "c")))
+
+    def test_cpdir_cancel_between_files(self):
+        os.mkdir(os.path.join(TEST_DIR, "to"))
+        control = BatchControl(onProgress=lambda c: c.cancel())
+        ret, recover = control.call(FileOperation.cpdir, TEST_DIR, "a", os.path.join(TEST_DIR, "to"), maxWorkers=1)
+        self.assertEqual(ret, FileOperation.ErrorCode.CANCELLED)
+        self.assertEqual(control.filesCopied, 1)
+        self.assertEqual(sum(cmd[0] == "rmfile" for cmd in recover), 1)
+        self.assertTrue(FileOperation.executer(list(reversed(recover)))[0])
+        self.assertFalse(os.path.exists(os.path.join(TEST_DIR, "to", "a")))
+
+    def test_task_cancel(self):
+        aBatch = [("touch", TEST_DIR, f"t/{i}.txt") for i in range(2000)]
+
+        async def main():
+            async with AsyncFileOperation() as asyncOperation:
+                started = asyncio.Event()
+                task = asyncio.create_task(asyncOperation.execute(aBatch, progress=lambda _: started.set()))
+                await started.wait()
+                task.cancel()
+                with self.assertRaises(BatchCancelled) as cm:
+                    await task
+                return cm.exception.recoverList
+        recover = asyncio.run(main())
+        made = os.listdir(os.path.join(TEST_DIR, "t"))
+        self.assertGreater(len(made), 0)
+        self.assertEqual(sum(cmd[0] == "rmfile" for cmd in recover), len(made))
+        self.assertTrue(FileOperation.executer(recover)[0])
+        self.assertFalse(os.path.exists(os.path.join(TEST_DIR, "t")))
+
+
+if __name__ == "__main__":
+    unittest.main()
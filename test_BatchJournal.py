@@ -0,0 +1,118 @@
+from PySide2.QtCore import QDir, QFileInfo
+from unittest import mock
+import shutil
+import unittest
+
+from BatchJournal import BatchJournal
+from CopyEngine import CopyEngine, CopyStats
+from FileOperation import FileOperation
+
+TEST_SRC_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/DONT_CHANGE")
+TEST_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/COPY_REMOVABLE")
+JOURNAL = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/COPY_REMOVABLE.journal")
+
+
+class BatchJournalTest(unittest.TestCase):
+    def setUp(self) -> None:
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        QDir().remove(JOURNAL)
+        shutil.copytree(TEST_SRC_DIR, TEST_DIR)
+        return super().setUp()
+
+    def tearDown(self):
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        QDir().remove(JOURNAL)
+        return super().tearDown()
+
+    def test_finished_batch_needs_no_rollback(self):
+        with BatchJournal(JOURNAL) as journal:
+            ret, _ = FileOperation.executer([("touch", TEST_DIR, "new.txt")], journal=journal)
+        self.assertTrue(ret)
+        self.assertGreater(journal.records, 0)
+        self.assertTrue(BatchJournal.ReadJournal(JOURNAL).complete)
+        self.assertEqual(BatchJournal.rollback(JOURNAL), (True, list(), list()))
+        self.assertTrue(QDir(TEST_DIR).exists("new.txt"))
+
+    def test_rollback_interrupted_batch(self):
+        aBatch = [("touch", TEST_DIR, "path/to/new.txt"), ("rename", TEST_DIR, "a.txt", TEST_DIR, "a moved.txt"),
+                  ("cpdir", TEST_DIR, "a", f"{TEST_DIR}/b")]
+        journal = BatchJournal(JOURNAL, syncEvery=1)
+        journal.begin(len(aBatch))
+        run = journal.wrap(FileOperation._execute)
+        for cmds in aBatch:  # the process "dies" before end()
+            run(cmds)
+        journal.intent(("rmfile", TEST_DIR, "b.txt"))  # started but not finished
+        journal.close()
+        with open(JOURNAL, "ab") as f:
+            f.write(b'{"t":"outco')  # torn tail
+        self.assertTrue(QDir(TEST_DIR).exists("b/a/a1.txt"))
+
+        state = BatchJournal.ReadJournal(JOURNAL)
+        self.assertFalse(state.complete)
+        self.assertEqual(state.uncertain, [("rmfile", TEST_DIR, "b.txt")])
+        ret, _, uncertain = BatchJournal.rollback(JOURNAL)
+        self.assertTrue(ret, "Rollback should succeed.")
+        self.assertEqual(uncertain, [("rmfile", TEST_DIR, "b.txt")])
+        self.assertFalse(QDir(TEST_DIR).exists("path"), "should rollback")
+        self.assertTrue(QDir(TEST_DIR).exists("a.txt"), "should rollback")
+        self.assertFalse(QDir(TEST_DIR).exists("a moved.txt"), "should rollback")
+        self.assertFalse(QDir(TEST_DIR).exists("b/a"), "should rollback")
+        self.assertTrue(BatchJournal.ReadJournal(JOURNAL).complete, "rolled back batch is ended")
+
+        with BatchJournal(JOURNAL) as journal:  # a journal with a torn tail can be appended again
+            FileOperation.executer([("touch", TEST_DIR, "new.txt")], journal=journal)
+        self.assertTrue(BatchJournal.ReadJournal(JOURNAL).complete)
+
+    def test_rollback_interrupted_cpdir(self):
+        copyFile = CopyEngine.copyFile
+
+        def dieOnA3(src: str, dst: str, reflink: bool = False):
+            if src.endswith("a3.txt"):
+                raise KeyboardInterrupt  # the process dies in the middle of the copy
+            return copyFile(src, dst, reflink)
+
+        cmds = ("cpdir", TEST_DIR, "a", f"{TEST_DIR}/b", None, 1)
+        journal = BatchJournal(JOURNAL, syncEvery=1)
+        journal.begin(1)
+        with mock.patch.object(CopyEngine, "copyFile", side_effect=dieOnA3), self.assertRaises(KeyboardInterrupt):
+            journal.wrap(FileOperation._execute)(cmds)
+        journal.close()
+        self.assertTrue(QDir(TEST_DIR).exists("b/a/a1/a2.txt"))
+
+        state = BatchJournal.ReadJournal(JOURNAL)
+        self.assertEqual(state.uncertain, [cmds])
+        self.assertIn(("rmfile", f"{TEST_DIR}/b/a", "a1/a2.txt"), state.recoverList)
+        self.assertEqual(state.recoverList[-1], ("rmpath", f"{TEST_DIR}/b", "a"), "the root dir is undone last")
+        ok, _, uncertain = BatchJournal.rollback(JOURNAL)
+        self.assertTrue(ok, "Rollback should succeed.")
+        self.assertEqual(uncertain, [cmds], "reported, not skipped silently")
+        self.assertFalse(QDir(TEST_DIR).exists("b/a"), "should rollback")
+        self.assertTrue(QDir(TEST_DIR).exists("b/b1.txt"))
+
+    def test_stats_args_are_journaled_by_type(self):
+        copyStats = CopyStats()
+        cmds = ("cpdir", TEST_DIR, "a", f"{TEST_DIR}/b", copyStats)
+        with BatchJournal(JOURNAL) as journal:
+            ret, _ = FileOperation.executer([cmds], journal=journal)
+        self.assertTrue(ret)
+        self.assertGreater(copyStats.files, 0)
+        self.assertTrue(QDir(TEST_DIR).exists("b/a/a1/a2/a3.txt"))
+
+        journal = BatchJournal(JOURNAL)
+        journal.begin(1)
+        journal.intent(cmds)  # the process dies before the outcome
+        journal.close()
+        self.assertEqual(BatchJournal.ReadJournal(JOURNAL).uncertain, [cmds[:4] + ("<CopyStats>",)])
+
+    def test_parallel_batch_is_journaled(self):
+        aBatch = [("touch", TEST_DIR, f"{i}.txt") for i in range(20)]
+        with BatchJournal(JOURNAL) as journal:
+            ret, _ = FileOperation.executer(aBatch, maxWorkers=4, journal=journal)
+        self.assertTrue(ret)
+        self.assertEqual(journal.records, 2 + 2 * len(aBatch))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+from PySide2.QtCore import QDir, QFileInfo
+import os
+import shutil
+import unittest
+
+from BatchOptimizer import BatchOptimizer
+from FileOperation import FileOperation
+
+TEST_SRC_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/DONT_CHANGE")
+TEST_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/COPY_REMOVABLE")
+
+
+class BatchOptimizerTest(unittest.TestCase):
+    def setUp(self) -> None:
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        shutil.copytree(TEST_SRC_DIR, TEST_DIR)
+        return super().setUp()
+
+    def tearDown(self):
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        return super().tearDown()
+
+    @staticmethod
+    def snapshot() -> dict[str, bytes | None]:
+        # rel -> content, None for dirs
+        tree = dict()
+        for root, dirs, files in os.walk(TEST_DIR):
+            rel = os.path.relpath(root, TEST_DIR)
+            for d in dirs:
+                tree[os.path.join(rel, d)] = None
+            for f in files:
+                with open(os.path.join(root, f), "rb") as fo:
+                    tree[os.path.join(rel, f)] = fo.read()
+        return tree
+
+    def assertSameEffect(self, aBatch: list[tuple]) -> "OptimizedBatch":
+        # the optimized batch leaves the tree the original batch leaves, and so does its recover list
+        initial = self.snapshot()
+        ret, recover = FileOperation.executer(aBatch)
+        self.assertTrue(ret)
+        done = self.snapshot()
+        self.assertTrue(FileOperation.executer(recover)[0])
+        self.assertEqual(self.snapshot(), initial)
+
+        optimized = BatchOptimizer.optimize(aBatch)
+        ret, recover = FileOperation.executer(optimized.batch)
+        self.assertTrue(ret)
+        self.assertEqual(self.snapshot(), done)
+        self.assertTrue(FileOperation.executer(recover)[0])
+        self.assertEqual(self.snapshot(), initial)
+        return optimized
+
+    def test_noop_and_touch_removed(self):
+        aBatch = [("touch", TEST_DIR, "a.txt"), ("rmfile", TEST_DIR, "inexist.txt"), ("mkpath", TEST_DIR, "a/a1"),
+                  ("touch", TEST_DIR, "tmp.txt"), ("touch", TEST_DIR, "kept.txt"), ("rmfile", TEST_DIR, "tmp.txt"),
+                  ("touch", TEST_DIR, "kept.txt")]
+        optimized = self.assertSameEffect(aBatch)
+        self.assertEqual(optimized.batch, [("touch", TEST_DIR, "kept.txt")])
+        self.assertEqual(optimized.eliminated, 6)
+        self.assertEqual([r.rule for r in optimized.rewrites], [BatchOptimizer.NOOP] * 3 + [BatchOptimizer.TOUCH_REMOVED,
+                                                                                           BatchOptimizer.NOOP])
+
+    def test_touch_in_a_new_dir_is_kept(self):
+        # touch makes new/, rmfile does not remove it
+        aBatch = [("touch", TEST_DIR, "new/tmp.txt"), ("rmfile", TEST_DIR, "new/tmp.txt")]
+        optimized = self.assertSameEffect(aBatch)
+        self.assertEqual(optimized.batch, aBatch)
+
+    def test_mkpath_implied(self):
+        aBatch = [("mkpath", TEST_DIR, "p/q"), ("touch", TEST_DIR, "p/q/r/new.txt"),
+                  ("mkpath", TEST_DIR, "m"), ("cpfile", TEST_DIR, "a.txt", f"{TEST_DIR}/m"),
+                  ("mkpath", TEST_DIR, "n"), ("touch", f"{TEST_DIR}/n", "new.txt")]  # touch needs n
+        optimized = self.assertSameEffect(aBatch)
+        self.assertEqual([r.indices for r in optimized.rewrites], [(0,)])
+        self.assertEqual(len(optimized.batch), 5)
+
+    def test_rename_chain(self):
+        aBatch = [("rename", TEST_DIR, "a.txt", TEST_DIR, "a1.txt"), ("touch", TEST_DIR, "other.txt"),
+                  ("rename", TEST_DIR, "a1.txt", TEST_DIR, "a2.txt"), ("rename", TEST_DIR, "a2.txt", TEST_DIR, "c/a3.txt"),
+                  ("rename", TEST_DIR, "b.txt", TEST_DIR, "b1.txt"), ("rename", TEST_DIR, "b1.txt", TEST_DIR, "b.txt")]
+        optimized = self.assertSameEffect(aBatch)
+        self.assertEqual(optimized.batch, [("rename", TEST_DIR, "a.txt", TEST_DIR, "c/a3.txt"),
+                                           ("touch", TEST_DIR, "other.txt")])
+        self.assertEqual(optimized.rewrites[-1].indices, (4, 5))
+
+    def test_copy_merge(self):
+        to = f"{TEST_DIR}/b"
+        aBatch = [("cpfile", TEST_DIR, rel, to) for rel in ("a/a1.txt", "a/a1/a2.txt", "a/a1/a2/a3.txt", "a.txt")]
+        for root, _, files in os.walk(f"{TEST_DIR}/a"):
+            for f in files:
+                rel = os.path.relpath(os.path.join(root, f), TEST_DIR)
+                if ("cpfile", TEST_DIR, rel, to) not in aBatch:
+                    aBatch.append(("cpfile", TEST_DIR, rel, to))
+        optimized = self.assertSameEffect(aBatch)
+        self.assertEqual(optimized.batch, [("cpdir", TEST_DIR, "a", to), ("cpfile", TEST_DIR, "a.txt", to)])
+
+        # a file of a/ missing from the batch: cpdir would copy it too
+        partial = [cmds for cmds in aBatch if cmds[2] != "a/a1.txt"]
+        self.assertEqual(BatchOptimizer.optimize(partial).batch, partial)
+
+
+if __name__ == "__main__":
+    unittest.main()
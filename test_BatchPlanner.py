@@ -0,0 +1,112 @@
+from PySide2.QtCore import QDir, QFileInfo
+from unittest import mock
+import os
+import shutil
+import unittest
+
+from BatchPlanner import BatchPlanner
+from FileBackend import FileBackend
+from FileOperation import FileOperation
+from StagedDelete import StagingArea
+
+TEST_SRC_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/DONT_CHANGE")
+TEST_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/COPY_REMOVABLE")
+
+
+class BatchPlannerTest(unittest.TestCase):
+    def setUp(self) -> None:
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        shutil.copytree(TEST_SRC_DIR, TEST_DIR)
+        return super().setUp()
+
+    def tearDown(self):
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        return super().tearDown()
+
+    def test_plan_matches_executer(self):
+        aBatch = [("touch", TEST_DIR, "path/to/new.txt"), ("mkpath", TEST_DIR, "c/c1"),
+                  ("rename", TEST_DIR, "a", TEST_DIR, "moved/a"), ("touch", TEST_DIR, "moved/a/a1/new.txt"),
+                  ("rmfile", TEST_DIR, "moved/a/a1.txt"), ("cpdir", TEST_DIR, "moved", f"{TEST_DIR}/c"),
+                  ("cpfile", TEST_DIR, "b.txt", f"{TEST_DIR}/c/c1"), ("mkpath", TEST_DIR, "d/d1"),
+                  ("rmpath", TEST_DIR, "d/d1")]
+        tree = sorted(os.walk(TEST_DIR))
+        plan = BatchPlanner.plan(aBatch)
+        self.assertEqual(sorted(os.walk(TEST_DIR)), tree, "planning must not touch disk")
+        self.assertTrue(plan.ok, plan.errors)
+
+        ret, recover = FileOperation.executer(aBatch, maxWorkers=1)
+        self.assertTrue(ret)
+        self.assertEqual(plan.recoverList, recover, "the order is what makes a recover list correct")
+
+    def test_every_verb_matches_LambdaTable(self):
+        T = TEST_DIR
+        cases = [("rmfile", T, "a.txt"), ("rmfile", T, "inexist.txt"), ("rmfile", T, "a"),
+                 ("rmpath", T, "a/a1/a2"), ("rmpath", T, "a"), ("rmpath", T, "inexist"),
+                 ("rmdir", T, "a"), ("rmdir", T, "inexist"),
+                 ("rmtree", T, "a", ["a1.txt"], list()),
+                 ("rmtree", T, "a", ["a1.txt", "a1/a2.txt", "a1/a2/a3.txt"], ["a1", "a1/a2"]),
+                 ("stageDelete", T, "a"), ("stageDelete", T, "inexist"),
+                 ("touch", T, "new/x.txt"), ("touch", T, "a.txt"), ("touch", f"{T}/inexist", "x.txt"),
+                 ("touch", T, "a.txt/x.txt"),
+                 ("mkpath", T, "c/c1"), ("mkpath", T, "a"), ("mkpath", f"{T}/inexist", "c"),
+                 ("rename", T, "a", T, "moved/a"), ("rename", T, "a.txt", T, "b.txt"), ("rename", T, "inexist", T, "x"),
+                 ("cpfile", T, "a.txt", f"{T}/b"), ("cpfile", T, "b1.txt", f"{T}/b"), ("cpfile", T, "inexist", T),
+                 ("cpfile", T, "a.txt", f"{T}/inexist"), ("cpfile", T, "a/a1/a2.txt", f"{T}/b"),
+                 ("cpdir", T, "a", f"{T}/b"), ("cpdir", T, "a", f"{T}/a"), ("cpdir", T, "b", f"{T}/b"),
+                 ("cpdir", T, "inexist", f"{T}/b"), ("cpdir", T, "a", f"{T}/inexist"),
+                 ("syncdir", T, "a", f"{T}/b"), ("syncdir", T, "a.txt", f"{T}/b"), ("syncdir", T, "a", f"{T}/inexist"),
+                 ("rmglob", T, "", "*.txt"), ("rmglob", T, "a", "re:^a1/"), ("rmglob", T, "inexist", "*"),
+                 ("rmglob", T, "", "re:("),
+                 ("mvglob", T, "a", "*.txt", f"{T}/b"), ("mvglob", T, "", "a*.txt", f"{T}/b"),
+                 ("mvglob", T, "", "*.txt", f"{T}/inexist"),
+                 ("cpglob", T, "", "*2.txt", f"{T}/b"), ("cpglob", T, "b", "*.txt", f"{T}/b"),
+                 ("link", T, "a.txt", f"{T}/b"), ("link", T, "inexist", f"{T}/b"), ("link", T, "a.txt", f"{T}/inexist"),
+                 ("unlink", T, "a.txt.lnk", f"{T}/b"), ("unlink", T, "b1.txt", f"{T}/b")]
+        if FileBackend.current().hasTrash():
+            cases += [("moveToTrash", T, "a"), ("moveToTrash", T, "inexist"),
+                      ("moveAllToTrash", T, ["a.txt", "inexist", "b"])]
+        self.assertEqual(set(verb for verb, *_ in cases) | {"moveToTrash", "moveAllToTrash"},
+                         set(FileOperation.LambdaTable), "a verb without a case")
+        stagingDir = StagingArea.register(f"{T}/{StagingArea.STAGING_DIR_NAME}")
+
+        def placeholders(cmd: tuple) -> tuple:
+            # names only known after running, see BatchPlanner.STAGED_NAME and TRASH_NAME
+            if cmd[0] == "rename" and cmd[1] == stagingDir:
+                return ("rename", BatchPlanner.STAGED_NAME, BatchPlanner.STAGED_NAME, *cmd[3:])
+            if cmd[0] == "rename" and "/Trash/files/" in cmd[2]:
+                return ("rename", "", BatchPlanner.TRASH_NAME, *cmd[3:])
+            return cmd
+
+        with mock.patch.dict(os.environ, {"XDG_DATA_HOME": f"{T}/.data", "XDG_CACHE_HOME": f"{T}/.cache"}):
+            for cmds in cases:
+                with self.subTest(cmds=cmds):
+                    self.setUp()
+                    planned = BatchPlanner().simulate(cmds)
+                    ret, recover = FileOperation.LambdaTable[cmds[0]](*cmds[1:])
+                    self.assertEqual(planned, (ret, [placeholders(cmd) for cmd in recover]))
+
+    def test_plan_reports_every_error(self):
+        aBatch = [("rename", TEST_DIR, "a.txt", TEST_DIR, "c.txt"), ("rename", TEST_DIR, "b.txt", TEST_DIR, "c.txt"),
+                  ("cpfile", TEST_DIR, "a.txt", f"{TEST_DIR}/b"), ("rmdir", TEST_DIR, "b"),
+                  ("cpdir", TEST_DIR, "a", f"{TEST_DIR}/b"), ("touch", TEST_DIR, "c.txt/x.txt")]
+        plan = BatchPlanner.plan(aBatch)
+        self.assertFalse(plan.ok)
+        self.assertEqual([(ind, ret) for ind, _, ret in plan.errors],
+                         [(1, FileOperation.ErrorCode.DST_FILE_OR_PATH_ALREADY_EXIST),
+                          (2, FileOperation.ErrorCode.SRC_INEXIST),
+                          (4, FileOperation.ErrorCode.DST_DIR_INEXIST),
+                          (5, FileOperation.ErrorCode.DST_PRE_DIR_CANNOT_MAKE)])
+        self.assertTrue(QDir(TEST_DIR).exists("a.txt"), "planning must not touch disk")
+
+    def test_one_stat_per_distinct_path(self):
+        aBatch = [("touch", TEST_DIR, f"{i}.txt") for i in range(100)]
+        plan = BatchPlanner.plan(aBatch)
+        self.assertTrue(plan.ok)
+        self.assertLessEqual(plan.statCalls, 101)
+        self.assertEqual(len(plan.recoverList), 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
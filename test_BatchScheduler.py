@@ -0,0 +1,47 @@
+import os
+import tempfile
+import unittest
+
+from BatchScheduler import BatchScheduler
+
+
+class BatchSchedulerTest(unittest.TestCase):
+    def test_independent_commands_share_one_wave(self):
+        aBatch = [("rmfile", "/x", "a.txt"), ("rmfile", "/x", "b.txt"), ("touch", "/y", "c.txt")]
+        self.assertEqual(BatchScheduler.levels(aBatch), [[0, 1, 2]])
+
+    def test_same_path_is_ordered(self):
+        aBatch = [("touch", "/x", "a.txt"), ("rmfile", "/x", "a.txt")]
+        self.assertEqual(BatchScheduler.levels(aBatch), [[0], [1]])
+
+    def test_parent_child_prefix_is_ordered(self):
+        aBatch = [("mkpath", "/x", "a/b"), ("touch", "/x", "a/b/c.txt"), ("rmdir", "/x", "a"), ("touch", "/z", "d.txt")]
+        self.assertEqual(BatchScheduler.levels(aBatch), [[0, 3], [1], [2]])
+
+    def test_rename_chain_is_ordered(self):
+        aBatch = [("rename", "/x", "a", "/x", "b"), ("rename", "/x", "b", "/x", "c"), ("rename", "/x", "d", "/x", "e")]
+        self.assertEqual(BatchScheduler.levels(aBatch), [[0, 2], [1]])
+
+    def test_rmpath_is_a_barrier(self):
+        aBatch = [("touch", "/x", "a.txt"), ("rmpath", "/y", "b"), ("touch", "/z", "c.txt")]
+        self.assertEqual(BatchScheduler.levels(aBatch), [[0], [1], [2]])
+
+    def test_moveToTrash_commands_are_ordered(self):
+        aBatch = [("moveToTrash", "/x", "a.txt"), ("moveToTrash", "/x", "b.txt")]
+        self.assertEqual(BatchScheduler.levels(aBatch), [[0], [1]])
+
+    def test_commands_creating_one_missing_ancestor_are_ordered(self):
+        with tempfile.TemporaryDirectory() as pre:
+            os.mkdir(f"{pre}/d")
+            aBatch = [("touch", pre, "a/b/1.txt"), ("touch", pre, "a/c/2.txt"), ("touch", pre, "d/e/3.txt"),
+                      ("touch", pre, "d/f/4.txt")]
+            self.assertEqual(BatchScheduler.levels(aBatch), [[0, 2, 3], [1]])
+
+    def test_results_keep_batch_order(self):
+        aBatch = [("rmfile", "/x", str(i)) for i in range(50)]
+        results = BatchScheduler.execute(aBatch, lambda cmds: cmds[2], 8)
+        self.assertEqual(results, [str(i) for i in range(50)])
+
+
+if __name__ == "__main__":
+    unittest.main()
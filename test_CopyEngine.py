@@ -0,0 +1,159 @@
+from PySide2.QtCore import QDir, QFileInfo
+from contextlib import nullcontext
+from unittest import mock
+import errno
+import os
+import shutil
+import sys
+import unittest
+
+from CopyEngine import CopyEngine, CopyStats
+
+TEST_SRC_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/DONT_CHANGE")
+TEST_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/COPY_REMOVABLE")
+
+
+class CopyEngineTest(unittest.TestCase):
+    def setUp(self) -> None:
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        shutil.copytree(TEST_SRC_DIR, TEST_DIR)
+        self.src = os.path.join(TEST_DIR, "big.bin")
+        with open(self.src, "wb") as f:
+            f.write(os.urandom(3 * CopyEngine.BUFFER_SIZE + 17))
+        return super().setUp()
+
+    def tearDown(self):
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        return super().tearDown()
+
+    def assertSameContent(self, a: str, b: str):
+        with open(a, "rb") as fa, open(b, "rb") as fb:
+            self.assertEqual(fa.read(), fb.read())
+
+    def test_copy_file(self):
+        dst = os.path.join(TEST_DIR, "big copied.bin")
+        ret = CopyEngine.copyFile(self.src, dst)
+        self.assertTrue(ret.ok)
+        self.assertEqual(ret.bytesCopied, os.path.getsize(self.src))
+        if sys.platform.startswith("linux"):
+            self.assertIn(ret.method, (CopyEngine.COPY_FILE_RANGE, CopyEngine.SENDFILE))
+        self.assertSameContent(self.src, dst)
+
+    def test_copy_keeps_mtime_and_up_to_date(self):
+        dst = os.path.join(TEST_DIR, "big copied.bin")
+        self.assertFalse(CopyEngine.upToDate(self.src, dst))
+        self.assertTrue(CopyEngine.copyFile(self.src, dst).ok)
+        self.assertEqual(os.stat(self.src).st_mtime_ns, os.stat(dst).st_mtime_ns)
+        self.assertTrue(CopyEngine.upToDate(self.src, dst))
+        with open(dst, "r+b") as f:
+            f.write(b"changed")
+        self.assertFalse(CopyEngine.upToDate(self.src, dst, checksum=True))
+
+    def test_copy_to_existed_file_fails_and_keeps_it(self):
+        dst = os.path.join(TEST_DIR, "b.txt")
+        before = os.path.getsize(dst)
+        ret = CopyEngine.copyFile(self.src, dst)
+        self.assertFalse(ret.ok)
+        self.assertEqual(os.path.getsize(dst), before)
+
+    def test_copy_inexist_file(self):
+        dst = os.path.join(TEST_DIR, "inexist copied.bin")
+        ret = CopyEngine.copyFile(os.path.join(TEST_DIR, "inexist.bin"), dst)
+        self.assertFalse(ret.ok)
+        self.assertEqual(ret.method, CopyEngine.NONE)
+        self.assertFalse(os.path.exists(dst))
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "kernel data paths are linux only")
+    def test_fallback_to_read_write(self):
+        dst = os.path.join(TEST_DIR, "big copied.bin")
+        unsupported = OSError(errno.ENOSYS, "not supported")
+        with mock.patch.object(os, "copy_file_range", side_effect=unsupported, create=True), \
+                mock.patch.object(os, "sendfile", side_effect=unsupported, create=True):
+            ret = CopyEngine.copyFile(self.src, dst)
+        self.assertTrue(ret.ok)
+        self.assertEqual(ret.method, CopyEngine.READ_WRITE)
+        self.assertEqual(ret.bytesCopied, os.path.getsize(self.src))
+        self.assertSameContent(self.src, dst)
+
+    def test_stats(self):
+        stats = CopyStats()
+        stats.add(CopyEngine.copyFile(self.src, os.path.join(TEST_DIR, "1.bin")))
+        stats.add(CopyEngine.copyFile(self.src, os.path.join(TEST_DIR, "1.bin")))
+        self.assertEqual(stats.files, 1)
+        self.assertEqual(stats.failedFiles, 1)
+        self.assertEqual(stats.bytesCopied, os.path.getsize(self.src))
+
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "FICLONE is linux only")
+    def test_reflink_or_fallback(self):
+        dst = os.path.join(TEST_DIR, "big cloned.bin")
+        ret = CopyEngine.copyFile(self.src, dst, reflink=True)
+        self.assertTrue(ret.ok)
+        self.assertIn(ret.method, (CopyEngine.REFLINK, CopyEngine.COPY_FILE_RANGE, CopyEngine.SENDFILE))
+        self.assertEqual(ret.bytesCopied, os.path.getsize(self.src))
+        self.assertSameContent(self.src, dst)
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "FICLONE is linux only")
+    def test_reflink_cloned(self):
+        import fcntl
+        dst = os.path.join(TEST_DIR, "big cloned.bin")
+        with mock.patch.object(fcntl, "ioctl") as ioctl:  # pretend to clone, a clone leaves dst with src's size
+            ioctl.side_effect = lambda dstFd, request, srcFd: os.ftruncate(dstFd, os.fstat(srcFd).st_size)
+            ret = CopyEngine.copyFile(self.src, dst, reflink=True)
+        self.assertEqual(ioctl.call_args[0][1], CopyEngine.FICLONE)
+        self.assertEqual((ret.ok, ret.method), (True, CopyEngine.REFLINK))
+        self.assertEqual(os.path.getsize(dst), os.path.getsize(self.src))
+
+    def test_dedup_hardlinks_same_content(self):
+        same = os.path.join(TEST_DIR, "same.bin")
+        shutil.copyfile(self.src, same)
+        other = os.path.join(TEST_DIR, "other.bin")
+        with open(other, "wb") as f:
+            f.write(os.urandom(os.path.getsize(self.src)))  # same size, other content
+        jobs = [(pth, pth + ".copy", os.path.getsize(pth)) for pth in (self.src, same, other)]
+        stats = CopyStats(perFile=True)
+        results = CopyEngine.copyFiles(jobs, maxWorkers=2, copyStats=stats, dedup=True)
+        self.assertEqual(results, [True, True, True])
+        self.assertEqual(os.stat(self.src + ".copy").st_ino, os.stat(same + ".copy").st_ino)
+        self.assertNotEqual(os.stat(self.src + ".copy").st_ino, os.stat(other + ".copy").st_ino)
+        self.assertSameContent(other, other + ".copy")
+        self.assertEqual(stats.fileMethods[same + ".copy"], CopyEngine.HARDLINK)
+        self.assertNotEqual(stats.fileMethods[other + ".copy"], CopyEngine.HARDLINK)
+        self.assertEqual(stats.methods[CopyEngine.HARDLINK], 1)
+
+    def test_sparse_keeps_holes(self):
+        sparse = os.path.join(TEST_DIR, "disk.img")
+        with open(sparse, "wb") as f:  # 64 MiB, 3 MiB of data, ends with a hole
+            f.truncate(64 << 20)
+            for offset in (0, 20 << 20, 40 << 20):
+                f.seek(offset)
+                f.write(os.urandom(1 << 20))
+        with open(sparse, "rb") as f:
+            extents = CopyEngine.DataExtents(f.fileno(), os.fstat(f.fileno()))
+        if extents is None:
+            self.skipTest("the filesystem has no sparse files or SEEK_DATA")
+        stats = CopyStats()
+        for dst, fails in (("disk copied.img", False), ("disk preadv.img", True)):
+            dst = os.path.join(TEST_DIR, dst)
+            with mock.patch("os.copy_file_range", side_effect=OSError(errno.EXDEV, "")) if fails else nullcontext():
+                ret = CopyEngine.copyFile(sparse, dst)
+            stats.add(ret)
+            self.assertEqual((ret.ok, ret.method), (True, CopyEngine.SPARSE))
+            self.assertEqual((ret.bytesCopied, ret.bytesWritten), (64 << 20, 3 << 20))
+            self.assertSameContent(sparse, dst)
+            self.assertLess(os.stat(dst).st_blocks * 512, 8 << 20)
+        self.assertEqual((stats.bytesCopied, stats.bytesWritten), (128 << 20, 6 << 20))
+
+    def test_large_file_preallocated(self):
+        with mock.patch.object(CopyEngine, "PREALLOCATE_MIN_SIZE", CopyEngine.BUFFER_SIZE), \
+                mock.patch.object(CopyEngine, "Preallocate", side_effect=CopyEngine.Preallocate) as preallocate:
+            ret = CopyEngine.copyFile(self.src, os.path.join(TEST_DIR, "big copied.bin"))
+        self.assertTrue(ret.ok)
+        self.assertEqual(preallocate.call_args[0][1], [(0, os.path.getsize(self.src))])
+        self.assertEqual(ret.bytesWritten, ret.bytesCopied)
+        self.assertSameContent(self.src, os.path.join(TEST_DIR, "big copied.bin"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+from PySide2.QtCore import QDir, QFileInfo
+from unittest import mock
+import os
+import shutil
+import unittest
+
+from DeleteEngine import DeleteEngine, DeleteStats
+from FileOperation import FileOperation
+
+TEST_SRC_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/DONT_CHANGE")
+TEST_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/COPY_REMOVABLE")
+
+
+@unittest.skipUnless(DeleteEngine.Supported(), "dir_fd is not supported")
+class DeleteEngineTest(unittest.TestCase):
+    def setUp(self) -> None:
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        shutil.copytree(TEST_SRC_DIR, TEST_DIR)
+        # big/d0..d9/e0..e4 with 3 files of 10 bytes in each e dir and 1 in each d dir
+        self.big = f"{TEST_DIR}/big"
+        for d in range(10):
+            for e in range(5):
+                os.makedirs(f"{self.big}/d{d}/e{e}")
+                for f in range(3):
+                    with open(f"{self.big}/d{d}/e{e}/{f}.txt", "wb") as fo:
+                        fo.write(b"0123456789")
+            with open(f"{self.big}/d{d}/top.txt", "wb") as fo:
+                fo.write(b"0123456789")
+        self.entries = 10 * 5 * 3 + 10 + 10 * 5 + 10 + 1  # files, e dirs, d dirs, big
+        return super().setUp()
+
+    def tearDown(self):
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        return super().tearDown()
+
+    def test_serial_and_parallel(self):
+        for maxWorkers in (1, 4):
+            stats = DeleteStats()
+            self.assertTrue(DeleteEngine.removeTree(self.big, maxWorkers, stats))
+            self.assertFalse(os.path.exists(self.big))
+            self.assertEqual(stats.entries, self.entries)
+            self.assertEqual(stats.bytesRemoved, 10 * (10 * 5 * 3 + 10))
+            self.assertEqual(stats.failedEntries, 0)
+            self.setUp()
+
+    def test_symlink_not_followed(self):
+        os.symlink(f"{TEST_DIR}/a", f"{self.big}/d0/link to a")
+        os.symlink(f"{TEST_DIR}/a.txt", f"{self.big}/d1/e1/link to a.txt")
+        self.assertTrue(DeleteEngine.removeTree(self.big, 4))
+        self.assertFalse(os.path.lexists(self.big))
+        self.assertTrue(os.path.isfile(f"{TEST_DIR}/a/a1.txt"))
+        self.assertTrue(os.path.isfile(f"{TEST_DIR}/a.txt"))
+
+        os.symlink(f"{TEST_DIR}/a", f"{TEST_DIR}/link to a")
+        self.assertFalse(DeleteEngine.removeTree(f"{TEST_DIR}/link to a", 4))  # refused, not followed
+        self.assertTrue(os.path.isfile(f"{TEST_DIR}/a/a1.txt"))
+
+    def test_failed_entries_do_not_stop_the_others(self):
+        realUnlink = os.unlink
+
+        def failOnTop(name, *args, **kwargs):
+            if name == "top.txt":
+                raise PermissionError(name)
+            return realUnlink(name, *args, **kwargs)
+
+        stats = DeleteStats()
+        with mock.patch("os.unlink", failOnTop):
+            self.assertFalse(DeleteEngine.removeTree(self.big, 4, stats))
+        self.assertEqual(sorted(os.listdir(f"{self.big}/d3")), ["top.txt"])
+        self.assertEqual(stats.failedEntries, 10 + 10 + 1)  # top.txt, then its d dir and big are not empty
+
+    def test_rmdir(self):
+        stats = DeleteStats()
+        ret, aBatch = FileOperation.rmdir(TEST_DIR, "big", maxWorkers=4, deleteStats=stats)
+        self.assertEqual(ret, FileOperation.ErrorCode.OK)
+        self.assertEqual(aBatch, list())
+        self.assertEqual(stats.entries, self.entries)
+        self.assertFalse(QDir(TEST_DIR).exists("big"))
+
+        with mock.patch.object(DeleteEngine, "removeTree", return_value=False):
+            ret, _ = FileOperation.rmdir(TEST_DIR, "a")
+        self.assertEqual(ret, FileOperation.ErrorCode.CANNOT_REMOVE_DIR)
+
+
+if __name__ == "__main__":
+    unittest.main()
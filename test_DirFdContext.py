@@ -0,0 +1,111 @@
+from PySide2.QtCore import QDir, QFileInfo
+from unittest import mock
+import os
+import shutil
+import unittest
+
+from DirFdContext import DirFdContext
+from FileOperation import FileOperation
+from StatCache import StatCache
+
+TEST_SRC_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/DONT_CHANGE")
+TEST_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/COPY_REMOVABLE")
+
+
+@unittest.skipUnless(DirFdContext.Supported(), "dir_fd is not supported")
+class DirFdContextTest(unittest.TestCase):
+    def setUp(self) -> None:
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        shutil.copytree(TEST_SRC_DIR, TEST_DIR)
+        return super().setUp()
+
+    def tearDown(self):
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        return super().tearDown()
+
+    def test_batch_and_recover(self):
+        aBatch = [("touch", TEST_DIR, f"fd/{i}.txt") for i in range(10)]
+        aBatch += [("mkpath", TEST_DIR, "fd/m/n"),
+                   ("rename", TEST_DIR, "a.txt", TEST_DIR, "fd/a moved.txt"),
+                   ("cpfile", TEST_DIR, "b.txt", f"{TEST_DIR}/a"),
+                   ("rmfile", TEST_DIR, "fd/0.txt")]
+        dirFds = DirFdContext()
+        realOpen = os.open
+        with mock.patch("os.open", side_effect=realOpen) as opened:
+            ret, recover = FileOperation.executer(aBatch, statCache=StatCache(), dirFds=dirFds)
+        self.assertTrue(ret)
+        self.assertEqual(dirFds.opens, 2)  # TEST_DIR and TEST_DIR/a
+        self.assertGreater(dirFds.hits, len(aBatch))
+        relativeOpens = [c for c in opened.call_args_list if c.kwargs.get("dir_fd") is not None]
+        self.assertEqual(len(relativeOpens), 10 + 2)  # touch creates, cpfile opens src and dst
+        self.assertTrue(QDir(TEST_DIR).exists("fd/9.txt"))
+        self.assertFalse(QDir(TEST_DIR).exists("fd/0.txt"))
+        self.assertTrue(QDir(TEST_DIR).exists("fd/m/n"))
+        self.assertTrue(QDir(TEST_DIR).exists("fd/a moved.txt"))
+        self.assertTrue(QDir(TEST_DIR).exists("a/b.txt"))
+
+        recoverRet, _ = FileOperation.executer(recover, dirFds=DirFdContext())
+        self.assertTrue(recoverRet)
+        self.assertFalse(QDir(TEST_DIR).exists("fd"))
+        self.assertTrue(QDir(TEST_DIR).exists("a.txt"))
+        self.assertFalse(QDir(TEST_DIR).exists("a/b.txt"))
+
+    def test_lru_limit(self):
+        dirFds = DirFdContext(maxOpen=2)
+        aBatch = [("touch", f"{TEST_DIR}/{d}", f"{i}.new") for i in range(3) for d in ("a", "b", "a/a1", "b/b1")]
+        ret, recover = FileOperation.executer(aBatch, dirFds=dirFds)
+        self.assertTrue(ret)
+        self.assertTrue(QDir(TEST_DIR).exists("b/b1/2.new"))
+        self.assertGreater(dirFds.evictions, 0)
+        self.assertEqual(dirFds.opens, dirFds.evictions + 2)
+        self.assertTrue(FileOperation.executer(recover, maxWorkers=4, dirFds=DirFdContext(maxOpen=1))[0])
+        self.assertFalse(QDir(TEST_DIR).exists("a/0.new"))
+
+    def test_renamed_root_is_not_reused(self):
+        aBatch = [("touch", f"{TEST_DIR}/a", "first.txt"),
+                  ("rename", TEST_DIR, "a", TEST_DIR, "a renamed"),
+                  ("mkpath", TEST_DIR, "a"),
+                  ("touch", f"{TEST_DIR}/a", "second.txt")]
+        ret, _ = FileOperation.executer(aBatch, dirFds=DirFdContext())
+        self.assertTrue(ret)
+        self.assertTrue(QDir(TEST_DIR).exists("a renamed/first.txt"))
+        self.assertFalse(QDir(TEST_DIR).exists("a renamed/second.txt"))
+        self.assertTrue(QDir(TEST_DIR).exists("a/second.txt"))
+
+    def test_call_without_context(self):
+        self.assertIsNone(DirFdContext.current())
+        self.assertEqual(DirFdContext.Call(os.stat, f"{TEST_DIR}/a.txt").st_size, os.stat(f"{TEST_DIR}/a.txt").st_size)
+        dirFds = DirFdContext()
+        dirFds.register(TEST_DIR)
+        with dirFds.at(f"{TEST_DIR}/a/a1.txt") as (fd, rel):
+            self.assertIsNotNone(fd)
+            self.assertEqual(rel, "a/a1.txt")
+        with dirFds.at("/elsewhere/x") as (fd, rel):
+            self.assertEqual((fd, rel), (None, "/elsewhere/x"))
+        dirFds.close()
+
+    def test_rename_no_replace(self):
+        def renames(cmds: tuple) -> tuple:
+            with self.assertRaises(FileExistsError):
+                DirFdContext.RenameNoReplace(f"{TEST_DIR}/a.txt", f"{TEST_DIR}/b.txt")
+            with self.assertRaises(FileExistsError):
+                DirFdContext.RenameNoReplace(f"{TEST_DIR}/a", f"{TEST_DIR}/b")
+            DirFdContext.RenameNoReplace(f"{TEST_DIR}/a.txt", f"{TEST_DIR}/{cmds[0]}.txt")
+            DirFdContext.RenameNoReplace(f"{TEST_DIR}/a", f"{TEST_DIR}/{cmds[0]}")
+            return cmds
+
+        DirFdContext().bound(renames)(("native", TEST_DIR))
+        with mock.patch.object(DirFdContext, "_RenameNoReplaceCall", return_value=False):  # link+unlink, lstat+rename
+            os.rename(f"{TEST_DIR}/native.txt", f"{TEST_DIR}/a.txt")
+            os.rename(f"{TEST_DIR}/native", f"{TEST_DIR}/a")
+            renames(("fallback",))
+        self.assertEqual(open(f"{TEST_DIR}/b.txt").read(), open(f"{TEST_SRC_DIR}/b.txt").read(), "b.txt not replaced")
+        self.assertTrue(QDir(TEST_DIR).exists("fallback/a1.txt"))
+        self.assertTrue(QDir(TEST_DIR).exists("fallback.txt"))
+        self.assertFalse(QDir(TEST_DIR).exists("a.txt"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+from PySide2.QtCore import QDir, QFileInfo
+from unittest import mock
+import os
+import re
+import shutil
+import subprocess
+import sys
+import unittest
+
+from DirFdContext import DirFdContext
+from FileBackend import FileBackend, OsBackend, QtBackend
+from FileOperation import FileOperation
+
+TEST_SRC_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/DONT_CHANGE")
+TEST_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/COPY_REMOVABLE")
+
+
+class FileBackendTest(unittest.TestCase):
+    def setUp(self) -> None:
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        shutil.copytree(TEST_SRC_DIR, TEST_DIR)
+        return super().setUp()
+
+    def tearDown(self):
+        FileBackend.use(OsBackend.name)
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        return super().tearDown()
+
+    def test_import_without_qt(self):
+        code = "import sys, FileOperation, BatchPlanner; sys.exit('PySide2' in sys.modules)"
+        ret = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(ret.returncode, 0)
+
+    def test_same_paths_as_qt(self):
+        os_, qt = OsBackend(), QtBackend()
+        for pre, rel in [(TEST_DIR, "a/a1.txt"), (TEST_DIR + "/", "a"), ("", "a.txt"), (TEST_DIR, "/abs/path")]:
+            self.assertEqual(os_.absoluteFilePath(pre, rel), qt.absoluteFilePath(pre, rel))
+        for pth in [f"{TEST_DIR}/a/a1.txt", f"{TEST_DIR}/a/", "a.txt"]:
+            self.assertEqual(os_.absolutePath(pth), qt.absolutePath(pth))
+
+    def test_rmpath_removes_empty_parents(self):
+        fs = OsBackend()
+        self.assertTrue(fs.mkpath(f"{TEST_DIR}/e/e1/e2"))
+        self.assertTrue(fs.rmpath(f"{TEST_DIR}/e/e1/e2"))
+        self.assertFalse(os.path.exists(f"{TEST_DIR}/e"))
+        self.assertTrue(os.path.isdir(TEST_DIR))  # not empty, kept
+        self.assertFalse(fs.rmpath(f"{TEST_DIR}/a.txt"))
+
+    def test_rename_never_replaces(self):
+        fs = OsBackend()
+        self.assertFalse(fs.rename(f"{TEST_DIR}/a.txt", f"{TEST_DIR}/b.txt"))
+        self.assertFalse(fs.rename(f"{TEST_DIR}/a", f"{TEST_DIR}/b"))
+        with mock.patch.object(DirFdContext, "_RenameNoReplaceCall", return_value=False):  # link+unlink
+            self.assertFalse(fs.rename(f"{TEST_DIR}/a.txt", f"{TEST_DIR}/b.txt"))
+            self.assertTrue(fs.rename(f"{TEST_DIR}/a.txt", f"{TEST_DIR}/c.txt"))
+        self.assertTrue(os.path.isfile(f"{TEST_DIR}/b.txt") and os.path.isdir(f"{TEST_DIR}/b/b1"))
+        self.assertEqual(sorted(os.listdir(TEST_DIR)), ["a", "b", "b.txt", "c.txt"])
+
+    def test_trash_and_recover(self):
+        dataHome = f"{TEST_DIR}/share"
+        with mock.patch.dict(os.environ, {"XDG_DATA_HOME": dataHome}):
+            FileBackend.use(OsBackend.name)
+            ret, aBatch = FileOperation.moveToTrash(TEST_DIR, "a.txt")
+            self.assertEqual(ret, FileOperation.ErrorCode.OK)
+            self.assertEqual(aBatch, [("rename", "", f"{dataHome}/Trash/files/a.txt", "", f"{TEST_DIR}/a.txt")])
+            with open(f"{dataHome}/Trash/info/a.txt.trashinfo") as f:
+                self.assertIn(f"Path={TEST_DIR}/a.txt", f.read())
+
+            self.assertTrue(FileOperation.touch(TEST_DIR, "a.txt")[0] == FileOperation.ErrorCode.OK)
+            ret, aBatch2 = FileOperation.moveToTrash(TEST_DIR, "a.txt")
+            self.assertEqual(ret, FileOperation.ErrorCode.OK)
+            self.assertRegex(aBatch2[0][2], re.escape(f"{dataHome}/Trash/files/a.txt.") + "[0-9a-f]+$")  # name taken
+            self.assertTrue(os.path.isfile(aBatch2[0][2]))
+            self.assertTrue(os.path.isfile(f"{dataHome}/Trash/files/a.txt"), "the first trashed a.txt is kept")
+
+        recoverRet, _ = FileOperation.executer(aBatch[::-1])
+        self.assertTrue(recoverRet)
+        self.assertTrue(QDir(TEST_DIR).exists("a.txt"))
+
+    def test_qt_trash_and_link_without_xdg_trash(self):
+        fs = OsBackend()
+        with mock.patch.object(sys, "platform", "darwin"), \
+                mock.patch.object(QtBackend, "moveToTrash", return_value="/trash/a.txt") as moveToTrash, \
+                mock.patch.object(QtBackend, "link", return_value=True) as link:
+            self.assertEqual(fs.moveToTrash(f"{TEST_DIR}/a.txt"), "/trash/a.txt")
+            self.assertTrue(fs.link(f"{TEST_DIR}/a.txt", f"{TEST_DIR}/a.txt.lnk"))
+        moveToTrash.assert_called_once_with(f"{TEST_DIR}/a.txt")
+        link.assert_called_once_with(f"{TEST_DIR}/a.txt", f"{TEST_DIR}/a.txt.lnk")
+        self.assertTrue(QDir(TEST_DIR).exists("a.txt"), "left to the mocked Qt backend")
+
+    def test_use_unknown(self):
+        with self.assertRaises(ValueError):
+            FileBackend.use("ftp")
+        self.assertIsInstance(FileBackend.use(QtBackend.name), QtBackend)
+        self.assertIs(FileBackend.current().name, QtBackend.name)
+
+
+if __name__ == "__main__":
+    unittest.main()
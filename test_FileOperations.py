@@ -1,11 +1,17 @@
 from PySide2.QtCore import QDir, QFileInfo
+from unittest import mock
+import json
 import os
 import sys
 import shutil
 import unittest
 
 
+from FileBackend import FileBackend, OsBackend, QtBackend
 from FileOperation import FileOperation
+from RecoverLog import RecoverLog
+from StagedDelete import StagingArea, StagingUnavailable
+from CopyEngine import CopyEngine, CopyResult, CopyStats
 
 DEFAULT_PATH = os.environ["USERPROFILE"] if sys.platform == "win32" else os.environ['HOME']
 DEFAULT_PATH_DIR = QDir(DEFAULT_PATH)
@@ -120,6 +126,14 @@ class FileOperationTest(unittest.TestCase):
         self.assertTrue(QDir(TEST_DIR).exists("b"), "recover failed")
         self.assertFalse(QDir(TEST_DIR).exists(f"b/{existFile}"), "recover failed")
 
+    def test_file_copy_stats(self):
+        stats = CopyStats()
+        ret, aBatch = FileOperation.cpfile(TEST_DIR, "a.txt", f"{TEST_DIR}/b", stats)
+        self.assertEqual(ret, FileOperation.ErrorCode.OK)
+        self.assertEqual(stats.files, 1)
+        self.assertEqual(stats.bytesCopied, QFileInfo(f"{TEST_DIR}/a.txt").size())
+        self.assertEqual(sum(stats.methods.values()), 1)
+
     def test_inexist_file_copy(self):
         inexistFileName = "an inexist file blablablabla.txt"
         self.assertFalse(QDir(TEST_DIR).exists(inexistFileName), "Precondition not required.")
@@ -168,6 +182,143 @@ class FileOperationTest(unittest.TestCase):
         self.assertFalse(QDir(TEST_DIR).exists(f"b/{subDir}"), "should recover")
         self.assertFalse(QDir(TEST_DIR).exists(f"b/{subFile}"), "should recover")
 
+    def test_recover_is_a_recover_log(self):
+        ret, cpdirRecover = FileOperation.cpdir(TEST_DIR, "a", f"{TEST_DIR}/b")
+        self.assertEqual(ret, FileOperation.ErrorCode.OK)
+        self.assertIsInstance(cpdirRecover, RecoverLog)
+        self.assertEqual(cpdirRecover[0], ("rmpath", f"{TEST_DIR}/b", "a"))
+        self.assertIn(("rmfile", f"{TEST_DIR}/b/a", "a1/a2/a3.txt"), cpdirRecover)
+        self.assertEqual(json.loads(json.dumps(list(cpdirRecover))), [list(cmd) for cmd in cpdirRecover])
+
+        ret, recover = FileOperation.executer([("cpdir", TEST_DIR, "a", f"{TEST_DIR}/a.txt copy"), ("touch", TEST_DIR, "c.txt")])
+        self.assertFalse(ret)
+        self.assertIsInstance(recover, RecoverLog)
+        self.assertEqual(recover, [("rmfile", TEST_DIR, "c.txt")])
+
+    def test_folder_copy_parallel(self):
+        for i in range(30):
+            with open(f"{TEST_DIR}/a/a1/many{i}.txt", "w") as f:
+                f.write(str(i) * i)
+        ret, aBatch = FileOperation.cpdir(TEST_DIR, "a", f"{TEST_DIR}/b", maxWorkers=4, largeFileSize=20)
+        self.assertEqual(ret, FileOperation.ErrorCode.OK)
+        for i in range(30):
+            with open(f"{TEST_DIR}/b/a/a1/many{i}.txt") as f:
+                self.assertEqual(f.read(), str(i) * i)
+        self.assertTrue(QDir(TEST_DIR).exists("b/a/a1/a2/a3.txt"))
+
+        recoverRet, _ = FileOperation.executer(aBatch[::-1])
+        self.assertTrue(recoverRet, "Recover progress should succeed.")
+        self.assertFalse(QDir(TEST_DIR).exists("b/a"), "should recover")
+
+    def test_folder_copy_worker_fails_partway(self):
+        copyFile = CopyEngine.copyFile
+
+        def failOnA2(src: str, dst: str, reflink: bool = False) -> CopyResult:
+            if src.endswith("a2.txt"):
+                return CopyResult(False, 0, CopyEngine.NONE)
+            return copyFile(src, dst, reflink)
+
+        with mock.patch.object(CopyEngine, "copyFile", side_effect=failOnA2):
+            ret, aBatch = FileOperation.cpdir(TEST_DIR, "a", f"{TEST_DIR}/b", maxWorkers=4)
+        self.assertNotEqual(ret, FileOperation.ErrorCode.OK)
+        self.assertFalse(QDir(TEST_DIR).exists("b/a/a1/a2.txt"))
+        for cmd in aBatch:
+            if cmd[0] == "rmfile":
+                self.assertTrue(QDir(cmd[1]).exists(cmd[2]), "recover only what was copied")
+
+        recoverRet, _ = FileOperation.executer(aBatch[::-1])
+        self.assertTrue(recoverRet, "Recover progress should succeed.")
+        self.assertFalse(QDir(TEST_DIR).exists("b/a"), "should recover")
+
+    def test_folder_copy_dedup(self):
+        for i in range(4):
+            with open(f"{TEST_DIR}/a/a1/dup{i}.txt", "w") as f:
+                f.write("duplicated content")
+        copyStats = CopyStats(perFile=True)
+        ret, aBatch = FileOperation.cpdir(TEST_DIR, "a", f"{TEST_DIR}/b", copyStats=copyStats, reflink=True, dedup=True)
+        self.assertEqual(ret, FileOperation.ErrorCode.OK)
+        self.assertEqual(len(set(os.stat(f"{TEST_DIR}/b/a/a1/dup{i}.txt").st_ino for i in range(4))), 1)
+        self.assertEqual(copyStats.methods[CopyEngine.HARDLINK], 3)
+        self.assertEqual(len(copyStats.fileMethods), copyStats.files)
+
+        recoverRet, _ = FileOperation.executer(aBatch[::-1])
+        self.assertTrue(recoverRet, "Recover progress should succeed.")
+        self.assertFalse(QDir(TEST_DIR).exists("b/a"), "should recover")
+
+    def test_folder_copy_resume(self):
+        StagingArea.register(os.path.join(TEST_DIR, StagingArea.STAGING_DIR_NAME))
+        copyFile = CopyEngine.copyFile
+
+        def failOnA2(src: str, dst: str, reflink: bool = False) -> CopyResult:
+            if src.endswith("a2.txt"):
+                with open(dst, "w") as f:  # like a copy interrupted partway
+                    f.write("partial")
+                return CopyResult(False, 0, CopyEngine.NONE)
+            return copyFile(src, dst, reflink)
+
+        with mock.patch.object(CopyEngine, "copyFile", side_effect=failOnA2):
+            ret, _ = FileOperation.cpdir(TEST_DIR, "a", f"{TEST_DIR}/b", maxWorkers=1)
+        self.assertNotEqual(ret, FileOperation.ErrorCode.OK)
+        ret, _ = FileOperation.cpdir(TEST_DIR, "a", f"{TEST_DIR}/b")
+        self.assertEqual(ret, FileOperation.ErrorCode.DST_FOLDER_ALREADY_EXIST)
+
+        copyStats = CopyStats()
+        ret, aBatch = FileOperation.cpdir(TEST_DIR, "a", f"{TEST_DIR}/b", copyStats=copyStats, resume=True)
+        self.assertEqual(ret, FileOperation.ErrorCode.OK)
+        for rel in ("a1.txt", "a1/a2.txt", "a1/a2/a3.txt"):
+            with open(f"{TEST_DIR}/a/{rel}", "rb") as fa, open(f"{TEST_DIR}/b/a/{rel}", "rb") as fb:
+                self.assertEqual(fa.read(), fb.read())
+        copiedBefore = [cmd for cmd in aBatch if cmd[0] == "rmfile"]
+        self.assertEqual(copyStats.files, len(copiedBefore))
+        self.assertIn(("rmfile", f"{TEST_DIR}/b/a", "a1/a2.txt"), copiedBefore)
+        self.assertNotIn(("rmfile", f"{TEST_DIR}/b/a", "a1.txt"), copiedBefore)
+        self.assertFalse(any(cmd[0] == "rmpath" for cmd in aBatch), "every dir existed already")
+
+        recoverRet, _ = FileOperation.executer(aBatch[::-1])
+        self.assertTrue(recoverRet, "Recover progress should succeed.")
+        with open(f"{TEST_DIR}/b/a/a1/a2.txt") as f:
+            self.assertEqual(f.read(), "partial", "the stale file the resumed run replaced")
+        self.assertTrue(QDir(TEST_DIR).exists("b/a/a1.txt"), "copied before the resumed run")
+
+    def test_folder_copy_resume_undo_restores_edited_file(self):
+        StagingArea.register(os.path.join(TEST_DIR, StagingArea.STAGING_DIR_NAME))
+        ret, _ = FileOperation.cpdir(TEST_DIR, "a", f"{TEST_DIR}/b")
+        self.assertEqual(ret, FileOperation.ErrorCode.OK)
+        edited = b"edited by the user, not a partial copy"
+        with open(f"{TEST_DIR}/b/a/a1.txt", "wb") as f:
+            f.write(edited)
+
+        ret, aBatch = FileOperation.executer([("cpdir", TEST_DIR, "a", f"{TEST_DIR}/b", None, 1, 64 << 20, True)])
+        self.assertTrue(ret)
+        with open(f"{TEST_DIR}/a/a1.txt", "rb") as fa, open(f"{TEST_DIR}/b/a/a1.txt", "rb") as fb:
+            self.assertEqual(fa.read(), fb.read())
+        recoverRet, _ = FileOperation.executer(aBatch)
+        self.assertTrue(recoverRet, "Recover progress should succeed.")
+        with open(f"{TEST_DIR}/b/a/a1.txt", "rb") as f:
+            self.assertEqual(f.read(), edited)
+
+    def test_folder_copy_resume_without_staging_keeps_edited_file(self):
+        ret, _ = FileOperation.cpdir(TEST_DIR, "a", f"{TEST_DIR}/b")
+        self.assertEqual(ret, FileOperation.ErrorCode.OK)
+        with open(f"{TEST_DIR}/b/a/a1.txt", "wb") as f:
+            f.write(b"edited by the user")
+        with mock.patch.object(StagingArea, "StagingDirFor", side_effect=StagingUnavailable("no staging dir")):
+            ret, aBatch = FileOperation.cpdir(TEST_DIR, "a", f"{TEST_DIR}/b", resume=True)
+        self.assertEqual((ret, list(aBatch)), (FileOperation.ErrorCode.STAGING_UNAVAILABLE, list()))
+        with open(f"{TEST_DIR}/b/a/a1.txt", "rb") as f:
+            self.assertEqual(f.read(), b"edited by the user")
+
+    def test_folder_copy_resume_checksum(self):
+        ret, _ = FileOperation.cpdir(TEST_DIR, "a", f"{TEST_DIR}/b")
+        self.assertEqual(ret, FileOperation.ErrorCode.OK)
+        os.utime(f"{TEST_DIR}/b/a/a1.txt", ns=(0, 0))
+        ret, aBatch = FileOperation.cpdir(TEST_DIR, "a", f"{TEST_DIR}/b", resume=True, checksum=True)
+        self.assertEqual((ret, list(aBatch)), (FileOperation.ErrorCode.OK, []), "same content, nothing to copy")
+        ret, aBatch = FileOperation.cpdir(TEST_DIR, "a", f"{TEST_DIR}/b", resume=True)
+        self.assertEqual(ret, FileOperation.ErrorCode.OK)
+        self.assertEqual([cmd for cmd in aBatch if cmd[0] != "rename"], [("rmfile", f"{TEST_DIR}/b/a", "a1.txt")],
+                         "the stale a1.txt is staged, when there is a staging dir")
+
     def test_inexist_folder_copy_including_its_articles(self):
         inexistFolder = "an inexist folder blablablabla"
         self.assertFalse(QDir(TEST_DIR).exists(inexistFolder), "Precondition not required.")
@@ -408,6 +559,25 @@ class FileOperationTest(unittest.TestCase):
 
         self.assertTrue(QDir(TEST_DIR).exists("a/a1"), "should keep")
 
+    def test_parallel_executer_and_recover(self):
+        aBatch = [("touch", TEST_DIR, f"parallel/{i}.txt") for i in range(20)]
+        aBatch += [("rename", TEST_DIR, "a.txt", TEST_DIR, "a moved.txt"),
+                   ("rename", TEST_DIR, "a moved.txt", TEST_DIR, "a moved twice.txt"),
+                   ("cpfile", TEST_DIR, "b.txt", f"{TEST_DIR}/a")]
+        ret, recover = FileOperation.executer(aBatch, maxWorkers=4)
+        self.assertTrue(ret)
+        self.assertTrue(QDir(TEST_DIR).exists("parallel/19.txt"))
+        self.assertTrue(QDir(TEST_DIR).exists("a moved twice.txt"))
+        self.assertFalse(QDir(TEST_DIR).exists("a.txt"))
+        self.assertTrue(QDir(TEST_DIR).exists("a/b.txt"))
+
+        recoverRet, _ = FileOperation.executer(recover, maxWorkers=4)
+        self.assertTrue(recoverRet, "Recover progress should succeed.")
+        self.assertFalse(QDir(TEST_DIR).exists("parallel"), "should recover")
+        self.assertTrue(QDir(TEST_DIR).exists("a.txt"), "should recover")
+        self.assertFalse(QDir(TEST_DIR).exists("a moved twice.txt"), "should recover")
+        self.assertFalse(QDir(TEST_DIR).exists("a/b.txt"), "should recover")
+
     def test_link_a_file(self):
         self.assertTrue(QDir(TEST_DIR).exists("a.txt"), "Precondition not required.")
         
@@ -469,5 +639,17 @@ class FileOperationTest(unittest.TestCase):
         self.assertTrue(QDir(TEST_DIR).exists("a/a1"))
         self.assertFalse(QDir(SystemPath.starredPath).exists("a/a1" + ".lnk"))
 
+
+class FileOperationQtBackendTest(FileOperationTest):
+    # the same cases on QDir/QFile
+    def setUp(self) -> None:
+        FileBackend.use(QtBackend.name)
+        return super().setUp()
+
+    def tearDown(self):
+        FileBackend.use(OsBackend.name)
+        return super().tearDown()
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,128 @@
+from PySide2.QtCore import QDir, QFileInfo
+import os
+import shutil
+import unittest
+from unittest import mock
+
+from CopyEngine import CopyEngine
+from FileOperation import FileOperation
+from Instrumentation import CommandCounters, Instrumentation, LatencyHistogram, LatencyHistograms
+
+TEST_SRC_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/DONT_CHANGE")
+TEST_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/COPY_REMOVABLE")
+
+
+class InstrumentationTest(unittest.TestCase):
+    def setUp(self) -> None:
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        shutil.copytree(TEST_SRC_DIR, TEST_DIR)
+        self.events: list[tuple] = list()
+        self.hook = lambda event, payload: self.events.append((event, payload))
+        Instrumentation.addHook(self.hook)
+        return super().setUp()
+
+    def tearDown(self):
+        Instrumentation.removeHook(self.hook)
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        return super().tearDown()
+
+    def test_command_stats(self):
+        with open(os.path.join(TEST_DIR, "data.bin"), "wb") as f:
+            f.write(b"x" * 5000)
+        os.mkdir(os.path.join(TEST_DIR, "to"))
+        aBatch = [("touch", TEST_DIR, "a.txt"), ("cpfile", TEST_DIR, "data.bin", os.path.join(TEST_DIR, "to")),
+                  ("cpdir", TEST_DIR, "a", os.path.join(TEST_DIR, "to"))]
+        ok, _ = FileOperation.executer(aBatch)
+        self.assertTrue(ok)
+        stats = [payload for event, payload in self.events if event == Instrumentation.COMMAND]
+        self.assertEqual([s.verb for s in stats], ["touch", "cpfile", "cpdir"])
+        self.assertEqual(stats[0].args, (TEST_DIR, "a.txt"))
+        self.assertTrue(all(s.errorCode == FileOperation.ErrorCode.OK and s.seconds >= 0 and s.fsCalls > 0 for s in stats))
+        self.assertEqual(stats[1].bytesMoved, 5000)
+        srcBytes = sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(os.path.join(TEST_DIR, "a"))
+                       for f in files)
+        self.assertEqual(stats[2].bytesMoved, srcBytes)
+
+    def test_failed_and_batch_done(self):
+        with self.assertLogs("FileOperation", level="WARNING") as logs:  # visible without any logging setup
+            ok, _ = FileOperation.executer([("rmfile", TEST_DIR, "inexist.txt"),
+                                            ("rename", TEST_DIR, "inexist", TEST_DIR, "b")])
+        self.assertFalse(ok)
+        self.assertEqual([r.levelname for r in logs.records], ["WARNING", "WARNING"])
+        self.assertIn("SRC_INEXIST", logs.output[0])
+        failed = [payload for event, payload in self.events if event == Instrumentation.COMMAND_FAILED]
+        self.assertEqual(failed, [("rename", (TEST_DIR, "inexist", TEST_DIR, "b"), FileOperation.ErrorCode.SRC_INEXIST)])
+        done = [payload for event, payload in self.events if event == Instrumentation.BATCH_DONE]
+        self.assertEqual(len(done), 1)
+        self.assertEqual((done[0]["commands"], done[0]["failed"]), (2, 1))
+
+    def test_copy_threads_detach_counters(self):
+        counters = CommandCounters()
+        jobs = [(os.path.join(TEST_DIR, "a.txt"), os.path.join(TEST_DIR, "a copied.txt"), 0)]
+        with mock.patch.object(Instrumentation, "Current", return_value=counters):  # the counters of the caller
+            self.assertEqual(CopyEngine.copyFiles(jobs), [True])
+        self.assertIsNone(Instrumentation.Current(), "not left on the thread which copied")
+        self.assertGreater(counters.fsCalls, 0)
+
+    def test_copy_counts_real_calls(self):
+        with open(os.path.join(TEST_DIR, "data.bin"), "wb") as f:
+            f.write(b"x" * 5000)
+        counters = CommandCounters()
+        previous = Instrumentation.attach(counters)
+        try:
+            with mock.patch.object(CopyEngine, "DataPaths", return_value=[(CopyEngine.READ_WRITE, CopyEngine._readWrite)]):
+                ret = CopyEngine.copyFile(os.path.join(TEST_DIR, "data.bin"), os.path.join(TEST_DIR, "copied.bin"))
+        finally:
+            Instrumentation.attach(previous)
+        self.assertTrue(ret.ok)
+        # open, fstat, close of src; open, fchmod, utime, close of dst; two reads and one write
+        self.assertEqual((counters.bytesMoved, counters.fsCalls), (5000, 10))
+
+    def test_nested_command_restores_outer_counters(self):
+        def inner(cmds: tuple) -> tuple:
+            Instrumentation.countFsCalls(2)
+            return FileOperation.ErrorCode.OK, list()
+
+        def outer(cmds: tuple) -> tuple:
+            Instrumentation.countFsCalls(1)
+            Instrumentation.instrumented(inner)(("touch", TEST_DIR, "inner.txt"))
+            Instrumentation.countFsCalls(1)  # still counted for outer
+            return FileOperation.ErrorCode.OK, list()
+
+        Instrumentation.instrumented(outer)(("touch", TEST_DIR, "outer.txt"))
+        stats = [payload for event, payload in self.events if event == Instrumentation.COMMAND]
+        self.assertEqual([(s.args[1], s.fsCalls) for s in stats], [("inner.txt", 2), ("outer.txt", 2)])
+        self.assertIsNone(Instrumentation.Current())
+
+    def test_latency_histograms(self):
+        histograms = LatencyHistograms()
+        Instrumentation.addHook(histograms)
+        try:
+            FileOperation.executer([("touch", TEST_DIR, f"h/{i}.txt") for i in range(20)])
+        finally:
+            Instrumentation.removeHook(histograms)
+        self.assertEqual(list(histograms.histograms), ["touch"])
+        touch = histograms.histograms["touch"]
+        self.assertEqual(touch.count, 20)
+        self.assertLessEqual(touch.percentile(50), touch.percentile(99))
+        self.assertGreater(touch.percentile(99), 0)
+
+    def test_histogram_buckets(self):
+        histogram = LatencyHistogram()
+        for seconds in (1e-6, 3e-6, 1e-3):
+            histogram.add(seconds)
+        self.assertEqual(histogram.percentile(30), 2e-6)
+        self.assertEqual(histogram.percentile(100), 1024e-6)
+
+    def test_no_hook_not_measured(self):
+        Instrumentation.removeHook(self.hook)
+        with mock.patch.object(Instrumentation, "instrumented") as instrumented:
+            ok, _ = FileOperation.executer([("touch", TEST_DIR, "a.txt")])
+        self.assertTrue(ok)
+        instrumented.assert_not_called()
+        self.assertIsNone(Instrumentation.Current())
+
+if __name__ == "__main__":
+    unittest.main()
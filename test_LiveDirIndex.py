@@ -0,0 +1,100 @@
+from PySide2.QtCore import QDir, QFileInfo
+from unittest import mock
+import math
+import os
+import shutil
+import time
+import unittest
+
+from CopyEngine import CopyEngine
+from FileBackend import FileBackend
+from FileOperation import FileOperation
+from LiveDirIndex import LiveDirIndex, IN_Q_OVERFLOW
+
+TEST_SRC_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/DONT_CHANGE")
+TEST_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/COPY_REMOVABLE")
+
+
+@unittest.skipUnless(LiveDirIndex.Supported(), "inotify is not supported")
+class LiveDirIndexTest(unittest.TestCase):
+    def setUp(self) -> None:
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        shutil.copytree(TEST_SRC_DIR, TEST_DIR)
+        self.index = LiveDirIndex.Watch(TEST_DIR)
+        return super().setUp()
+
+    def tearDown(self):
+        self.index.close()
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        return super().tearDown()
+
+    def waitFor(self, pth: str, kind: str) -> None:
+        # changes made by others show up once the thread read their events
+        deadline = time.monotonic() + 5
+        while self.index.kind(pth) != kind and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.index.kind(pth), kind)
+
+    def test_kinds_and_scan(self):
+        self.assertEqual(self.index.kind(f"{TEST_DIR}/a.txt"), LiveDirIndex.FILE)
+        self.assertEqual(self.index.kind(f"{TEST_DIR}/a"), LiveDirIndex.DIR)
+        self.assertEqual(self.index.kind(f"{TEST_DIR}/a/inexist/deeper"), LiveDirIndex.ABSENT)
+        self.assertEqual(self.index.kind(f"{TEST_DIR}/a.txt/x"), LiveDirIndex.ABSENT)
+        self.assertIsNone(self.index.kind(TEST_SRC_DIR))
+        os.symlink(f"{TEST_DIR}/a", f"{TEST_DIR}/link to a")
+        self.waitFor(f"{TEST_DIR}/link to a", None)  # what a symlink points to is not indexed
+
+        dirs, files = self.index.scanTree(f"{TEST_DIR}/a", withSize=True)
+        self.index.close()
+        realDirs, realFiles = CopyEngine.ScanTree(f"{TEST_DIR}/a", withSize=True)
+        self.assertEqual(sorted(dirs), sorted(realDirs))
+        self.assertEqual(sorted(files), sorted(realFiles))
+        self.assertGreater(self.index.footprint(), 0)
+
+    def test_changes_by_others(self):
+        os.makedirs(f"{TEST_DIR}/new/sub")
+        with open(f"{TEST_DIR}/new/sub/x.txt", "w") as fo:
+            fo.write("x")
+        self.waitFor(f"{TEST_DIR}/new/sub/x.txt", LiveDirIndex.FILE)
+        os.rename(f"{TEST_DIR}/new", f"{TEST_DIR}/a/moved")
+        self.waitFor(f"{TEST_DIR}/a/moved/sub/x.txt", LiveDirIndex.FILE)
+        self.waitFor(f"{TEST_DIR}/new", LiveDirIndex.ABSENT)
+        with open(f"{TEST_DIR}/a/moved/sub/x.txt", "a") as fo:
+            fo.write("longer")
+        shutil.rmtree(f"{TEST_DIR}/b")
+        self.waitFor(f"{TEST_DIR}/b", LiveDirIndex.ABSENT)
+        self.assertEqual(self.index.staleness(), 0.0)
+        self.assertIn(("moved/sub/x.txt", 7), self.index.scanTree(f"{TEST_DIR}/a", withSize=True)[1])
+
+    def test_executer_is_served_by_the_index(self):
+        realExists = FileBackend.current().exists
+        with mock.patch.object(FileBackend.current(), "exists", side_effect=realExists) as exists, \
+                mock.patch("os.scandir", side_effect=os.scandir) as scandir:
+            ret, recover = FileOperation.executer([("mkpath", TEST_DIR, "new"),
+                                                   ("cpdir", TEST_DIR, "a", f"{TEST_DIR}/new"),
+                                                   ("touch", TEST_DIR, "new/a/touched.txt"),
+                                                   ("cpfile", TEST_DIR, "new/a/touched.txt", f"{TEST_DIR}/b")])
+            self.assertTrue(ret)
+        self.assertEqual(exists.call_count, 0)
+        srcScans = [c for c in scandir.call_args_list if c.args and LiveDirIndex.Key(c.args[0]) == f"{TEST_DIR}/a"]
+        self.assertEqual(srcScans, list())  # the new dirs are listed by the index, the source of cpdir is not
+        self.assertTrue(QDir(TEST_DIR).exists("b/new/a/touched.txt"))  # the batch sees its own changes at once
+        self.assertTrue(FileOperation.executer(recover)[0])
+        self.assertEqual(self.index.kind(f"{TEST_DIR}/new"), LiveDirIndex.ABSENT)
+
+    def test_overflow_falls_back_and_rebuilds(self):
+        rebuilds = self.index.rebuilds
+        with self.index._lock:
+            self.index._apply(-1, IN_Q_OVERFLOW, "")
+            self.assertIsNone(self.index.kind(f"{TEST_DIR}/a.txt"))
+            self.assertEqual(self.index.staleness(), math.inf)
+            self.assertTrue(FileOperation._exists(f"{TEST_DIR}/a.txt"))  # the real syscall
+        self.waitFor(f"{TEST_DIR}/a.txt", LiveDirIndex.FILE)
+        self.assertEqual(self.index.rebuilds, rebuilds + 1)
+        self.assertEqual(self.index.overflows, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+from PySide2.QtCore import QDir, QFileInfo
+from unittest import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from CopyEngine import CopyEngine
+from DirFdContext import DirFdContext
+from FileOperation import FileOperation
+from MoveEngine import MoveEngine
+from StagedDelete import StagingArea, StagingReaper, StagingUnavailable
+
+TEST_SRC_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/DONT_CHANGE")
+TEST_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/COPY_REMOVABLE")
+OTHER_DEVICE_DIR = "/dev/shm"
+
+
+class MoveEngineTest(unittest.TestCase):
+    def setUp(self) -> None:
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        shutil.copytree(TEST_SRC_DIR, TEST_DIR)
+        self.stagingDir = StagingArea.register(os.path.join(TEST_DIR, StagingArea.STAGING_DIR_NAME))
+        os.symlink("a1.txt", f"{TEST_DIR}/a/link to a1.txt")
+        return super().setUp()
+
+    def tearDown(self):
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        return super().tearDown()
+
+    def assertMovedTree(self, dst: str):
+        self.assertFalse(QDir(TEST_DIR).exists("a"))
+        self.assertEqual(os.readlink(f"{dst}/link to a1.txt"), "a1.txt")
+        for rel in ("a1.txt", "a1/a2.txt", "a1/a2/a3.txt"):
+            with open(f"{TEST_SRC_DIR}/a/{rel}", "rb") as fa, open(f"{dst}/{rel}", "rb") as fb:
+                self.assertEqual(fa.read(), fb.read())
+        staged = set(os.listdir(self.stagingDir)) - {StagingArea.PINS_DIR_NAME}
+        self.assertEqual(staged, set(), "the source is deleted at the end")
+        self.assertEqual(StagingArea.pins(self.stagingDir), dict())
+
+    def test_move_dir_across_devices(self):
+        with mock.patch.object(MoveEngine, "SameDevice", return_value=False):
+            ret, aBatch = FileOperation.rename(TEST_DIR, "a", TEST_DIR, "moved/a")
+        self.assertEqual(ret, FileOperation.ErrorCode.OK)
+        self.assertMovedTree(f"{TEST_DIR}/moved/a")
+        self.assertEqual(os.listdir(f"{TEST_DIR}/moved"), ["a"], "no hidden copy left")
+
+        with mock.patch.object(MoveEngine, "SameDevice", return_value=False):
+            recoverRet, _ = FileOperation.executer(aBatch[::-1])
+        self.assertTrue(recoverRet, "Recover progress should succeed.")
+        self.assertTrue(QDir(TEST_DIR).exists("a/a1/a2/a3.txt"), "should recover")
+        self.assertFalse(QDir(TEST_DIR).exists("moved"), "should recover")
+
+    def test_verify_failure_keeps_source(self):
+        with mock.patch.object(MoveEngine, "SameDevice", return_value=False), \
+                mock.patch.object(CopyEngine, "upToDate", return_value=False):
+            ret, aBatch = FileOperation.rename(TEST_DIR, "a", TEST_DIR, "b/a")
+        self.assertEqual(ret, FileOperation.ErrorCode.UNKNOWN_ERROR)
+        self.assertEqual(list(aBatch), list())
+        self.assertTrue(QDir(TEST_DIR).exists("a/a1/a2/a3.txt"), "source untouched")
+        self.assertEqual(sorted(os.listdir(f"{TEST_DIR}/b")), ["b1", "b1.txt"], "the partial copy is removed")
+
+    def test_publish_failure_puts_source_back(self):
+        rename = DirFdContext.RenameNoReplace
+
+        def failPublish(src: str, dst: str):
+            if ".moving-" in src:
+                raise OSError("publish failed")
+            return rename(src, dst)
+
+        with mock.patch.object(DirFdContext, "RenameNoReplace", side_effect=failPublish):
+            ret = MoveEngine.move(f"{TEST_DIR}/a", f"{TEST_DIR}/b/a")
+        self.assertEqual((ret.ok, ret.step, ret.staged), (False, MoveEngine.PUBLISH, None))
+        self.assertTrue(QDir(TEST_DIR).exists("a/a1/a2/a3.txt"), "source renamed back")
+        self.assertFalse(QDir(TEST_DIR).exists("b/a"))
+
+    def test_dst_created_during_copy_is_not_replaced(self):
+        copyFiles = CopyEngine.copyFiles
+
+        def createDst(*args, **kwargs):
+            os.mkdir(f"{TEST_DIR}/b/a")
+            with open(f"{TEST_DIR}/b/a/mine.txt", "w") as f:
+                f.write("mine")
+            return copyFiles(*args, **kwargs)
+
+        with mock.patch.object(CopyEngine, "copyFiles", side_effect=createDst):
+            ret = MoveEngine.move(f"{TEST_DIR}/a", f"{TEST_DIR}/b/a")
+        self.assertEqual((ret.ok, ret.step, ret.staged), (False, MoveEngine.PUBLISH, None))
+        self.assertEqual(os.listdir(f"{TEST_DIR}/b/a"), ["mine.txt"], "dst created meanwhile is kept")
+        self.assertTrue(QDir(TEST_DIR).exists("a/a1/a2/a3.txt"), "source renamed back")
+        self.assertEqual(sorted(os.listdir(f"{TEST_DIR}/b")), ["a", "b1", "b1.txt"], "the hidden copy is removed")
+
+    @unittest.skipUnless(hasattr(os, "mkfifo"), "needs FIFOs")
+    def test_fifo_in_tree_is_refused(self):
+        os.mkfifo(f"{TEST_DIR}/a/a1/fifo")
+        ret = MoveEngine.move(f"{TEST_DIR}/a", f"{TEST_DIR}/b/a")
+        self.assertEqual((ret.ok, ret.step), (False, MoveEngine.COPY))
+        self.assertTrue(QDir(TEST_DIR).exists("a/a1/fifo"), "source untouched")
+        self.assertEqual(sorted(os.listdir(f"{TEST_DIR}/b")), ["b1", "b1.txt"])
+        self.assertEqual(StagingArea.pins(self.stagingDir), dict())
+
+        ret = MoveEngine.move(f"{TEST_DIR}/a/a1/fifo", f"{TEST_DIR}/b/fifo")
+        self.assertEqual((ret.ok, ret.step), (False, MoveEngine.COPY))
+
+    def test_no_staging_dir_publishes_then_deletes(self):
+        with mock.patch.object(StagingArea, "StagingDirFor", side_effect=StagingUnavailable("no staging dir")):
+            ret = MoveEngine.move(f"{TEST_DIR}/a", f"{TEST_DIR}/b/a")
+        self.assertEqual((ret.ok, ret.staged), (True, None))
+        self.assertMovedTree(f"{TEST_DIR}/b/a")
+
+    def test_interrupted_move_is_recovered_by_reaper(self):
+        rename = DirFdContext.RenameNoReplace
+
+        def dieBeforePublish(src: str, dst: str):
+            if ".moving-" in src:
+                raise KeyboardInterrupt  # nothing of move's own cleanup runs
+            return rename(src, dst)
+
+        with mock.patch.object(DirFdContext, "RenameNoReplace", side_effect=dieBeforePublish), \
+                self.assertRaises(KeyboardInterrupt):
+            MoveEngine.move(f"{TEST_DIR}/a", f"{TEST_DIR}/b/a")
+        self.assertFalse(QDir(TEST_DIR).exists("a"), "the source is staged")
+        self.assertEqual(len(StagingArea.pins(self.stagingDir)), 1)
+
+        reaper = StagingReaper(retentionSeconds=0)
+        self.assertEqual(reaper.reapOnce(), 0, "the owner is alive, the staged source is pinned")
+        self.assertFalse(QDir(TEST_DIR).exists("a"))
+        with mock.patch.object(StagingArea, "Alive", return_value=False):
+            reaper.reapOnce()
+        self.assertTrue(QDir(TEST_DIR).exists("a/a1/a2/a3.txt"), "the source is put back")
+        self.assertEqual(sorted(os.listdir(f"{TEST_DIR}/b")), ["b1", "b1.txt"], "the hidden copy is removed")
+        self.assertEqual(os.listdir(self.stagingDir), [StagingArea.PINS_DIR_NAME])
+        self.assertEqual(StagingArea.pins(self.stagingDir), dict())
+
+    @unittest.skipUnless(os.path.isdir(OTHER_DEVICE_DIR) and os.access(OTHER_DEVICE_DIR, os.W_OK)
+                         and os.stat(OTHER_DEVICE_DIR).st_dev != os.stat(QFileInfo(__file__).absolutePath()).st_dev,
+                         "needs a writable dir on another filesystem")
+    def test_move_to_another_filesystem(self):
+        other = tempfile.mkdtemp(dir=OTHER_DEVICE_DIR)
+        try:
+            ret, aBatch = FileOperation.rename(TEST_DIR, "a", other, "a")
+            self.assertEqual(ret, FileOperation.ErrorCode.OK)
+            self.assertMovedTree(f"{other}/a")
+            recoverRet, _ = FileOperation.executer(aBatch[::-1])
+            self.assertTrue(recoverRet, "Recover progress should succeed.")
+            self.assertTrue(QDir(TEST_DIR).exists("a/a1/a2/a3.txt"), "should recover")
+        finally:
+            shutil.rmtree(other, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
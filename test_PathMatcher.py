@@ -0,0 +1,76 @@
+from PySide2.QtCore import QDir, QFileInfo
+import os
+import shutil
+import unittest
+
+from BatchPlanner import BatchPlanner
+from FileOperation import FileOperation
+from PathMatcher import PathMatcher
+
+TEST_SRC_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/DONT_CHANGE")
+TEST_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/COPY_REMOVABLE")
+
+
+class PathMatcherTest(unittest.TestCase):
+    def setUp(self) -> None:
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        shutil.copytree(TEST_SRC_DIR, TEST_DIR)
+        for rel in ("x.tmp", "a/x.tmp", "a/a1/y.tmp", "a/a1/keep.txt", "b/deep/er/z.tmp"):
+            os.makedirs(os.path.dirname(f"{TEST_DIR}/{rel}"), exist_ok=True)
+            with open(f"{TEST_DIR}/{rel}", "w") as fo:
+                fo.write(rel)
+        self.tmps = ["a/a1/y.tmp", "a/x.tmp", "b/deep/er/z.tmp", "x.tmp"]
+        return super().setUp()
+
+    def tearDown(self):
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        return super().tearDown()
+
+    def test_walk(self):
+        self.assertEqual(sorted(PathMatcher.Walk(TEST_DIR, "*.tmp")), self.tmps)
+        self.assertEqual(sorted(PathMatcher.Walk(TEST_DIR, "a/*.tmp")), ["a/a1/y.tmp", "a/x.tmp"])  # like fnmatch
+        self.assertEqual(list(PathMatcher.Walk(TEST_DIR, r"re:^b/.*\.tmp$")), ["b/deep/er/z.tmp"])
+        self.assertEqual(sorted(PathMatcher.Walk(TEST_DIR, "*.tmp", prune=f"{TEST_DIR}/a")), ["b/deep/er/z.tmp", "x.tmp"])
+
+    def test_same_recover_as_expanded_batch(self):
+        for verb, expanded in (("rmglob", lambda rel: ("rmfile", TEST_DIR, rel)),
+                               ("mvglob", lambda rel: ("rename", TEST_DIR, rel, f"{TEST_DIR}/out", rel)),
+                               ("cpglob", lambda rel: ("cpfile", TEST_DIR, rel, f"{TEST_DIR}/out"))):
+            self.setUp()
+            os.mkdir(f"{TEST_DIR}/out")
+            aBatch = [expanded(rel) for rel in PathMatcher.Walk(TEST_DIR, "*.tmp", prune=f"{TEST_DIR}/out")]
+            ret, expandedRecover = FileOperation.executer(aBatch)
+            self.assertTrue(ret)
+            self.assertTrue(FileOperation.executer(expandedRecover)[0])
+
+            cmds = (verb, TEST_DIR, "", "*.tmp") + ((f"{TEST_DIR}/out",) if verb != "rmglob" else ())
+            plan = BatchPlanner.plan([cmds])
+            ret, recover = FileOperation.executer([cmds])
+            self.assertTrue(ret)
+            self.assertEqual(recover, expandedRecover, verb)
+            self.assertEqual(plan.recoverList, recover, verb)
+            self.assertEqual(sorted(PathMatcher.Walk(TEST_DIR, "*.tmp", prune=f"{TEST_DIR}/out")),
+                             self.tmps if verb == "cpglob" else [])
+            if verb != "rmglob":
+                self.assertEqual(sorted(PathMatcher.Walk(f"{TEST_DIR}/out", "*.tmp")), self.tmps)
+
+    def test_sub_dir_and_errors(self):
+        ret, recover = FileOperation.executer([("mvglob", TEST_DIR, "a", "*.tmp", f"{TEST_DIR}/b")])
+        self.assertTrue(ret)
+        self.assertTrue(QDir(TEST_DIR).exists("b/a/a1/y.tmp"))
+        self.assertTrue(QDir(TEST_DIR).exists("a/a1/keep.txt"))
+        self.assertTrue(FileOperation.executer(recover)[0])
+        self.assertTrue(QDir(TEST_DIR).exists("a/a1/y.tmp"))
+        self.assertFalse(QDir(TEST_DIR).exists("b/a"))
+
+        self.assertEqual(FileOperation.rmglob(TEST_DIR, "inexist", "*"),
+                         (FileOperation.ErrorCode.SRC_DIR_INEXIST, list()))
+        self.assertEqual(FileOperation.rmglob(TEST_DIR, "", "re:(")[0], FileOperation.ErrorCode.INVALID_PATTERN)
+        self.assertEqual(FileOperation.cpglob(TEST_DIR, "", "*", f"{TEST_DIR}/inexist")[0],
+                         FileOperation.ErrorCode.DST_DIR_INEXIST)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+from PySide2.QtCore import QDir, QFileInfo
+import os
+import shutil
+import unittest
+
+from BatchPlanner import BatchPlanner
+from FileOperation import FileOperation
+from RecoverCompactor import RecoverCompactor
+
+TEST_SRC_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/DONT_CHANGE")
+TEST_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/COPY_REMOVABLE")
+
+
+class RecoverCompactorTest(unittest.TestCase):
+    def setUp(self) -> None:
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        shutil.copytree(TEST_SRC_DIR, TEST_DIR)
+        return super().setUp()
+
+    def tearDown(self):
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        return super().tearDown()
+
+    @staticmethod
+    def snapshot() -> dict[str, bytes | None]:
+        tree = dict()
+        for root, dirs, files in os.walk(TEST_DIR):
+            rel = os.path.relpath(root, TEST_DIR)
+            for d in dirs:
+                tree[os.path.join(rel, d)] = None
+            for f in files:
+                with open(os.path.join(root, f), "rb") as fo:
+                    tree[os.path.join(rel, f)] = fo.read()
+        return tree
+
+    def test_cpdir_is_one_rmtree(self):
+        initial = self.snapshot()
+        aBatch = [("mkpath", TEST_DIR, "new"), ("cpdir", TEST_DIR, "a", f"{TEST_DIR}/new"),
+                  ("touch", TEST_DIR, "new/deep/x.txt")]
+        ret, full = FileOperation.executer(aBatch)
+        self.assertTrue(ret)
+        compacted = RecoverCompactor.compact(full)
+        self.assertEqual(len(compacted), 1)
+        verb, pre, rel, files, dirs = compacted[0]
+        self.assertEqual((verb, pre, rel), ("rmtree", TEST_DIR, "new"))
+        self.assertEqual(len(files) + len(dirs), len(full) - 1)
+        self.assertIn("a/a1.txt", files)
+        self.assertIn("a", dirs)
+        self.assertIn("deep", dirs)
+
+        self.assertEqual(BatchPlanner.plan(compacted).recoverList, [("mkpath", TEST_DIR, "new")])
+        self.assertTrue(FileOperation.executer(compacted)[0])
+        self.assertEqual(self.snapshot(), initial)
+
+        ret, recover = FileOperation.executer(aBatch, compactRecover=True)
+        self.assertTrue(ret)
+        self.assertEqual(recover, compacted)
+
+    def test_foreign_entries_are_kept(self):
+        aBatch = [("mkpath", TEST_DIR, "new"), ("cpdir", TEST_DIR, "a", f"{TEST_DIR}/new")]
+        ret, recover = FileOperation.executer(aBatch, compactRecover=True)
+        self.assertTrue(ret)
+        self.assertEqual(len(recover), 1)
+        with open(f"{TEST_DIR}/new/a/a1/foreign.txt", "w") as fo:
+            fo.write("not created by the batch")
+
+        ret, _ = FileOperation.executer(recover)
+        self.assertFalse(ret)  # like the rmpath of a dir which is not empty
+        self.assertEqual(sorted(os.listdir(f"{TEST_DIR}/new")), ["a"])
+        self.assertEqual(sorted(os.listdir(f"{TEST_DIR}/new/a")), ["a1"])
+        self.assertEqual(sorted(os.listdir(f"{TEST_DIR}/new/a/a1")), ["foreign.txt"])
+
+    def test_exceptions_stay_in_place(self):
+        initial = self.snapshot()
+        aBatch = [("mkpath", TEST_DIR, "new"), ("touch", TEST_DIR, "new/x.txt"),
+                  ("rename", TEST_DIR, "a.txt", TEST_DIR, "new/a.txt"), ("touch", TEST_DIR, "new/y.txt")]
+        ret, recover = FileOperation.executer(aBatch, compactRecover=True)
+        self.assertTrue(ret)
+        self.assertEqual(recover, [("rmfile", TEST_DIR, "new/y.txt"),
+                                   ("rename", TEST_DIR, "new/a.txt", TEST_DIR, "a.txt"),
+                                   ("rmtree", TEST_DIR, "new", ("x.txt",), ())])
+        self.assertTrue(FileOperation.executer(recover)[0])
+        self.assertEqual(self.snapshot(), initial)
+
+    def test_existing_dirs_are_not_roots(self):
+        aBatch = [("touch", TEST_DIR, "a/new1.txt"), ("touch", TEST_DIR, "a/new2.txt"), ("mkpath", TEST_DIR, "a/m")]
+        ret, recover = FileOperation.executer(aBatch)
+        self.assertTrue(ret)
+        self.assertEqual(RecoverCompactor.compact(recover), recover)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+
+from RecoverLog import RecoverLog
+
+
+class RecoverLogTest(unittest.TestCase):
+    COMMANDS = [("rmpath", "/to", "a"), ("rmfile", "/to/a", "a1.txt"), ("rmfile", "/to/a", "a2.txt"),
+                ("rename", "/to", "x", "/from", "y"), tuple(), ("unlink", "/pre", "a.lnk", "/to")]
+
+    def test_round_trip(self):
+        log = RecoverLog.fromList(self.COMMANDS)
+        self.assertEqual(len(log), len(self.COMMANDS))
+        self.assertEqual(log.toList(), self.COMMANDS)
+        self.assertEqual(log, self.COMMANDS)
+        self.assertEqual(log[1], ("rmfile", "/to/a", "a1.txt"))
+        self.assertEqual(log[-1], self.COMMANDS[-1])
+        self.assertEqual(log[::-1], self.COMMANDS[::-1])
+        self.assertFalse(bool(RecoverLog()))
+
+    def test_prefix_is_interned(self):
+        log = RecoverLog(("rmfile", "/to/a", f"{i}.txt") for i in range(1000))
+        self.assertEqual(len(log._prefixes), 1)
+        self.assertEqual(len(log._strings), 1000)
+
+    def test_reverse_in_place(self):
+        log = RecoverLog(self.COMMANDS)
+        log.reverse()
+        self.assertEqual(log.toList(), self.COMMANDS[::-1])
+        self.assertEqual(list(reversed(log)), self.COMMANDS)
+        self.assertEqual(log[0], self.COMMANDS[-1])
+        log.append(("rmfile", "/to", "last.txt"))
+        self.assertEqual(log.toList(), self.COMMANDS[::-1] + [("rmfile", "/to", "last.txt")])
+
+    def test_extend_and_setitem(self):
+        log = RecoverLog()
+        log += self.COMMANDS[:2]
+        log.extend(RecoverLog(self.COMMANDS[2:]))
+        self.assertEqual(log, self.COMMANDS)
+        log[-2] = tuple()
+        self.assertEqual(log[-2], tuple())
+        lst = list()
+        lst += log
+        self.assertEqual(len(lst), len(self.COMMANDS))
+        self.assertEqual(log + [("rmfile", "/to", "z")], self.COMMANDS[:-2] + [tuple(), self.COMMANDS[-1], ("rmfile", "/to", "z")])
+        self.assertEqual(([tuple()] + log)[1:], log)
+        self.assertEqual(len(log), len(self.COMMANDS), "+ leaves the log unchanged")
+
+
+if __name__ == "__main__":
+    unittest.main()
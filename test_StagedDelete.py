@@ -0,0 +1,118 @@
+from PySide2.QtCore import QDir, QFileInfo
+from unittest import mock
+import os
+import shutil
+import unittest
+
+from FileOperation import FileOperation
+from StagedDelete import StagingArea, StagingReaper, StagingUnavailable
+
+TEST_SRC_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/DONT_CHANGE")
+TEST_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/COPY_REMOVABLE")
+
+
+class StagedDeleteTest(unittest.TestCase):
+    def setUp(self) -> None:
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        shutil.copytree(TEST_SRC_DIR, TEST_DIR)
+        self.stagingDir = StagingArea.register(os.path.join(TEST_DIR, StagingArea.STAGING_DIR_NAME))
+        return super().setUp()
+
+    def tearDown(self):
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        return super().tearDown()
+
+    def test_stage_delete_folder_and_recover(self):
+        ret, aBatch = FileOperation.stageDelete(TEST_DIR, "a")
+        self.assertEqual(ret, FileOperation.ErrorCode.OK)
+        self.assertFalse(QDir(TEST_DIR).exists("a"))
+        self.assertEqual(len(os.listdir(self.stagingDir)), 1)
+        self.assertEqual(aBatch[0][:2], ("rename", self.stagingDir))
+
+        recoverRet, _ = FileOperation.executer(aBatch[::-1])
+        self.assertTrue(recoverRet, "Recover progress should succeed.")
+        self.assertTrue(QDir(TEST_DIR).exists("a/a1/a2/a3.txt"), "should recover")
+        self.assertEqual(os.listdir(self.stagingDir), list())
+
+    def test_stage_delete_inexist(self):
+        ret, aBatch = FileOperation.stageDelete(TEST_DIR, "an inexist file blablablabla.txt")
+        self.assertEqual(ret, FileOperation.ErrorCode.OK)
+        self.assertFalse(bool(aBatch))
+
+    def test_deleted_staging_dir_is_made_again(self):
+        shutil.rmtree(self.stagingDir)
+        ret, aBatch = FileOperation.stageDelete(TEST_DIR, "a.txt")
+        self.assertEqual(ret, FileOperation.ErrorCode.OK)
+        self.assertEqual(os.listdir(self.stagingDir), [aBatch[0][2]])
+        self.assertTrue(FileOperation.executer(aBatch)[0])
+        self.assertTrue(QDir(TEST_DIR).exists("a.txt"), "should recover")
+
+    @unittest.skipUnless(os.stat("/").st_dev == os.stat(TEST_DIR.rsplit("/", 1)[0]).st_dev,
+                         "needs the test dir on the root filesystem")
+    def test_root_is_never_a_staging_dir(self):
+        with mock.patch.dict(StagingArea._stagingDirs, clear=True), mock.patch("os.access", return_value=True), \
+                mock.patch.object(StagingArea, "HomeStagingDir", return_value="/proc/inexist/staging"):
+            ret, aBatch = FileOperation.stageDelete(TEST_DIR, "a")
+            self.assertEqual((ret, aBatch), (FileOperation.ErrorCode.STAGING_UNAVAILABLE, list()), "refused")
+            self.assertEqual(StagingArea.stagingDirs(), list())
+        self.assertTrue(QDir(TEST_DIR).exists("a/a1/a2/a3.txt"), "never deleted without its undo")
+        self.assertFalse(os.path.exists("/" + StagingArea.STAGING_DIR_NAME))
+
+    @unittest.skipUnless(hasattr(os, "getuid"), "owner and mode are POSIX")
+    def test_staging_dir_must_be_private(self):
+        self.assertEqual(os.stat(self.stagingDir).st_mode & 0o777, 0o700)
+        os.chmod(self.stagingDir, 0o777)
+        with self.assertRaises(StagingUnavailable):
+            StagingArea.Private(self.stagingDir)
+        elsewhere = os.path.join(TEST_DIR, "elsewhere")
+        os.mkdir(elsewhere, 0o700)
+        os.symlink(elsewhere, os.path.join(TEST_DIR, "linked staging"))
+        with self.assertRaises(StagingUnavailable):
+            StagingArea.Private(os.path.join(TEST_DIR, "linked staging"))
+
+    def test_reaper_respects_retention(self):
+        FileOperation.executer([("stageDelete", TEST_DIR, "a"), ("stageDelete", TEST_DIR, "b.txt")])
+        keeper = StagingReaper(retentionSeconds=3600)
+        self.assertEqual(keeper.reapOnce(), 0)
+        reaper = StagingReaper(retentionSeconds=0)
+        self.assertGreaterEqual(reaper.reapOnce(), 2)
+        self.assertEqual(os.listdir(self.stagingDir), list())
+        self.assertEqual(reaper.entriesRemoved, 7)
+
+    def test_reaper_keeps_pinned(self):
+        stagingDir, stagedName = StagingArea.stage(os.path.join(TEST_DIR, "a"), pin=True)
+        StagingArea.stage(os.path.join(TEST_DIR, "b.txt"))
+        reaper = StagingReaper(retentionSeconds=0)
+        self.assertEqual(reaper.reapOnce(), 1)
+        self.assertEqual(sorted(os.listdir(stagingDir)), sorted([StagingArea.PINS_DIR_NAME, stagedName]))
+        StagingArea.unpin(stagingDir, stagedName)
+        self.assertEqual(reaper.reapOnce(), 1)
+        self.assertEqual(os.listdir(stagingDir), [StagingArea.PINS_DIR_NAME])
+
+    def test_executer_runs_a_reaper_for_every_known_staging_dir(self):
+        with mock.patch.dict(os.environ, {"XDG_DATA_HOME": f"{TEST_DIR}/.data"}):
+            FileOperation.executer([("touch", TEST_DIR, "new.txt")])
+            self.assertTrue(StagingReaper.ensureRunning().is_alive())
+            other = StagingArea.Private(f"{TEST_DIR}/other process staging")
+            os.makedirs(f"{TEST_DIR}/.data")
+            with open(StagingArea.KnownDirsPath(), "a") as f:  # what another process records
+                f.write(other + "\n")
+            with mock.patch.dict(StagingArea._stagingDirs, clear=True):
+                self.assertEqual(StagingArea.knownStagingDirs(), [other])
+            with open(f"{other}/1-1-staged by the other process.txt", "w") as f:
+                f.write("old")
+            self.assertEqual(StagingReaper(retentionSeconds=0).reapOnce(), 1)
+            self.assertEqual(os.listdir(other), list())
+
+    def test_reaper_thread_stops(self):
+        FileOperation.stageDelete(TEST_DIR, "a")
+        reaper = StagingReaper(retentionSeconds=0, bytesPerSecond=1 << 30, scanIntervalSeconds=0.01)
+        reaper.start()
+        reaper.stop()
+        self.assertFalse(reaper.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+from PySide2.QtCore import QDir, QFileInfo
+from unittest import mock
+import os
+import shutil
+import unittest
+
+from DirFdContext import DirFdContext
+from FileOperation import FileOperation
+from StatCache import StatCache
+
+TEST_SRC_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/DONT_CHANGE")
+TEST_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/COPY_REMOVABLE")
+
+
+class StatCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        shutil.copytree(TEST_SRC_DIR, TEST_DIR)
+        return super().setUp()
+
+    def tearDown(self):
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        return super().tearDown()
+
+    def test_hit_and_invalidate(self):
+        cache = StatCache()
+        pth = os.path.join(TEST_DIR, "new.txt")
+        self.assertFalse(cache.exists(pth))
+        self.assertFalse(cache.exists(pth))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        open(pth, "w").close()
+        cache.created(pth)
+        self.assertTrue(cache.isFile(pth))
+        os.remove(pth)
+        cache.removed(pth)
+        self.assertFalse(cache.exists(pth))
+
+    def test_alias_is_dropped_with_its_key(self):
+        cache = StatCache()
+        pth = os.path.join(TEST_DIR, "new.txt")
+        alias = os.path.join(TEST_DIR, "a", "..", "new.txt")
+        self.assertFalse(cache.exists(pth))
+        with mock.patch.object(StatCache, "Key", side_effect=AssertionError("a hit normalizes nothing")):
+            self.assertFalse(cache.exists(pth))
+        self.assertFalse(cache.exists(alias))
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        open(pth, "w").close()
+        cache.created(pth)
+        self.assertTrue(cache.exists(alias))
+        self.assertEqual(cache.misses, 2)
+        os.remove(pth)
+        cache.removed(alias)
+        self.assertEqual(cache._aliases, dict())
+        self.assertFalse(cache.exists(pth))
+        self.assertFalse(cache.exists(alias))
+
+    def test_created_drops_negative_ancestors(self):
+        cache = StatCache()
+        self.assertFalse(cache.isDir(os.path.join(TEST_DIR, "x")))
+        self.assertFalse(cache.exists(os.path.join(TEST_DIR, "x/y/z.txt")))
+        os.makedirs(os.path.join(TEST_DIR, "x/y"))
+        open(os.path.join(TEST_DIR, "x/y/z.txt"), "w").close()
+        cache.created(os.path.join(TEST_DIR, "x/y/z.txt"))
+        self.assertTrue(cache.isDir(os.path.join(TEST_DIR, "x")))
+        self.assertTrue(cache.exists(os.path.join(TEST_DIR, "x/y/z.txt")))
+
+    def test_removed_drops_subtree(self):
+        cache = StatCache()
+        self.assertTrue(cache.exists(os.path.join(TEST_DIR, "a/a1/a2.txt")))
+        shutil.rmtree(os.path.join(TEST_DIR, "a"))
+        cache.removed(os.path.join(TEST_DIR, "a"))
+        self.assertFalse(cache.exists(os.path.join(TEST_DIR, "a/a1/a2.txt")))
+
+    def test_invalidation_during_a_miss_wins(self):
+        cache = StatCache()
+        pth = os.path.join(TEST_DIR, "x/new.txt")
+        call = DirFdContext.Call
+
+        def createdMeanwhile(func, key):
+            try:
+                return call(func, key)  # inexist when stat-ed
+            finally:
+                os.makedirs(os.path.dirname(pth))
+                open(pth, "w").close()
+                cache.created(pth)  # what another worker reports before this miss stores its None
+
+        with mock.patch.object(DirFdContext, "Call", side_effect=createdMeanwhile):
+            self.assertFalse(cache.exists(pth))
+        self.assertTrue(cache.exists(pth))
+        self.assertTrue(cache.isDir(os.path.dirname(pth)))
+        self.assertEqual(cache.misses, 3, "the stale result was not cached")
+        self.assertEqual(cache._invalidated, dict())
+
+    def test_removed_empty_parents_drops_links(self):
+        cache = StatCache()
+        self.assertFalse(cache.exists(os.path.join(TEST_DIR, "x/y/z.txt")))
+        self.assertTrue(cache._children)
+        cache.removed(os.path.join(TEST_DIR, "x/y/z.txt"), emptyParents=True)
+        self.assertEqual((cache._entries, cache._children), (dict(), dict()))
+
+        self.assertTrue(cache.exists(os.path.join(TEST_DIR, "a/a1.txt")))
+        self.assertFalse(cache.exists(os.path.join(TEST_DIR, "a/x/y")))
+        cache.removed(os.path.join(TEST_DIR, "a/x/y"), emptyParents=True)
+        self.assertEqual(cache._children[StatCache.Key(os.path.join(TEST_DIR, "a"))],
+                         {StatCache.Key(os.path.join(TEST_DIR, "a/a1.txt"))}, "links of cached siblings stay")
+        shutil.rmtree(os.path.join(TEST_DIR, "a"))
+        cache.removed(TEST_DIR)
+        self.assertFalse(cache.exists(os.path.join(TEST_DIR, "a/a1.txt")))
+
+    def test_executer_with_cache_is_identical(self):
+        def batch():
+            return [("touch", TEST_DIR, f"shared/{i}.txt") for i in range(50)] + \
+                [("rename", TEST_DIR, f"shared/{i}.txt", TEST_DIR, f"shared/moved/{i}.txt") for i in range(50)] + \
+                [("cpfile", TEST_DIR, "a.txt", f"{TEST_DIR}/shared"), ("rmdir", TEST_DIR, "b"),
+                 ("touch", TEST_DIR, "b/b1.txt"), ("rename", TEST_DIR, "a.txt", TEST_DIR, "b.txt")]
+
+        cache = StatCache()
+        ret, recover = FileOperation.executer(batch(), statCache=cache)
+        self.assertFalse(ret, "the last rename conflicts")
+        self.assertGreater(cache.hits, 100)
+        cachedTree = sorted(os.walk(TEST_DIR))
+        self.assertTrue(FileOperation.executer(recover)[0])
+
+        ret2, recover2 = FileOperation.executer(batch())
+        self.assertFalse(ret2)
+        self.assertEqual(sorted(os.walk(TEST_DIR)), cachedTree)
+        self.assertEqual(recover2, recover)
+
+
+if __name__ == "__main__":
+    unittest.main()
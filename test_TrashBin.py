@@ -0,0 +1,107 @@
+from PySide2.QtCore import QDir, QFileInfo
+from unittest import mock
+import json
+import os
+import shutil
+import time
+import unittest
+
+from FileBackend import FileBackend
+from FileOperation import FileOperation
+from TrashBin import TrashBin, TRASH_INDEX_NAME
+
+TEST_SRC_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/DONT_CHANGE")
+TEST_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/COPY_REMOVABLE")
+
+
+@unittest.skipUnless(FileBackend.current().hasTrash(), "no freedesktop.org trash")
+class TrashBinTest(unittest.TestCase):
+    def setUp(self) -> None:
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        shutil.copytree(TEST_SRC_DIR, TEST_DIR)
+        self.env = mock.patch.dict(os.environ, {"XDG_DATA_HOME": f"{TEST_DIR}/.data"})
+        self.env.start()
+        self.trashDir = f"{TEST_DIR}/.data/Trash"
+        self.many = [f"many/{i % 3}/same name.txt" if i % 2 else f"many/{i % 3}/{i}.txt" for i in range(60)]
+        for rel in self.many:
+            os.makedirs(os.path.dirname(f"{TEST_DIR}/{rel}"), exist_ok=True)
+            with open(f"{TEST_DIR}/{rel}", "w") as fo:
+                fo.write(rel)
+        self.many = sorted(set(self.many))
+        return super().setUp()
+
+    def tearDown(self):
+        self.env.stop()
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        return super().tearDown()
+
+    def test_bulk_trash_and_recover(self):
+        ret, recover = FileOperation.executer([("moveAllToTrash", TEST_DIR, self.many + ["inexist.txt"])])
+        self.assertTrue(ret)
+        self.assertEqual(len(recover), len(self.many))
+        self.assertFalse(any(os.path.exists(f"{TEST_DIR}/{rel}") for rel in self.many))
+        self.assertEqual(len(os.listdir(f"{self.trashDir}/files")), len(self.many))
+        self.assertEqual(len(os.listdir(f"{self.trashDir}/info")), len(self.many))
+        with open(f"{self.trashDir}/{TRASH_INDEX_NAME}") as f:
+            self.assertEqual(len(f.readlines()), len(self.many))
+        self.assertEqual(len(TrashBin.entries(self.trashDir)), len(self.many))
+
+        self.assertTrue(FileOperation.executer(recover)[0])
+        self.assertTrue(all(os.path.isfile(f"{TEST_DIR}/{rel}") for rel in self.many))
+
+    def test_restore_by_original_path(self):
+        ret, _ = FileOperation.moveToTrash(TEST_DIR, "a")
+        self.assertEqual(ret, FileOperation.ErrorCode.OK)
+        with open(f"{TEST_DIR}/a", "w") as fo:
+            fo.write("a file in place of the trashed dir")
+        self.assertFalse(TrashBin.restore(f"{TEST_DIR}/a"))  # a exists again
+        os.remove(f"{TEST_DIR}/a")
+
+        TrashBin._indexes.clear()  # what another process finds: the index file only
+        with mock.patch("os.listdir", side_effect=AssertionError("no scan")):
+            self.assertTrue(TrashBin.restore(f"{TEST_DIR}/a"))
+        self.assertTrue(os.path.isfile(f"{TEST_DIR}/a/a1/a2/a3.txt"))
+        self.assertEqual(os.listdir(f"{self.trashDir}/info"), list())
+        self.assertIsNone(TrashBin.lookup(f"{TEST_DIR}/a"))
+
+    def test_purge_by_age_and_size(self):
+        self.assertEqual(TrashBin.trash([f"{TEST_DIR}/a", f"{TEST_DIR}/a.txt"])[1], f"{self.trashDir}/files/a.txt")
+        later = time.time() + 3600
+        with mock.patch("time.time", return_value=later):  # an hour after a and a.txt
+            TrashBin.trash([f"{TEST_DIR}/{rel}" for rel in self.many])
+            sizes = {e.name: e.size for e in TrashBin.entries(self.trashDir)}
+            self.assertIsNone(sizes["a"])  # a dir is summed when purged
+            stats = TrashBin.purge(self.trashDir, maxAgeSeconds=1800)
+        self.assertEqual(stats.entries, 2)
+        self.assertFalse(os.path.lexists(f"{self.trashDir}/files/a"))
+        self.assertIsNone(TrashBin.lookup(f"{TEST_DIR}/a.txt"))
+
+        total = sum(e.size for e in TrashBin.entries(self.trashDir))
+        stats = TrashBin.purge(self.trashDir, maxBytes=total // 2)
+        rest = TrashBin.entries(self.trashDir)
+        self.assertLessEqual(sum(e.size for e in rest), total // 2)
+        self.assertEqual(stats.bytesRemoved + sum(e.size for e in rest), total)
+        self.assertEqual(len(os.listdir(f"{self.trashDir}/files")), len(rest))
+
+    def test_records_appended_by_another_process(self):
+        self.assertTrue(TrashBin.trash([f"{TEST_DIR}/a.txt"])[0])
+        self.assertIsNotNone(TrashBin.lookup(f"{TEST_DIR}/a.txt"))  # the index is loaded
+
+        def trashOutside(name: str) -> None:
+            with open(f"{self.trashDir}/files/{name}", "w") as fo:
+                fo.write(name)
+            with open(f"{self.trashDir}/{TRASH_INDEX_NAME}", "a") as fo:
+                fo.write(json.dumps({"o": f"{TEST_DIR}/{name}", "n": name, "d": time.time(), "s": 1}) + "\n")
+
+        trashOutside("x.txt")
+        self.assertEqual(TrashBin.lookup(f"{TEST_DIR}/x.txt"), (self.trashDir, TrashBin.entries(self.trashDir)[-1]))
+        trashOutside("y.txt")
+        TrashBin._indexes[self.trashDir].rewrite()  # compaction without a lookup first
+        TrashBin._indexes.clear()
+        self.assertEqual(sorted(e.name for e in TrashBin.entries(self.trashDir)), ["a.txt", "x.txt", "y.txt"])
+
+
+if __name__ == "__main__":
+    unittest.main()
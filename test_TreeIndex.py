@@ -0,0 +1,155 @@
+from PySide2.QtCore import QDir, QFileInfo
+from unittest import mock
+import os
+import shutil
+import unittest
+
+from CopyEngine import CopyEngine, CopyStats
+from FileOperation import FileOperation
+from StagedDelete import StagingArea, StagingReaper, StagingUnavailable
+from TreeIndex import TreeIndex
+
+TEST_SRC_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/DONT_CHANGE")
+TEST_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/COPY_REMOVABLE")
+
+
+class TreeIndexTest(unittest.TestCase):
+    def setUp(self) -> None:
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        shutil.copytree(TEST_SRC_DIR, TEST_DIR)
+        StagingArea.register(os.path.join(TEST_DIR, StagingArea.STAGING_DIR_NAME))
+        self.env = mock.patch.dict(os.environ, {"XDG_CACHE_HOME": f"{TEST_DIR}/.cache"})
+        self.env.start()
+        self.to = f"{TEST_DIR}/b"
+        return super().setUp()
+
+    def tearDown(self):
+        self.env.stop()
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        return super().tearDown()
+
+    def indexPath(self, dst: str) -> str:
+        return os.path.join(TreeIndex.IndexDir(), TreeIndex.IndexName(dst))
+
+    def read(self, pth: str) -> str:
+        with open(pth) as f:
+            return f.read()
+
+    def write(self, pth: str, content: str) -> None:
+        with open(pth, "w") as f:
+            f.write(content)
+
+    def test_scan_save_load(self):
+        index = TreeIndex.Scan(f"{TEST_DIR}/a")
+        self.assertEqual(index.dirs, {"a1", "a1/a2"})
+        self.assertEqual(set(index.files), {"a1.txt", "a1/a2.txt", "a1/a2/a3.txt"})
+        st = os.stat(f"{TEST_DIR}/a/a1.txt")
+        self.assertEqual(index.files["a1.txt"], (st.st_size, st.st_mtime_ns, st.st_ino))
+        indexPath = f"{TEST_DIR}/index.json"
+        index.save(indexPath)
+        loaded = TreeIndex.Load(indexPath)
+        self.assertEqual((loaded.src, loaded.dirs, loaded.files), (index.src, index.dirs, index.files))
+        self.write(indexPath, "{torn")
+        self.assertIsNone(TreeIndex.Load(indexPath))
+        self.assertIsNone(TreeIndex.Load(f"{TEST_DIR}/inexist.json"))
+
+    def test_first_sync_is_a_copy(self):
+        ret, aBatch = FileOperation.syncdir(TEST_DIR, "a", self.to)
+        self.assertEqual(ret, FileOperation.ErrorCode.OK)
+        self.assertEqual(self.read(f"{self.to}/a/a1/a2/a3.txt"), self.read(f"{TEST_DIR}/a/a1/a2/a3.txt"))
+        self.assertTrue(os.path.isfile(self.indexPath(f"{self.to}/a")))
+        self.assertEqual(sorted(os.listdir(f"{self.to}/a")), ["a1", "a1.txt"], "nothing but the copy in the tree")
+
+        recoverRet, _ = FileOperation.executer(aBatch[::-1])
+        self.assertTrue(recoverRet, "Recover progress should succeed.")
+        self.assertFalse(QDir(TEST_DIR).exists("b/a"), "should recover")
+
+    def test_sync_copies_only_changes(self):
+        FileOperation.syncdir(TEST_DIR, "a", self.to)
+        firstIndex = TreeIndex.Load(self.indexPath(f"{self.to}/a"))
+        self.write(f"{TEST_DIR}/a/a1.txt", "changed content")
+        self.write(f"{TEST_DIR}/a/a1/added.txt", "added")
+        os.remove(f"{TEST_DIR}/a/a1/a2.txt")
+        copyStats = CopyStats()
+        with mock.patch.object(CopyEngine, "upToDate", wraps=CopyEngine.upToDate) as upToDate:
+            ret, aBatch = FileOperation.syncdir(TEST_DIR, "a", self.to, copyStats=copyStats)
+        self.assertEqual(ret, FileOperation.ErrorCode.OK)
+        self.assertEqual(copyStats.files, 2)
+        self.assertEqual(upToDate.call_count, 1, "unchanged files are not compared at all")
+        self.assertEqual(self.read(f"{self.to}/a/a1.txt"), "changed content")
+        self.assertEqual(self.read(f"{self.to}/a/a1/added.txt"), "added")
+        self.assertTrue(os.path.exists(f"{self.to}/a/a1/a2.txt"), "kept without delete")
+
+        ret, deleteBatch = FileOperation.syncdir(TEST_DIR, "a", self.to, delete=True)
+        self.assertEqual(ret, FileOperation.ErrorCode.OK)
+        self.assertFalse(os.path.exists(f"{self.to}/a/a1/a2.txt"))
+        ret, nothing = FileOperation.syncdir(TEST_DIR, "a", self.to, copyStats=copyStats)
+        self.assertEqual([cmd[0] for cmd in nothing], ["rename", "rmfile"], "only the index is replaced")
+        self.assertEqual(copyStats.files, 2)
+
+        for batch in (nothing, deleteBatch, aBatch):
+            recoverRet, _ = FileOperation.executer(batch[::-1])
+            self.assertTrue(recoverRet, "Recover progress should succeed.")
+        self.assertEqual(self.read(f"{self.to}/a/a1.txt"), self.read(f"{TEST_SRC_DIR}/a/a1.txt"), "old content back")
+        self.assertFalse(os.path.exists(f"{self.to}/a/a1/added.txt"))
+        self.assertTrue(os.path.exists(f"{self.to}/a/a1/a2.txt"))
+        self.assertEqual(TreeIndex.Load(self.indexPath(f"{self.to}/a")).files, firstIndex.files, "old index back")
+
+    def test_sync_without_index_compares_destination(self):
+        FileOperation.cpdir(TEST_DIR, "a", self.to)
+        self.write(f"{self.to}/a/extra.txt", "only in destination")
+        copyStats = CopyStats()
+        ret, aBatch = FileOperation.syncdir(TEST_DIR, "a", self.to, delete=True, copyStats=copyStats)
+        self.assertEqual(ret, FileOperation.ErrorCode.OK)
+        self.assertEqual(copyStats.files, 0, "cpdir copies keep size and mtime")
+        self.assertFalse(os.path.exists(f"{self.to}/a/extra.txt"))
+        recoverRet, _ = FileOperation.executer(aBatch[::-1])
+        self.assertTrue(recoverRet, "Recover progress should succeed.")
+        self.assertEqual(self.read(f"{self.to}/a/extra.txt"), "only in destination")
+        self.assertFalse(os.path.exists(self.indexPath(f"{self.to}/a")))
+
+    def test_staged_entries_pinned_until_the_batch_ends(self):
+        FileOperation.syncdir(TEST_DIR, "a", self.to)
+        os.remove(f"{TEST_DIR}/a/a1.txt")
+        stagingDir = os.path.join(TEST_DIR, StagingArea.STAGING_DIR_NAME)
+        reaper = StagingReaper(retentionSeconds=0)
+
+        def reapWhileSyncing(pre: str, rel: str, to: str, delete: bool = False, *args) -> tuple:
+            ret = FileOperation.syncdir(pre, rel, to, delete, *args)
+            self.assertEqual(reaper.reapOnce(), 0, "pinned while the batch runs")
+            return ret
+
+        with mock.patch.dict(FileOperation.LambdaTable, {"syncdir": reapWhileSyncing}):
+            ret, recover = FileOperation.executer([("syncdir", TEST_DIR, "a", self.to, True)])
+        self.assertTrue(ret)
+        self.assertEqual(StagingArea.pins(stagingDir), dict(), "released when the batch ends")
+        recoverRet, _ = FileOperation.executer(recover)
+        self.assertTrue(recoverRet, "Recover progress should succeed.")
+        self.assertEqual(self.read(f"{self.to}/a/a1.txt"), self.read(f"{TEST_SRC_DIR}/a/a1.txt"))
+
+    def test_no_staging_dir_refuses_to_sync(self):
+        FileOperation.syncdir(TEST_DIR, "a", self.to)
+        self.write(f"{TEST_DIR}/a/a1.txt", "changed content")
+        before = self.read(f"{self.to}/a/a1.txt")
+        with mock.patch.object(StagingArea, "StagingDirFor", side_effect=StagingUnavailable("no staging dir")):
+            ret, aBatch = FileOperation.syncdir(TEST_DIR, "a", self.to, delete=True)
+        self.assertEqual((ret, list(aBatch)), (FileOperation.ErrorCode.STAGING_UNAVAILABLE, list()))
+        self.assertEqual(self.read(f"{self.to}/a/a1.txt"), before, "nothing replaced without its undo")
+
+    def test_file_replaced_by_dir(self):
+        FileOperation.syncdir(TEST_DIR, "a", self.to)
+        os.remove(f"{TEST_DIR}/a/a1.txt")
+        os.mkdir(f"{TEST_DIR}/a/a1.txt")
+        self.write(f"{TEST_DIR}/a/a1.txt/inside.txt", "inside")
+        ret, aBatch = FileOperation.syncdir(TEST_DIR, "a", self.to)
+        self.assertEqual(ret, FileOperation.ErrorCode.OK)
+        self.assertEqual(self.read(f"{self.to}/a/a1.txt/inside.txt"), "inside")
+        recoverRet, _ = FileOperation.executer(aBatch[::-1])
+        self.assertTrue(recoverRet, "Recover progress should succeed.")
+        self.assertEqual(self.read(f"{self.to}/a/a1.txt"), self.read(f"{TEST_SRC_DIR}/a/a1.txt"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+from PySide2.QtCore import QDir, QFileInfo
+from unittest import mock
+import os
+import shutil
+import unittest
+
+import VerifyEngine as VerifyEngineModule
+from CopyEngine import CopyEngine, CopyResult
+from FileOperation import FileOperation
+from VerifyEngine import ChecksumManifest, Mismatch, VerifyEngine
+
+TEST_SRC_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/DONT_CHANGE")
+TEST_DIR = QDir(QFileInfo(__file__).absolutePath()).absoluteFilePath("FileOperationTestEnv/COPY_REMOVABLE")
+
+
+class VerifyEngineTest(unittest.TestCase):
+    def setUp(self) -> None:
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        shutil.copytree(TEST_SRC_DIR, TEST_DIR)
+        for i in range(6):
+            with open(f"{TEST_DIR}/a/a1/data{i}.bin", "wb") as f:
+                f.write(os.urandom(100000 + i))
+        self.rels = ["a1.txt", "a1/a2.txt", "a1/a2/a3.txt"] + [f"a1/data{i}.bin" for i in range(6)]
+        self.manifest = f"{TEST_DIR}/manifest.json"
+        return super().setUp()
+
+    def tearDown(self):
+        if QDir(TEST_DIR).exists():
+            QDir(TEST_DIR).removeRecursively()
+        return super().tearDown()
+
+    def copied(self) -> str:
+        ret, _ = FileOperation.cpdir(TEST_DIR, "a", f"{TEST_DIR}/b")
+        self.assertEqual(ret, FileOperation.ErrorCode.OK)
+        return f"{TEST_DIR}/b/a"
+
+    def test_verify_on_thread_pool(self):
+        dst = self.copied()
+        with mock.patch.object(VerifyEngineModule, "VERIFY_INLINE_BYTES", 0):
+            report = VerifyEngine.verifyTree(f"{TEST_DIR}/a", dst, self.rels, workers=2)
+        self.assertTrue(report.ok)
+        self.assertEqual(report.filesHashed, 2 * len(self.rels))
+
+    def test_mismatches(self):
+        dst = self.copied()
+        with open(f"{dst}/a1/data0.bin", "r+b") as f:
+            f.write(b"same size, other bytes")
+        with open(f"{dst}/a1/data1.bin", "ab") as f:
+            f.write(b"longer")
+        os.remove(f"{dst}/a1/data2.bin")
+        report = VerifyEngine.verifyTree(f"{TEST_DIR}/a", dst, self.rels, workers=1)
+        self.assertFalse(report.ok)
+        self.assertEqual(report.mismatches, [Mismatch("a1/data0.bin", VerifyEngine.CHECKSUM),
+                                             Mismatch("a1/data1.bin", VerifyEngine.SIZE),
+                                             Mismatch("a1/data2.bin", VerifyEngine.UNREADABLE)])
+
+    def test_manifest_skips_unchanged_files(self):
+        dst = self.copied()
+        report = VerifyEngine.verifyTree(f"{TEST_DIR}/a", dst, self.rels, self.manifest)
+        self.assertTrue(report.ok)
+        self.assertEqual(len(ChecksumManifest.Load(self.manifest).files), len(self.rels))
+        report = VerifyEngine.verifyTree(f"{TEST_DIR}/a", dst, self.rels, self.manifest)
+        self.assertEqual((report.ok, report.filesHashed, report.bytesHashed), (True, 0, 0))
+
+        os.utime(f"{dst}/a1/data3.bin", ns=(0, 0))  # only the destination side is read again
+        report = VerifyEngine.verifyTree(f"{TEST_DIR}/a", dst, self.rels, self.manifest)
+        self.assertEqual((report.ok, report.filesHashed), (True, 1))
+        with open(f"{dst}/a1/data4.bin", "r+b") as f:
+            f.write(b"corrupted")
+        report = VerifyEngine.verifyTree(f"{TEST_DIR}/a", dst, self.rels, self.manifest)
+        self.assertEqual(report.mismatches, [Mismatch("a1/data4.bin", VerifyEngine.CHECKSUM)])
+
+    def test_cpdir_and_cpfile_verify(self):
+        ret, aBatch = FileOperation.cpdir(TEST_DIR, "a", f"{TEST_DIR}/b", verify=True, manifestPath=self.manifest)
+        self.assertEqual(ret, FileOperation.ErrorCode.OK)
+        self.assertTrue(os.path.isfile(self.manifest))
+
+        copyFile = CopyEngine.copyFile
+
+        def corrupt(src: str, dst: str, reflink: bool = False) -> CopyResult:
+            ret = copyFile(src, dst, reflink)
+            with open(dst, "r+b") as f:
+                f.write(b"X")
+            return ret
+
+        with mock.patch.object(CopyEngine, "copyFile", side_effect=corrupt):
+            ret, aBatch = FileOperation.cpfile(TEST_DIR, "a/a1/data5.bin", f"{TEST_DIR}/b/b1", verify=True)
+        self.assertEqual(ret, FileOperation.ErrorCode.CHECKSUM_MISMATCH)
+        self.assertEqual(aBatch[-1], ("rmfile", f"{TEST_DIR}/b/b1", "a/a1/data5.bin"), "the bad copy can be undone")
+
+
+if __name__ == "__main__":
+    unittest.main()